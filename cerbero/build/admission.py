@@ -0,0 +1,203 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+def available_memory():
+    '''
+    Gets the memory available for new processes
+
+    @return: the available memory in KB, or None if it's not known
+    @rtype: int
+    '''
+    try:
+        meminfo = {}
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                meminfo[key] = int(value.split()[0])
+        if 'MemAvailable' in meminfo:
+            return meminfo['MemAvailable']
+        # kernels older than 3.14
+        return meminfo['MemFree'] + meminfo.get('Cached', 0)
+    except (IOError, ValueError, KeyError):
+        pass
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 1024
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def system_load():
+    '''
+    Gets the system load average of the last minute
+
+    @return: the load average, or None if it's not known
+    @rtype: float
+    '''
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+def format_memory(kbytes):
+    return '%.1f GB' % (float(kbytes) / 1024 / 1024)
+
+
+class AdmissionControl (object):
+    '''
+    Decides when a recipe can start being built and how many make jobs it
+    can run, so that the recipes built at the same time fit in the memory
+    available and don't overload the system.
+
+    The memory a recipe needs is the peak RSS of its commands measured in
+    previous builds, which is the memory used by its heaviest job, like a
+    link, or the memory_hint of the recipe when it was never measured.
+    Recipes with no estimate are never delayed.
+
+    @ivar memory: memory budget of the build in KB, or None for no limit
+    @type memory: int
+    @ivar max_load: maximum load average to start new recipes, or None for
+                    no limit
+    @type max_load: float
+    @ivar jobs: number of make jobs a recipe runs without limits
+    @type jobs: int
+    @ivar estimates: recipe name -> memory needed by a job in KB
+    @type estimates: dict
+    '''
+
+    def __init__(self, memory=None, max_load=None, jobs=1, estimates=None):
+        self.memory = memory
+        self.max_load = max_load
+        self.jobs = jobs
+        self.estimates = estimates or {}
+        self._running = set()
+        self._delayed = set()
+
+    @staticmethod
+    def from_config(config, recipes, metrics=None):
+        '''
+        Creates the admission control of a build
+
+        @param config: the build configuration
+        @type config: L{cerbero.config.Config}
+        @param recipes: recipes of the build
+        @type recipes: list
+        @param metrics: database with the peak memory of previous builds
+        @type metrics: L{cerbero.build.metrics.MetricsDB}
+        '''
+        estimates = {}
+        peaks = {}
+        if metrics is not None:
+            peaks = metrics.peak_memory()
+        for recipe in recipes:
+            hint = getattr(recipe, 'memory_hint', None)
+            if recipe.name in peaks:
+                estimates[recipe.name] = peaks[recipe.name]
+            elif hint:
+                estimates[recipe.name] = hint * 1024
+        memory = getattr(config, 'max_memory', None)
+        if memory is not None:
+            memory = memory * 1024
+        else:
+            memory = available_memory()
+        jobs = 1
+        if config.allow_parallel_build:
+            jobs = config.num_of_cpus
+        return AdmissionControl(memory, getattr(config, 'max_load', None),
+                                jobs, estimates)
+
+    def admit(self, name):
+        '''
+        Whether a recipe can start being built now. A recipe is always
+        admitted when no other recipe is being built, or the build could
+        never finish.
+
+        @param name: name of the recipe
+        @type name: str
+        @return: True if the recipe can be started
+        @rtype: bool
+        '''
+        reason = None
+        estimate = self.estimates.get(name)
+        if not self._running:
+            pass
+        elif estimate and self.memory is not None and \
+                estimate > self._free_memory():
+            reason = _("it needs %s of memory and %s are free") % \
+                (format_memory(estimate), format_memory(self._free_memory()))
+        elif self.max_load is not None:
+            load = system_load()
+            if load is not None and load > self.max_load:
+                reason = _("the system load %.1f is over %.1f") % \
+                    (load, self.max_load)
+        if reason is not None:
+            # Logged once, the recipe is checked again each time the
+            # scheduler looks for recipes to start
+            if name not in self._delayed:
+                m.message(_("Delaying the build of %s, %s") % (name, reason))
+                self._delayed.add(name)
+            return False
+        if name in self._delayed:
+            m.message(_("Resuming the build of %s") % name)
+            self._delayed.remove(name)
+        return True
+
+    def start(self, name):
+        '''
+        Records that a recipe started being built
+        '''
+        self._running.add(name)
+
+    def finish(self, name):
+        '''
+        Records that a recipe finished being built
+        '''
+        self._running.discard(name)
+
+    def make_jobs(self, name):
+        '''
+        Gets the number of make jobs a recipe can run with the memory left
+        by the other recipes being built
+
+        @param name: name of the recipe
+        @type name: str
+        @return: the number of jobs, or None if it doesn't need to be limited
+        @rtype: int
+        '''
+        estimate = self.estimates.get(name)
+        if not estimate or self.memory is None:
+            return None
+        free = self._free_memory(exclude=name)
+        jobs = max(1, int(free / estimate))
+        if jobs >= self.jobs:
+            return None
+        m.message(_("Limiting %s to %d make jobs, each one can use up to "
+                    "%s of memory and %s are free") % (name, jobs,
+                  format_memory(estimate), format_memory(max(free, 0))))
+        return jobs
+
+    def _free_memory(self, exclude=None):
+        used = sum([self.estimates.get(x, 0) for x in self._running
+                    if x != exclude])
+        return self.memory - used
@@ -0,0 +1,620 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import os
+import json
+import time
+import shutil
+import socket
+import hashlib
+import httplib
+import tarfile
+import tempfile
+import urlparse
+from multiprocessing.pool import ThreadPool
+
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+# Configuration properties affecting the binaries built by a recipe
+KEY_PROPERTIES = ['target_platform', 'target_arch', 'target_distro',
+                  'target_distro_version', 'prefix', 'lib_suffix',
+                  'py_prefix', 'host', 'build', 'target', 'toolchain_prefix',
+                  'min_osx_sdk_version', 'osx_target_sdk_version',
+                  'ios_platform', 'target_arch_flags', 'allow_system_libs']
+
+
+# Number of entries downloaded at the same time from the remote cache
+DOWNLOAD_JOBS = 4
+
+
+def _publish(fileobj, path):
+    '''
+    Writes the contents of a file object to a path atomically, so that
+    readers never see an incomplete file
+    '''
+    dirname = os.path.dirname(path)
+    if not os.path.exists(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # created in the meantime by another builder
+            if not os.path.isdir(dirname):
+                raise
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(fileobj, f)
+        os.chmod(tmp, 0644)
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+
+class CacheBackend (object):
+    '''
+    Storage of the artifacts cache entries.
+
+    Entries are files identified by a relative path. Backends must publish
+    them atomically, as they can be shared by several builders at the same
+    time.
+    '''
+
+    def exists(self, name):
+        '''
+        Checks if an entry exists
+
+        @param name: name of the entry
+        @type name: str
+        @rtype: bool
+        '''
+        raise NotImplementedError
+
+    def get(self, name, path):
+        '''
+        Downloads an entry to a local file
+
+        @param name: name of the entry
+        @type name: str
+        @param path: destination path
+        @type path: str
+        @return: False if the entry does not exist
+        @rtype: bool
+        '''
+        raise NotImplementedError
+
+    def put(self, path, name):
+        '''
+        Uploads a local file as an entry
+
+        @param path: path of the file to upload
+        @type path: str
+        @param name: name of the entry
+        @type name: str
+        '''
+        raise NotImplementedError
+
+
+class DirectoryBackend (CacheBackend):
+    '''
+    Backend storing the entries in a directory, that can be shared between
+    builders using a network filesystem
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self, name):
+        return os.path.exists(self.filepath(name))
+
+    def get(self, name, path):
+        try:
+            src = open(self.filepath(name), 'rb')
+        except IOError:
+            return False
+        with src:
+            _publish(src, path)
+        return True
+
+    def put(self, path, name):
+        with open(path, 'rb') as src:
+            _publish(src, self.filepath(name))
+
+    def filepath(self, name):
+        return os.path.join(self.path, name)
+
+
+class HTTPBackend (CacheBackend):
+    '''
+    Backend storing the entries in an HTTP server supporting GET and PUT,
+    such as a WebDAV share
+    '''
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        parsed = urlparse.urlparse(self.url)
+        if parsed.scheme == 'https':
+            self._connection_class = httplib.HTTPSConnection
+        else:
+            self._connection_class = httplib.HTTPConnection
+        self._netloc = parsed.netloc
+        self._path = parsed.path
+
+    def exists(self, name):
+        response = self._request('HEAD', name)
+        response.read()
+        return response.status == 200
+
+    def get(self, name, path):
+        response = self._request('GET', name)
+        if response.status == 404:
+            response.read()
+            return False
+        if response.status != 200:
+            raise IOError(_('Error downloading %s/%s: %s %s') %
+                          (self.url, name, response.status, response.reason))
+        _publish(response, path)
+        return True
+
+    def put(self, path, name):
+        with open(path, 'rb') as f:
+            response = self._request('PUT', name, f,
+                                     {'Content-Length': os.path.getsize(path)})
+        response.read()
+        if response.status not in [200, 201, 204]:
+            raise IOError(_('Error uploading %s/%s: %s %s') %
+                          (self.url, name, response.status, response.reason))
+
+    def _request(self, method, name, body=None, headers={}):
+        conn = self._connection_class(self._netloc, timeout=60)
+        conn.request(method, '%s/%s' % (self._path, name), body, headers)
+        return conn.getresponse()
+
+
+def get_backend(url):
+    '''
+    Gets the backend for the remote cache at the given location
+
+    @param url: an http(s) URL or the path of a directory
+    @type url: str
+    @return: the backend
+    @rtype: L{CacheBackend}
+    '''
+    scheme = urlparse.urlparse(url).scheme
+    if scheme in ['http', 'https']:
+        return HTTPBackend(url)
+    if scheme == 'file':
+        return DirectoryBackend(urlparse.urlparse(url).path)
+    return DirectoryBackend(url)
+
+
+class LocalCache (DirectoryBackend):
+    '''
+    Local tier of the artifacts cache, bounded in size by evicting the
+    least recently used entries
+
+    @ivar max_size: maximum size of the cache in bytes, None for no limit
+    @type max_size: int
+    '''
+
+    def __init__(self, path, max_size=None):
+        DirectoryBackend.__init__(self, path)
+        self.max_size = max_size
+
+    def touch(self, name):
+        '''
+        Marks an entry as recently used
+        '''
+        try:
+            os.utime(self.filepath(name), None)
+        except OSError:
+            pass
+
+    def entries(self):
+        '''
+        Lists the entries of the cache
+
+        @return: list of (key, size in bytes, last use time) for each entry,
+                 least recently used first
+        @rtype: list
+        '''
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+        for dirname in os.listdir(self.path):
+            dirpath = os.path.join(self.path, dirname)
+            if not os.path.isdir(dirpath):
+                continue
+            for f in os.listdir(dirpath):
+                if not f.endswith('.tar.gz'):
+                    continue
+                key = f[:-len('.tar.gz')]
+                try:
+                    st = os.stat(os.path.join(dirpath, f))
+                except OSError:
+                    continue
+                size = st.st_size
+                metadata = os.path.join(dirpath, '%s.json' % key)
+                if os.path.exists(metadata):
+                    size += os.path.getsize(metadata)
+                entries.append((key, size, st.st_mtime))
+        return sorted(entries, key=lambda x: x[2])
+
+    def size(self):
+        return sum([x[1] for x in self.entries()])
+
+    def prune(self, max_size=None):
+        '''
+        Removes the least recently used entries until the cache fits in
+        the given size
+
+        @param max_size: size in bytes, defaults to the size of the cache
+        @type max_size: int
+        @return: list of the keys removed
+        @rtype: list
+        '''
+        if max_size is None:
+            max_size = self.max_size
+        if max_size is None:
+            return []
+        entries = self.entries()
+        size = sum([x[1] for x in entries])
+        removed = []
+        for key, entry_size, atime in entries:
+            if size <= max_size:
+                break
+            for name in [entry_name(key), metadata_name(key)]:
+                try:
+                    os.remove(self.filepath(name))
+                except OSError:
+                    pass
+            size -= entry_size
+            removed.append(key)
+        return removed
+
+
+def entry_name(key):
+    return '%s/%s.tar.gz' % (key[:2], key)
+
+
+def metadata_name(key):
+    return '%s/%s.json' % (key[:2], key)
+
+
+def unsafe_member(tf, prefix):
+    '''
+    Looks for members of an archive that would be extracted outside a
+    directory: absolute paths, paths with '..' components, links pointing
+    outside it and special files
+
+    @param tf: the archive
+    @type tf: L{tarfile.TarFile}
+    @param prefix: directory where the archive is extracted
+    @type prefix: str
+    @return: the name of the first unsafe member, or None if all are safe
+    @rtype: str
+    '''
+    prefix = os.path.normpath(os.path.abspath(prefix))
+
+    def inside(path):
+        path = os.path.normpath(os.path.join(prefix, path))
+        return path == prefix or path.startswith(prefix + os.sep)
+
+    for member in tf.getmembers():
+        name = member.name
+        if os.path.isabs(name) or '..' in name.replace('\\', '/').split('/'):
+            return name
+        if not (member.isfile() or member.isdir() or member.issym() or
+                member.islnk()):
+            return name
+        if member.issym():
+            target = member.linkname
+            if not os.path.isabs(target):
+                target = os.path.join(os.path.dirname(name), target)
+            if not inside(target):
+                return name
+        if member.islnk() and (os.path.isabs(member.linkname) or
+                               not inside(member.linkname)):
+            return name
+    return None
+
+
+class ArtifactsCache (object):
+    '''
+    Content-addressed cache of the files installed by each recipe.
+
+    Entries are keyed by a hash of the recipe file and its patches, the
+    built version of its sources, the configuration properties affecting
+    the build and the keys of all its dependencies, so that a recipe is
+    only restored from the cache if it would produce the same binaries.
+
+    Entries are looked up in a local cache first and then in the remote
+    cache, if any, which is shared between builders. Recipes built locally
+    are published in both.
+
+    @ivar cookbook: cookbook with the recipes
+    @type cookbook: L{cerbero.build.cookbook.CookBook}
+    @ivar local: local tier of the cache
+    @type local: L{LocalCache}
+    @ivar remote: remote tier of the cache
+    @type remote: L{CacheBackend}
+    @ivar hits: number of recipes restored from the cache
+    @type hits: int
+    @ivar misses: number of recipes not found in the cache
+    @type misses: int
+    @ivar saved_time: build time saved restoring recipes, in seconds
+    @type saved_time: float
+    '''
+
+    def __init__(self, cookbook, cache_dir, max_size=None, remote=None):
+        '''
+        @param cookbook: cookbook with the recipes
+        @type cookbook: L{cerbero.build.cookbook.CookBook}
+        @param cache_dir: directory of the local cache
+        @type cache_dir: str
+        @param max_size: maximum size of the local cache in bytes
+        @type max_size: int
+        @param remote: backend of the remote cache
+        @type remote: L{CacheBackend}
+        '''
+        self.cookbook = cookbook
+        self.config = cookbook.get_config()
+        self.local = LocalCache(cache_dir, max_size)
+        self.remote = remote
+        self._keys = {}
+        self.reset_stats()
+
+    @staticmethod
+    def from_config(cookbook):
+        '''
+        Creates the artifacts cache configured for a cookbook
+
+        @return: the cache or None if it's not enabled
+        @rtype: L{ArtifactsCache}
+        '''
+        config = cookbook.get_config()
+        cache_dir = getattr(config, 'artifacts_cache', None)
+        if not cache_dir:
+            return None
+        max_size = getattr(config, 'artifacts_cache_size', None)
+        if max_size is not None:
+            max_size = int(max_size * 1024 * 1024)
+        remote = getattr(config, 'artifacts_remote', None)
+        if remote:
+            remote = get_backend(remote)
+        return ArtifactsCache(cookbook, cache_dir, max_size, remote or None)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.saved_time = 0.0
+
+    def add_stats(self, hits, misses, saved_time):
+        self.hits += hits
+        self.misses += misses
+        self.saved_time += saved_time
+
+    def get_stats(self):
+        return (self.hits, self.misses, self.saved_time)
+
+    def print_stats(self):
+        if self.hits == 0 and self.misses == 0:
+            return
+        m.message(_("Artifacts cache: %d hits, %d misses, %.0f seconds "
+                    "saved") % (self.hits, self.misses, self.saved_time))
+
+    def recipe_key(self, recipe):
+        '''
+        Gets the key of a recipe in the cache
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @return: the key or None if it can't be computed yet, for instance
+                 because the sources were not fetched
+        @rtype: str
+        '''
+        return self._key(recipe, self._keys)
+
+    def download(self, recipes, jobs=DOWNLOAD_JOBS):
+        '''
+        Downloads concurrently from the remote cache the entries of a list
+        of recipes that can be already computed
+
+        @param recipes: list of recipes
+        @type recipes: list
+        @param jobs: number of concurrent downloads
+        @type jobs: int
+        '''
+        if self.remote is None:
+            return
+        # The keys are computed before the sources are fetched, when the
+        # revision of git recipes can still change, so they are not kept
+        keys = {}
+        keys = [self._key(r, keys) for r in recipes]
+        keys = [k for k in keys if k is not None and
+                not self.local.exists(entry_name(k))]
+        if not keys:
+            return
+        m.action(_("Looking up %d recipes in the remote artifacts cache") %
+                 len(keys))
+        # Transfers are I/O bound, threads are enough here
+        pool = ThreadPool(min(jobs, len(keys)))
+        try:
+            pool.map(self._download, keys)
+        finally:
+            pool.close()
+            pool.join()
+
+    def restore(self, recipe):
+        '''
+        Installs the files of a recipe from the cache, if found
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @return: True if the recipe was restored from the cache
+        @rtype: bool
+        '''
+        key = self.recipe_key(recipe)
+        if key is None or not (self.local.exists(entry_name(key)) or
+                               self._download(key)):
+            self.misses += 1
+            return False
+        start = time.time()
+        m.action(_("Restoring %s from the artifacts cache") % recipe.name)
+        self.local.touch(entry_name(key))
+        metadata = self._read_metadata(key)
+        tf = tarfile.open(self.local.filepath(entry_name(key)), 'r:*')
+        try:
+            # Entries can come from other builders, they must not write
+            # anything outside the prefix
+            unsafe = unsafe_member(tf, self.config.prefix)
+            if unsafe is not None:
+                m.warning(_("Not restoring %s from the artifacts cache, the "
+                            "entry %s has an unsafe path: %s") %
+                          (recipe.name, key, unsafe))
+                self.misses += 1
+                return False
+            tf.extractall(self.config.prefix)
+        finally:
+            tf.close()
+        self.hits += 1
+        self.saved_time += max(0, metadata.get('build_time', 0) -
+                               (time.time() - start))
+        return True
+
+    def recipe_files(self, recipe):
+        '''
+        Gets the files of a recipe stored in the cache
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @return: files relative to the prefix, or None if they are not known
+        @rtype: list
+        '''
+        key = self.recipe_key(recipe)
+        if key is None:
+            return None
+        return self._read_metadata(key).get('files')
+
+    def store(self, recipe, files, build_time):
+        '''
+        Stores the files installed by a recipe in the cache
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @param files: installed files, relative to the prefix
+        @type files: list
+        @param build_time: time spent building the recipe, in seconds
+        @type build_time: float
+        '''
+        key = self.recipe_key(recipe)
+        if key is None:
+            return
+        m.action(_("Storing %s in the artifacts cache") % recipe.name)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            tarpath = os.path.join(tmpdir, 'entry.tar.gz')
+            tf = tarfile.open(tarpath, 'w:gz')
+            try:
+                for f in sorted(files):
+                    fpath = os.path.join(self.config.prefix, f)
+                    if os.path.lexists(fpath):
+                        tf.add(fpath, f, recursive=False)
+            finally:
+                tf.close()
+            metadata = {'recipe': recipe.name, 'files': sorted(files),
+                        'build_time': build_time, 'created': time.time()}
+            metadata_path = os.path.join(tmpdir, 'entry.json')
+            with open(metadata_path, 'w') as f:
+                json.dump(metadata, f)
+            # The entry is looked up by its tarball, so publish it last
+            backends = [self.local]
+            if self.remote is not None:
+                backends.append(self.remote)
+            for backend in backends:
+                try:
+                    backend.put(metadata_path, metadata_name(key))
+                    backend.put(tarpath, entry_name(key))
+                except (IOError, OSError, socket.error,
+                        httplib.HTTPException), e:
+                    m.warning(_("Could not store %s in the artifacts "
+                                "cache: %s") % (recipe.name, e))
+        finally:
+            shutil.rmtree(tmpdir)
+        self.local.prune()
+
+    def _download(self, key):
+        if self.remote is None:
+            return False
+        try:
+            if not self.remote.get(metadata_name(key),
+                                   self.local.filepath(metadata_name(key))):
+                return False
+            return self.remote.get(entry_name(key),
+                                   self.local.filepath(entry_name(key)))
+        except (IOError, OSError, socket.error, httplib.HTTPException), e:
+            m.warning(_("Could not download %s from the remote artifacts "
+                        "cache: %s") % (key, e))
+            return False
+
+    def _key(self, recipe, keys):
+        if recipe.name in keys:
+            return keys[recipe.name]
+        key = self._compute_key(recipe, keys)
+        if key is not None:
+            keys[recipe.name] = key
+        return key
+
+    def _compute_key(self, recipe, keys):
+        h = hashlib.sha256()
+        h.update(recipe.name)
+        if hasattr(recipe, '__file__'):
+            with open(recipe.__file__, 'rb') as f:
+                h.update(f.read())
+        for patch in getattr(recipe, 'patches', []):
+            if not os.path.isabs(patch):
+                patch = recipe.relative_path(patch)
+            with open(patch, 'rb') as f:
+                h.update(f.read())
+        built_version = recipe.built_version()
+        if built_version is None and \
+                hasattr(recipe.stype, 'built_version'):
+            # The source revision can't be resolved yet
+            return None
+        h.update('%s %s' % (recipe.version, built_version))
+        for prop in KEY_PROPERTIES:
+            h.update('%s=%r' % (prop, getattr(self.config, prop, None)))
+        variants = getattr(self.config, 'variants', None)
+        if variants is not None:
+            h.update(repr(sorted(vars(variants).items())))
+        for dep in sorted(self.cookbook.list_recipe_direct_deps(recipe.name)):
+            dep_key = self._key(self.cookbook.get_recipe(dep), keys)
+            if dep_key is None:
+                return None
+            h.update('%s=%s' % (dep, dep_key))
+        return h.hexdigest()
+
+    def _read_metadata(self, key):
+        try:
+            with open(self.local.filepath(metadata_name(key)), 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
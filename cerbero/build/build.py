@@ -18,6 +18,8 @@
 
 import os
 
+from cerbero.build import jobserver
+from cerbero.build.staging import InstallStaging
 from cerbero.config import Platform, Architecture, Distro
 from cerbero.utils import shell, to_unixpath
 from cerbero.utils import messages as m
@@ -33,9 +35,13 @@ class Build (object):
     @type recipe: L{cerbero.recipe.Recipe}
     @ivar config: cerbero's configuration
     @type config: L{cerbero.config.Config}
+    @ivar installed_files: files installed by the last install, relative to
+                           the prefix, or None if they are not known
+    @type installed_files: list
     '''
 
     _properties_keys = []
+    installed_files = None
 
     def configure(self):
         '''
@@ -61,6 +67,13 @@ class Build (object):
         '''
         pass
 
+    def can_stage_install(self):
+        '''
+        Whether the install step installs the module in a staging directory
+        listing the installed files in L{installed_files}
+        '''
+        return False
+
 
 class CustomBuild(Build):
 
@@ -105,6 +118,8 @@ class MakefilesBase (Build):
     make_clean = 'make clean'
     use_system_libs = False
     allow_parallel_build = True
+    stage_install = True
+    install_prefix = None
     srcdir = '.'
     append_env = None
     new_env = None
@@ -117,8 +132,11 @@ class MakefilesBase (Build):
             self.new_env = {}
         self.make_dir = os.path.abspath(os.path.join(self.build_dir,
                                                      self.srcdir))
+        # Where it's supported, the number of jobs is given by the jobserver
+        # shared by all the recipes being built
         if self.config.allow_parallel_build and self.allow_parallel_build \
-                and self.config.num_of_cpus > 1:
+                and self.config.num_of_cpus > 1 and \
+                not jobserver.supported(self.config):
             self.make += ' -j%d' % self.config.num_of_cpus
         self._old_env = None
 
@@ -139,7 +157,28 @@ class MakefilesBase (Build):
 
     @modify_environment
     def install(self):
-        shell.call(self.make_install, self.make_dir)
+        if not self.can_stage_install():
+            shell.call(self.make_install, self.make_dir)
+            return
+        staging = InstallStaging(self)
+        staging.start()
+        try:
+            shell.call(self.make_install, self.make_dir)
+        except:
+            staging.abort()
+            raise
+        self.installed_files = staging.finish(self.install_prefix)
+
+    def can_stage_install(self):
+        # Custom install commands or methods might not support DESTDIR,
+        # recipes can also disable it with stage_install = False
+        if not self.stage_install or \
+                self.config.platform == Platform.WINDOWS:
+            return False
+        if type(self).install.im_func is not MakefilesBase.install.im_func:
+            return False
+        return 'DESTDIR' not in self.make_install and \
+            'PREFIX' not in self.make_install
 
     @modify_environment
     def clean(self):
@@ -298,12 +337,17 @@ class CMake (MakefilesBase):
         cxx = os.environ.get('CXX', 'g++')
         cflags = os.environ.get('CFLAGS', '')
         cxxflags = os.environ.get('CXXFLAGS', '')
-        # FIXME: CMake doesn't support passing "ccache $CC"
-        if self.config.use_ccache:
-            cc = cc.replace('ccache ', '')
-            cxx = cxx.replace('ccache ', '')
-        cc = cc.split(' ')[0]
-        cxx = cxx.split(' ')[0]
+        # CMake doesn't support passing "ccache $CC", the compiler cache is
+        # used as a compiler launcher
+        launcher = None
+        cc = cc.split() or ['']
+        cxx = cxx.split() or ['']
+        if cc[0] == 'ccache':
+            launcher = cc.pop(0)
+        if cxx[0] == 'ccache':
+            launcher = cxx.pop(0)
+        cc = cc[0]
+        cxx = cxx[0]
 
         if self.config.target_platform == Platform.WINDOWS:
             self.configure_options += ' -DCMAKE_SYSTEM_NAME=Windows '
@@ -318,6 +362,11 @@ class CMake (MakefilesBase):
 
         self.configure_options += ' -DCMAKE_C_COMPILER=%s ' % cc
         self.configure_options += ' -DCMAKE_CXX_COMPILER=%s ' % cxx
+        if launcher is not None:
+            self.configure_options += \
+                ' -DCMAKE_C_COMPILER_LAUNCHER=%s ' % launcher
+            self.configure_options += \
+                ' -DCMAKE_CXX_COMPILER_LAUNCHER=%s ' % launcher
         self.configure_options += ' -DCMAKE_C_FLAGS="%s"' % cflags
         self.configure_options += ' -DCMAKE_CXX_FLAGS="%s"' % cxxflags
         self.configure_options += ' -DLIB_SUFFIX=%s ' % self.config.lib_suffix
@@ -0,0 +1,164 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+from distutils.spawn import find_executable
+
+from cerbero.errors import FatalError
+from cerbero.utils import _, shell
+from cerbero.utils import messages as m
+
+
+CCACHE = 'ccache'
+STATSLOG = 'CCACHE_STATSLOG'
+
+
+def parse_stats_log(path):
+    '''
+    Counts the cache hits and misses in a ccache statistics log, which
+    lists the result of each compilation
+
+    @param path: path of the log
+    @type path: str
+    @return: number of hits and misses
+    @rtype: tuple
+    '''
+    hits = 0
+    misses = 0
+    if not os.path.exists(path):
+        return (hits, misses)
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.endswith('_cache_hit'):
+                hits += 1
+            elif line == 'cache_miss':
+                misses += 1
+    return (hits, misses)
+
+
+class CompilerCache (object):
+    '''
+    Manages the ccache compiler cache used by the builds, with a cache
+    directory per toolchain, set in the environment by the config, and
+    collects the hit rate of each recipe.
+
+    The compilations of a recipe are logged with the statistics log of
+    ccache (ccache >= 4.0), so that the hit rates are right even when
+    several recipes are built at the same time. Older versions of ccache
+    still cache the objects, but no hit rates are reported.
+
+    @ivar config: the build configuration
+    @type config: L{cerbero.config.Config}
+    @ivar stats: recipe name -> (hits, misses)
+    @type stats: dict
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.stats = {}
+
+    @staticmethod
+    def from_config(config):
+        '''
+        Creates the compiler cache of a configuration
+
+        @return: the cache or None if ccache is not used
+        @rtype: L{CompilerCache}
+        '''
+        if not getattr(config, 'use_ccache', None) or \
+                config.ccache_toolchain_dir() is None:
+            return None
+        if find_executable(CCACHE) is None:
+            m.warning(_("use_ccache is set, but %s was not found") % CCACHE)
+            return None
+        return CompilerCache(config)
+
+    def cache_dirs(self):
+        '''
+        Gets the cache directories of all the toolchains of the build, one
+        per architecture for universal builds
+        '''
+        dirs = [x.ccache_toolchain_dir() for x in
+                self.config.arch_config.values()]
+        return sorted(set([x for x in dirs if x is not None]))
+
+    def setup(self):
+        '''
+        Creates the cache directories and applies the size limit, which
+        ccache enforces cleaning up the oldest objects
+        '''
+        max_size = getattr(self.config, 'ccache_max_size', None)
+        for cache_dir in self.cache_dirs():
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            if max_size is None:
+                continue
+            try:
+                shell.call('CCACHE_DIR="%s" %s -M %dM' %
+                           (cache_dir, CCACHE, max_size))
+            except FatalError, e:
+                m.warning(_("Could not set the size of the compiler "
+                            "cache %s: %s") % (cache_dir, e))
+
+    def start_recipe(self, recipe):
+        '''
+        Starts logging the compilations of a recipe
+        '''
+        path = self._stats_log(recipe.name)
+        if os.path.exists(path):
+            os.remove(path)
+        self.config.set_build_env(STATSLOG, path)
+
+    def finish_recipe(self, recipe):
+        '''
+        Stops logging the compilations of a recipe and records its hit rate
+
+        @return: number of hits and misses of the recipe
+        @rtype: tuple
+        '''
+        self.config.set_build_env(STATSLOG, None)
+        path = self._stats_log(recipe.name)
+        stats = parse_stats_log(path)
+        if os.path.exists(path):
+            os.remove(path)
+        self.add_stats(recipe.name, *stats)
+        return stats
+
+    def add_stats(self, recipe_name, hits, misses):
+        if hits == 0 and misses == 0:
+            return
+        self.stats[recipe_name] = (hits, misses)
+
+    def print_stats(self):
+        if not self.stats:
+            return
+        hits = sum([x[0] for x in self.stats.values()])
+        misses = sum([x[1] for x in self.stats.values()])
+        m.message(_("Compiler cache: %d hits, %d misses (%.0f%% hit rate)") %
+                  (hits, misses, 100.0 * hits / (hits + misses)))
+        for name in sorted(self.stats):
+            hits, misses = self.stats[name]
+            m.message('  %-30s %6d hits %6d misses  %3.0f%%' %
+                      (name, hits, misses, 100.0 * hits / (hits + misses)))
+
+    def _stats_log(self, recipe_name):
+        logs = self.config.logs
+        if not os.path.exists(logs):
+            os.makedirs(logs)
+        return os.path.join(logs, '%s.ccache-stats' % recipe_name)
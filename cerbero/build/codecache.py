@@ -0,0 +1,121 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import imp
+import marshal
+import hashlib
+import tempfile
+
+from cerbero.config import CONFIG_DIR
+
+
+CODE_CACHE_DIR = os.path.join(CONFIG_DIR, 'code-cache')
+
+
+class CodeCache (object):
+    '''
+    Caches the compiled code of python files, such as recipes, so that they
+    are compiled only once per process and only when they change between
+    runs.
+
+    Compiled files are stored on disk with marshal, keyed by the file path
+    and validated with the file modification time and, when it changed,
+    with the hash of its contents.
+
+    @ivar cache_dir: directory where the compiled files are stored
+    @type cache_dir: str
+    '''
+
+    def __init__(self, cache_dir=CODE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._codes = {}
+
+    def get_code(self, filepath):
+        '''
+        Gets the code object of a python file
+
+        @param filepath: path of the file
+        @type filepath: str
+        @return: the compiled code
+        @rtype: code
+        '''
+        filepath = os.path.abspath(filepath)
+        mtime = os.path.getmtime(filepath)
+        if filepath in self._codes and self._codes[filepath][0] == mtime:
+            return self._codes[filepath][1]
+
+        cached = self._load(filepath)
+        if cached is not None and cached[0] == mtime:
+            code = cached[2]
+        else:
+            with open(filepath, 'rU') as f:
+                source = f.read()
+            digest = hashlib.sha1(source).hexdigest()
+            if cached is not None and cached[1] == digest:
+                # touched but not modified
+                code = cached[2]
+            else:
+                code = compile(source + '\n', filepath, 'exec')
+            self._save(filepath, mtime, digest, code)
+        self._codes[filepath] = (mtime, code)
+        return code
+
+    def _cache_path(self, filepath):
+        return os.path.join(self.cache_dir, '%s.bin' %
+                            hashlib.sha1(filepath).hexdigest())
+
+    def _load(self, filepath):
+        try:
+            with open(self._cache_path(filepath), 'rb') as f:
+                magic, path, mtime, digest, code = marshal.load(f)
+        except (IOError, EOFError, ValueError, TypeError):
+            return None
+        if magic != imp.get_magic() or path != filepath:
+            return None
+        return (mtime, digest, code)
+
+    def _save(self, filepath, mtime, digest, code):
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump((imp.get_magic(), filepath, mtime, digest, code),
+                             f)
+            cache_path = self._cache_path(filepath)
+            if os.path.exists(cache_path) and os.name == 'nt':
+                # rename does not replace existing files on Windows
+                os.remove(cache_path)
+            os.rename(tmp, cache_path)
+        except (IOError, OSError):
+            # the cache is just an optimization
+            pass
+
+
+_default_cache = None
+
+
+def default_cache():
+    '''
+    Gets the code cache shared by all the cookbooks of the process
+    '''
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = CodeCache()
+    return _default_cache
@@ -18,22 +18,36 @@
 
 from collections import defaultdict
 import os
+import re
 import pickle
+import sqlite3
+import tempfile
 import time
 import imp
 
 from cerbero.config import CONFIG_DIR, Platform, Architecture, Distro,\
     DistroVersion, License
 from cerbero.build.build import BuildType
+from cerbero.build.codecache import default_cache
+from cerbero.build.depgraph import DependencyGraph
 from cerbero.build.source import SourceType
 from cerbero.errors import FatalError, RecipeNotFoundError, InvalidRecipeError
-from cerbero.utils import _, shell, parse_file
+from cerbero.utils import _, shell
 from cerbero.utils import messages as m
 from cerbero.build import recipe as crecipe
 
 
 COOKBOOK_NAME = 'cookbook'
 COOKBOOK_FILE = os.path.join(CONFIG_DIR, COOKBOOK_NAME)
+SQLITE_HEADER = 'SQLite format 3\x00'
+
+# Matches the name of the recipe in a recipe file, so that recipes can be
+# indexed without loading them
+RECIPE_NAME_RE = re.compile(r'^\s+name\s*=\s*[\'"]([^\'"]+)[\'"]', re.M)
+
+# custom.py modules already loaded in this process
+# path -> (mtime, module)
+_custom_modules = {}
 
 
 class RecipeStatus (object):
@@ -54,16 +68,31 @@ class RecipeStatus (object):
     @type built_version: str
     @ivar file_hash: hash of the file with the recipe description
     @type file_hash: int
+    @ivar manifest: files installed by the recipe, relative to the prefix
+    @type manifest: list
+    @ivar interface: fingerprint of the public interface of the recipe
+    @type interface: str
+    @ivar deps_interfaces: fingerprints of the interfaces of the dependencies
+                           the recipe was built against
+    @type deps_interfaces: dict
+    @ivar fingerprints: fingerprints of the inputs of the steps done
+    @type fingerprints: dict
     '''
 
     def __init__(self, filepath, steps=[], needs_build=True,
-                 mtime=time.time(), built_version=None, file_hash=0):
+                 mtime=time.time(), built_version=None, file_hash=0,
+                 manifest=None, interface=None, deps_interfaces=None,
+                 fingerprints=None):
         self.steps = steps
         self.needs_build = needs_build
         self.mtime = mtime
         self.filepath = filepath
         self.built_version = built_version
         self.file_hash = file_hash
+        self.manifest = manifest
+        self.interface = interface
+        self.deps_interfaces = deps_interfaces
+        self.fingerprints = fingerprints
 
     def touch(self):
         ''' Touches the recipe updating its modification time '''
@@ -76,7 +105,14 @@ class RecipeStatus (object):
 class CookBook (object):
     '''
     Stores a list of recipes and their build status saving it's state to a
-    cache file
+    cache file.
+
+    Recipes files are indexed by the recipe name they define, and recipes
+    are only loaded when they are used, with L{get_recipe}.
+
+    The cache file is an sqlite database with a row per recipe, which is
+    updated in a transaction each time the status of a recipe changes, so
+    that several cerbero processes can share it safely.
 
     @ivar recipes: dictionary with L{cerbero.recipe.Recipe} availables
     @type recipes: dict
@@ -86,10 +122,18 @@ class CookBook (object):
 
     RECIPE_EXT = '.recipe'
 
-    def __init__(self, config, load=True):
+    def __init__(self, config, load=True, code_cache=None):
         self.set_config(config)
         self.recipes = {}  # recipe_name -> recipe
+        # recipe_name -> [(filepath, custom)], by descending priority
+        self._index = {}
+        # recipes modified since their steps were done
+        self._edited = set()
+        # recipes that might be runtime dependencies
+        self._runtime_candidates = set()
+        self._graph = DependencyGraph(self)
         self._mtimes = {}
+        self._code_cache = code_cache or default_cache()
 
         if not load:
             return
@@ -133,7 +177,6 @@ class CookBook (object):
         Reloads the recipes list and updates the cookbook
         '''
         self._load_recipes()
-        self.save()
 
     def get_recipes_list(self):
         '''
@@ -142,6 +185,7 @@ class CookBook (object):
         @return: list of recipes
         @rtype: list
         '''
+        self._load_all_recipes()
         recipes = self.recipes.values()
         recipes.sort(key=lambda x: x.name)
         return recipes
@@ -154,6 +198,7 @@ class CookBook (object):
         @type  recipe: L{cerbero.build.cookbook.Recipe}
         '''
         self.recipes[recipe.name] = recipe
+        self._graph.invalidate()
 
     def get_recipe(self, name):
         '''
@@ -162,11 +207,13 @@ class CookBook (object):
         @param name: name of the recipe
         @type name: str
         '''
+        if name not in self.recipes:
+            self._load_indexed_recipe(name)
         if name not in self.recipes:
             raise RecipeNotFoundError(name)
         return self.recipes[name]
 
-    def update_step_status(self, recipe_name, step):
+    def update_step_status(self, recipe_name, step, fingerprint=None):
         '''
         Updates the status of a recipe's step
 
@@ -174,12 +221,33 @@ class CookBook (object):
         @type recipe: str
         @param step: name of the step
         @type step: str
+        @param fingerprint: fingerprint of the inputs of the step, as
+                            returned by L{cerbero.build.recipe.Recipe.step_fingerprint}
+        @type fingerprint: str
         '''
-        status = self._recipe_status(recipe_name)
-        status.steps.append(step)
-        status.touch()
-        self.status[recipe_name] = status
-        self.save()
+        def update(status):
+            status.steps.append(step)
+            # Use getattr as fingerprints were added later
+            if getattr(status, 'fingerprints', None) is None:
+                status.fingerprints = {}
+            status.fingerprints[step] = fingerprint
+            status.touch()
+        self._update_status(recipe_name, update)
+
+    def reset_steps(self, recipe_name, steps):
+        '''
+        Marks steps of a recipe as not done, keeping the fingerprints of
+        their inputs, like when the build tree of the recipe was removed
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param steps: names of the steps
+        @type steps: list
+        '''
+        def update(status):
+            status.steps = [x for x in status.steps if x not in steps]
+            status.touch()
+        self._update_status(recipe_name, update)
 
     def update_build_status(self, recipe_name, built_version):
         '''
@@ -190,12 +258,105 @@ class CookBook (object):
         @param built_version: built version ir None to reset it
         @type built_version: str
         '''
+        def update(status):
+            status.needs_build = built_version == None
+            status.built_version = built_version
+            status.touch()
+        self._update_status(recipe_name, update)
+
+    def update_manifest(self, recipe_name, files):
+        '''
+        Updates the list of files installed by a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param files: installed files, relative to the prefix
+        @type files: list
+        '''
+        def update(status):
+            status.manifest = files
+        self._update_status(recipe_name, update)
+
+    def recipe_manifest(self, recipe_name):
+        '''
+        Gets the list of files installed by a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: installed files, relative to the prefix, or None if they
+                 are not known
+        @rtype: list
+        '''
+        # Use getattr as manifest was added later
+        return getattr(self._recipe_status(recipe_name), 'manifest', None)
+
+    def update_interface(self, recipe_name, interface, deps_interfaces):
+        '''
+        Updates the fingerprint of the public interface of a recipe, see
+        L{cerbero.build.interface.interface_fingerprint}
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param interface: fingerprint of the recipe's interface
+        @type interface: str
+        @param deps_interfaces: dependency name -> fingerprint of the
+                                dependency's interface it was built against
+        @type deps_interfaces: dict
+        '''
+        def update(status):
+            status.interface = interface
+            status.deps_interfaces = deps_interfaces
+        self._update_status(recipe_name, update)
+
+    def recipe_interface(self, recipe_name):
+        '''
+        Gets the fingerprint of the public interface of a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: the fingerprint, or None if it's not known
+        @rtype: str
+        '''
+        # Use getattr as interface was added later
+        return getattr(self._recipe_status(recipe_name), 'interface', None)
+
+    def recipe_built_against(self, recipe_name, dep_name):
+        '''
+        Gets the fingerprint of the interface of a dependency a recipe was
+        built against
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param dep_name: name of the dependency
+        @type dep_name: str
+        @return: the fingerprint, or None if it's not known
+        @rtype: str
+        '''
         status = self._recipe_status(recipe_name)
-        status.needs_build = built_version == None
-        status.built_version = built_version
-        status.touch()
-        self.status[recipe_name] = status
-        self.save()
+        deps_interfaces = getattr(status, 'deps_interfaces', None) or {}
+        return deps_interfaces.get(dep_name)
+
+    def changed_deps_interfaces(self, recipe_name):
+        '''
+        Lists the dependencies of a recipe whose interface changed since the
+        recipe was built against them. Dependencies with an unknown
+        interface are not taken into account.
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: list of dependencies names
+        @rtype: list
+        '''
+        status = self._recipe_status(recipe_name)
+        deps_interfaces = getattr(status, 'deps_interfaces', None) or {}
+        changed = []
+        for dep, interface in sorted(deps_interfaces.iteritems()):
+            if dep not in self.recipes and dep not in self._index:
+                continue
+            current = self.recipe_interface(dep)
+            if None not in (current, interface) and current != interface:
+                changed.append(dep)
+        return changed
 
     def recipe_built_version (self, recipe_name):
         '''
@@ -229,7 +390,15 @@ class CookBook (object):
         '''
         if recipe_name in self.status:
             del self.status[recipe_name]
-            self.save()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute('DELETE FROM status WHERE recipe = ?',
+                             (recipe_name, ))
+            finally:
+                conn.close()
+        except sqlite3.Error, ex:
+            m.warning(_("Could not cache the CookBook: %s") % ex)
 
     def recipe_needs_build(self, recipe_name):
         '''
@@ -252,22 +421,54 @@ class CookBook (object):
         @return: list of L{cerbero.recipe.Recipe}
         @rtype: list
         '''
-        recipe = self.get_recipe(recipe_name)
-        return self._find_deps(recipe, {}, [])
+        return [self.get_recipe(x) for x in
+                self._graph.deps_order(recipe_name)]
 
-    def list_recipe_reverse_deps(self, recipe_name):
+    def list_recipe_reverse_deps(self, recipe_name, recursive=False):
         '''
-        List the dependencies that depends on this recipe
+        List the dependencies that depends on this recipe, the ones that
+        need a rebuild when it changes
 
         @param recipe_name: name of the recipe
         @type recipe_name: str
+        @param recursive: list also the recipes depending on them
+        @type recursive: bool
         @return: list of reverse dependencies L{cerbero.recipe.Recipe}
         @rtype: list
         '''
-        recipe = self.get_recipe(recipe_name)
-        return [r for r in self.recipes.values() if recipe.name in r.deps]
+        return [self.get_recipe(x) for x in
+                self._graph.reverse_deps(recipe_name, recursive)]
+
+    def list_recipe_all_reverse_deps(self, recipe_name, recursive=False):
+        '''
+        List the recipes built after this one, including the ones depending
+        on it only because it's a runtime dependency common to all recipes
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param recursive: list also the recipes depending on them
+        @type recursive: bool
+        @return: list of reverse dependencies L{cerbero.recipe.Recipe}
+        @rtype: list
+        '''
+        return [self.get_recipe(x) for x in
+                self._graph.all_reverse_deps(recipe_name, recursive)]
+
+    def list_recipe_direct_deps(self, recipe_name):
+        '''
+        List the direct dependencies of a recipe, including the runtime
+        dependencies common to all recipes
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: list of dependencies names
+        @rtype: list
+        '''
+        return list(self._graph.direct_deps(recipe_name))
 
     def _runtime_deps (self):
+        for name in list(self._runtime_candidates):
+            self._load_indexed_recipe(name)
         return [x.name for x in self.recipes.values() if x.runtime_dep]
 
     def _cache_file(self, config):
@@ -277,72 +478,160 @@ class CookBook (object):
             return COOKBOOK_FILE
 
     def _restore_cache(self):
+        cache_file = self._cache_file(self.get_config())
         try:
-            with open(self._cache_file(self.get_config()), 'rb') as f:
-                self.status = pickle.load(f)
+            if self._is_pickle(cache_file):
+                try:
+                    self._migrate_pickle(cache_file)
+                except Exception:
+                    # Otherwise every later update would fail using it as a
+                    # database
+                    self._move_aside(cache_file)
+                    raise
+            conn = self._connect()
+            try:
+                rows = conn.execute('SELECT recipe, data FROM status')
+                self.status = dict([(name, pickle.loads(str(data))) for
+                                    name, data in rows])
+            finally:
+                conn.close()
         except Exception:
             self.status = {}
             m.warning(_("Could not recover status"))
 
-    def save(self):
-        try:
+    def _connect(self, cache_file=None):
+        if cache_file is None:
             cache_file = self._cache_file(self.get_config())
-            if not os.path.exists(os.path.dirname(cache_file)):
-                os.makedirs(os.path.dirname(cache_file))
-            with open(cache_file, 'wb') as f:
-                pickle.dump(self.status, f)
-        except IOError, ex:
+        if not os.path.exists(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+        # Transactions are handled explicitly, and sqlite's locking
+        # serializes the writes of concurrent cerbero processes
+        conn = sqlite3.connect(cache_file, timeout=60, isolation_level=None)
+        conn.execute('CREATE TABLE IF NOT EXISTS status '
+                     '(recipe TEXT PRIMARY KEY, data BLOB)')
+        return conn
+
+    def _write_status(self, conn, recipe_name, status):
+        data = sqlite3.Binary(pickle.dumps(status, pickle.HIGHEST_PROTOCOL))
+        conn.execute('INSERT OR REPLACE INTO status (recipe, data) '
+                     'VALUES (?, ?)', (recipe_name, data))
+
+    def _update_status(self, recipe_name, update_func):
+        '''
+        Updates the status of a recipe in a transaction, starting from the
+        saved one so that updates from other processes are not lost
+        '''
+        # Loading the recipe can update its status too, if it was edited,
+        # which must not happen while the database is locked
+        recipe = self.get_recipe(recipe_name)
+        conn = None
+        try:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT data FROM status WHERE recipe = ?',
+                               (recipe_name, )).fetchone()
+            if row is not None:
+                self.status[recipe_name] = pickle.loads(str(row[0]))
+        except (IOError, OSError, sqlite3.Error), ex:
             m.warning(_("Could not cache the CookBook: %s") % ex)
-
-    def _find_deps(self, recipe, state={}, ordered=[]):
-        if state.get(recipe, 'clean') == 'processed':
+            if conn is not None:
+                conn.close()
+                conn = None
+        status = self._loaded_recipe_status(recipe)
+        update_func(status)
+        if conn is None:
             return
-        if state.get(recipe, 'clean') == 'in-progress':
-            raise FatalError(_("Dependency Cycle"))
-        state[recipe] = 'in-progress'
-        recipe_deps = recipe.list_deps()
-        if not recipe.runtime_dep:
-            recipe_deps = self._runtime_deps () + recipe_deps
-        for recipe_name in recipe_deps:
+        try:
+            self._write_status(conn, recipe_name, status)
+            conn.execute('COMMIT')
+        except sqlite3.Error, ex:
+            m.warning(_("Could not cache the CookBook: %s") % ex)
+        finally:
+            conn.close()
+
+    def _is_pickle(self, cache_file):
+        if not os.path.exists(cache_file) or \
+                os.path.getsize(cache_file) == 0:
+            return False
+        with open(cache_file, 'rb') as f:
+            return f.read(len(SQLITE_HEADER)) != SQLITE_HEADER
+
+    def _migrate_pickle(self, cache_file):
+        '''
+        Converts a cache file from the old pickle format to a database
+        '''
+        with open(cache_file, 'rb') as f:
+            status = pickle.load(f)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+        os.close(fd)
+        try:
+            conn = self._connect(tmp)
             try:
-                recipedep = self.get_recipe(recipe_name)
-            except RecipeNotFoundError, e:
-                raise FatalError(_("Recipe %s has a unknown dependency %s"
-                                 % (recipe.name, recipe_name)))
-            self._find_deps(recipedep, state, ordered)
-        state[recipe] = 'processed'
-        ordered.append(recipe)
-        return ordered
+                conn.execute('BEGIN')
+                for name in status:
+                    self._write_status(conn, name, status[name])
+                conn.execute('COMMIT')
+            finally:
+                conn.close()
+            if self._config.platform == Platform.WINDOWS:
+                # rename does not replace existing files on Windows
+                os.remove(cache_file)
+            os.rename(tmp, cache_file)
+        except:
+            os.remove(tmp)
+            raise
+
+    def _move_aside(self, cache_file):
+        old = cache_file + '.old'
+        m.warning(_("Could not migrate the CookBook cache, moving it to %s")
+                  % old)
+        if os.path.exists(old):
+            os.remove(old)
+        os.rename(cache_file, old)
 
     def _recipe_status(self, recipe_name):
-        recipe = self.get_recipe(recipe_name)
-        if recipe_name not in self.status:
+        return self._loaded_recipe_status(self.get_recipe(recipe_name))
+
+    def _loaded_recipe_status(self, recipe):
+        '''
+        Gets the status of a loaded recipe, creating it if it has none yet
+        '''
+        if recipe.name not in self.status:
             filepath = None
             if hasattr(recipe, '__file__'):
                 filepath = recipe.__file__
-            self.status[recipe_name] = RecipeStatus(filepath, steps=[],
+            self.status[recipe.name] = RecipeStatus(filepath, steps=[],
                     file_hash=shell.file_hash(filepath))
-        return self.status[recipe_name]
+        return self.status[recipe.name]
 
     def _load_recipes(self):
         self.recipes = {}
-        recipes = defaultdict(dict)
+        self._index = {}
+        self._edited = set()
+        self._runtime_candidates = set()
+        self._graph.invalidate()
+        index = defaultdict(list)
         recipes_repos = self._config.get_recipes_repos()
         for reponame, (repodir, priority) in recipes_repos.iteritems():
-            recipes[int(priority)].update(self._load_recipes_from_dir(repodir))
-        # Add recipes by asceding pripority
-        for key in sorted(recipes.keys()):
-            self.recipes.update(recipes[key])
+            index[int(priority)].append(self._index_recipes_from_dir(repodir))
+        # Add recipes by asceding pripority, keeping the files with lower
+        # priority as fallbacks in case the recipe is not valid for this
+        # configuration
+        for key in sorted(index.keys()):
+            for repo_index in index[key]:
+                for name, files in repo_index.iteritems():
+                    self._index[name] = files + self._index.get(name, [])
 
         # Check for updates in the recipe file to reset the status
-        for recipe in self.recipes.values():
-            if recipe.name not in self.status:
+        for name in self.status.keys():
+            if name not in self._index:
                 continue
-            st = self.status[recipe.name]
+            filepath = self._index[name][0][0]
+            st = self.status[name]
             # filepath attribute was added afterwards
             if not hasattr(st, 'filepath') or not getattr(st, 'filepath'):
-                st.filepath = recipe.__file__
-            rmtime = os.path.getmtime(recipe.__file__)
+                st.filepath = filepath
+            rmtime = os.path.getmtime(filepath)
             if rmtime > st.mtime:
                 # The mtime is different, check the file hash now
                 # Use getattr as file_hash we added later
@@ -353,36 +642,128 @@ class CookBook (object):
                     current_hash = None
                 if saved_hash == current_hash:
                     # Update the status with the mtime
-                    st.touch()
+                    self._update_status(name, RecipeStatus.touch)
+                elif getattr(st, 'fingerprints', None) and \
+                        current_hash is not None:
+                    # Find out which steps changed when the recipe is loaded
+                    self._edited.add(name)
                 else:
-                    self.reset_recipe_status(recipe.name)
+                    self.reset_recipe_status(name)
 
-    def _load_recipes_from_dir(self, repo):
-        recipes = {}
+    def _index_recipes_from_dir(self, repo):
+        index = defaultdict(list)
         recipes_files = shell.find_files('*%s' % self.RECIPE_EXT, repo)
         recipes_files.extend(shell.find_files('*/*%s' % self.RECIPE_EXT, repo))
-        try:
-            custom = None
-            m_path = os.path.join(repo, 'custom.py')
-            if os.path.exists(m_path):
-                custom = imp.load_source('custom', m_path)
-        except Exception:
-            custom = None
+        # Try to load the custom.py module located in the recipes dir
+        # which can contain private classes to extend cerbero's recipes
+        # and reuse them in our private repository
+        m_path = os.path.join(repo, 'custom.py')
+        custom = self._load_custom(m_path)
+        custom_runtime_dep = custom is not None and \
+            'runtime_dep' in open(m_path).read()
         for f in recipes_files:
-            # Try to load the custom.py module located in the recipes dir
-            # which can contain private classes to extend cerbero's recipes
-            # and reuse them in our private repository
+            with open(f, 'r') as rf:
+                content = rf.read()
+            match = RECIPE_NAME_RE.search(content)
+            if match is not None:
+                name = match.group(1)
+            else:
+                # The name is not a literal, load the recipe to get it
+                try:
+                    recipe = self._load_recipe_from_file(f, custom)
+                except RecipeNotFoundError:
+                    recipe = None
+                if recipe is None:
+                    m.warning(_("Could not found a valid recipe in %s") % f)
+                    continue
+                name = recipe.name
+            index[name].insert(0, (f, custom))
+            if custom_runtime_dep or 'runtime_dep' in content:
+                self._runtime_candidates.add(name)
+        return index
+
+    def _load_indexed_recipe(self, name):
+        for filepath, custom in self._index.pop(name, []):
             try:
-                recipe = self._load_recipe_from_file(f, custom)
+                recipe = self._load_recipe_from_file(filepath, custom)
             except RecipeNotFoundError:
-                m.warning(_("Could not found a valid recipe in %s") % f)
+                m.warning(_("Could not found a valid recipe in %s") %
+                          filepath)
+                continue
             if recipe is None:
                 continue
-            recipes[recipe.name] = recipe
-        return recipes
+            if recipe.name != name:
+                m.warning(_("Recipe file %s was indexed as %s but defines "
+                            "%s") % (filepath, name, recipe.name))
+                if recipe.name not in self.recipes and \
+                        recipe.name not in self._index:
+                    self.recipes[recipe.name] = recipe
+                continue
+            self.recipes[name] = recipe
+            if name in self._edited:
+                self._edited.remove(name)
+                self._restart_edited_recipe(recipe)
+            return
+
+    def _restart_edited_recipe(self, recipe):
+        '''
+        Compares the fingerprints of the steps of a modified recipe with the
+        ones saved when they were done, so that the build restarts from the
+        first step whose inputs changed instead of from scratch.
+        '''
+        steps = [x[1] for x in recipe.steps]
+        fingerprints = dict([(x, recipe.step_fingerprint(x)) for x in steps])
+        file_hash = shell.file_hash(recipe.__file__)
+        changed = []
+
+        def update(status):
+            saved = getattr(status, 'fingerprints', None) or {}
+            # Steps reset keeping their fingerprints, like the ones built in
+            # a scratch space, are checked too
+            done = [x for x in steps if x in status.steps or x in saved]
+            for i, step in enumerate(done):
+                if saved.get(step) != fingerprints[step]:
+                    changed.append(step)
+                    # Later steps used the output of this one
+                    for s in done[i:]:
+                        if s in status.steps:
+                            status.steps.remove(s)
+                        saved.pop(s, None)
+                    status.needs_build = True
+                    break
+            status.file_hash = file_hash
+            status.touch()
+        self._update_status(recipe.name, update)
+        if changed:
+            m.message(_("Recipe %s was modified, restarting its build from "
+                        "the %s step") % (recipe.name, changed[0]))
+
+    def _load_all_recipes(self):
+        for name in self._index.keys():
+            self._load_indexed_recipe(name)
+
+    def _load_custom(self, m_path):
+        try:
+            if not os.path.exists(m_path):
+                return None
+            mtime = os.path.getmtime(m_path)
+            if m_path not in _custom_modules or \
+                    _custom_modules[m_path][0] != mtime:
+                _custom_modules[m_path] = (mtime,
+                                           imp.load_source('custom', m_path))
+            return _custom_modules[m_path][1]
+        except Exception:
+            return None
 
     def _load_recipe_from_file(self, filepath, custom=None):
         mod_name, file_ext = os.path.splitext(os.path.split(filepath)[-1])
+        try:
+            # The recipe is compiled only once, but it's evaluated again for
+            # each architecture to get a new class
+            code = self._code_cache.get_code(filepath)
+        except Exception, ex:
+            m.warning("Error loading recipe in file %s %s" % (filepath, ex))
+            return None
         if self._config.target_arch == Architecture.UNIVERSAL:
             if self._config.target_platform in [Platform.IOS, Platform.DARWIN]:
                 recipe = crecipe.UniversalFlatRecipe(self._config)
@@ -398,7 +779,7 @@ class CookBook (object):
                      'InvalidRecipeError': InvalidRecipeError,
                      'FatalError': FatalError,
                      'custom': custom, '_': _, 'shell': shell}
-                parse_file(filepath, d)
+                exec code in d
                 conf = self._config.arch_config[c]
                 if self._config.target_arch == Architecture.UNIVERSAL:
                     if self._config.target_platform not in [Platform.IOS,
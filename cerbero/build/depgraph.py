@@ -0,0 +1,181 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+from collections import defaultdict
+
+from cerbero.errors import FatalError, RecipeNotFoundError
+from cerbero.utils import _
+
+
+class DependencyGraph (object):
+    '''
+    Dependency graph of the recipes of a cookbook.
+
+    The graph is built as it's queried, so that only the recipes needed are
+    loaded, and every result is cached until the graph is invalidated.
+    Listing reverse dependencies needs the whole graph and loads all the
+    recipes.
+    '''
+
+    def __init__(self, cookbook):
+        '''
+        @param cookbook: cookbook with the recipes
+        @type cookbook: L{cerbero.build.cookbook.CookBook}
+        '''
+        self.cookbook = cookbook
+        self.invalidate()
+
+    def invalidate(self):
+        '''
+        Drops the cached graph, after the recipes changed
+        '''
+        self._runtime_deps = None
+        self._deps = {}
+        self._orders = {}
+        self._order = None
+        self._rdeps = None
+        self._build_rdeps = None
+
+    def runtime_deps(self):
+        '''
+        Gets the runtime dependencies common to all the recipes
+
+        @return: list of recipe names
+        @rtype: list
+        '''
+        if self._runtime_deps is None:
+            self._runtime_deps = self.cookbook._runtime_deps()
+        return self._runtime_deps
+
+    def direct_deps(self, name):
+        '''
+        Gets the direct dependencies of a recipe, including the runtime
+        dependencies common to all recipes
+
+        @param name: name of the recipe
+        @type name: str
+        @return: list of recipe names
+        @rtype: list
+        '''
+        if name not in self._deps:
+            recipe = self.cookbook.get_recipe(name)
+            deps = recipe.list_deps()
+            if not recipe.runtime_dep:
+                deps = self.runtime_deps() + deps
+            self._deps[name] = deps
+        return self._deps[name]
+
+    def deps_order(self, name):
+        '''
+        Gets the dependencies of a recipe, including itself, in build order
+
+        @param name: name of the recipe
+        @type name: str
+        @return: list of recipe names
+        @rtype: list
+        '''
+        if name not in self._orders:
+            ordered = []
+            self._visit(name, {}, ordered)
+            self._orders[name] = ordered
+        return self._orders[name]
+
+    def order(self):
+        '''
+        Gets all the recipes in build order
+
+        @return: list of recipe names
+        @rtype: list
+        '''
+        if self._order is None:
+            state = {}
+            ordered = []
+            for recipe in self.cookbook.get_recipes_list():
+                self._visit(recipe.name, state, ordered)
+            self._order = ordered
+        return self._order
+
+    def reverse_deps(self, name, recursive=False):
+        '''
+        Gets the recipes declaring a recipe as a dependency, which are the
+        ones built against it
+
+        @param name: name of the recipe
+        @type name: str
+        @param recursive: include the reverse dependencies of the reverse
+                          dependencies
+        @type recursive: bool
+        @return: list of recipe names, in build order
+        @rtype: list
+        '''
+        if self._build_rdeps is None:
+            self._build_rdeps = self._reverse_index(
+                lambda x: self.cookbook.get_recipe(x).list_deps())
+        return self._reverse(self._build_rdeps, name, recursive)
+
+    def all_reverse_deps(self, name, recursive=False):
+        '''
+        Gets the recipes built after a recipe, like L{reverse_deps} but
+        including the recipes depending on it because it's a runtime
+        dependency common to all the recipes
+
+        @param name: name of the recipe
+        @type name: str
+        @param recursive: include the reverse dependencies of the reverse
+                          dependencies
+        @type recursive: bool
+        @return: list of recipe names, in build order
+        @rtype: list
+        '''
+        if self._rdeps is None:
+            self._rdeps = self._reverse_index(self.direct_deps)
+        return self._reverse(self._rdeps, name, recursive)
+
+    def _reverse_index(self, deps_func):
+        rdeps = defaultdict(set)
+        for recipe_name in self.order():
+            for dep in deps_func(recipe_name):
+                rdeps[dep].add(recipe_name)
+        return rdeps
+
+    def _reverse(self, index, name, recursive):
+        rdeps = set(index[name])
+        if recursive:
+            pending = list(rdeps)
+            while pending:
+                for rdep in index[pending.pop()]:
+                    if rdep not in rdeps:
+                        rdeps.add(rdep)
+                        pending.append(rdep)
+        return [x for x in self.order() if x in rdeps]
+
+    def _visit(self, name, state, ordered):
+        if state.get(name) == 'processed':
+            return
+        if state.get(name) == 'in-progress':
+            raise FatalError(_("Dependency Cycle"))
+        state[name] = 'in-progress'
+        for dep in self.direct_deps(name):
+            try:
+                self.cookbook.get_recipe(dep)
+            except RecipeNotFoundError:
+                raise FatalError(_("Recipe %s has a unknown dependency %s"
+                                 % (name, dep)))
+            self._visit(dep, state, ordered)
+        state[name] = 'processed'
+        ordered.append(name)
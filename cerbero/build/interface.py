@@ -0,0 +1,161 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import re
+import hashlib
+
+from cerbero.config import Platform
+from cerbero.errors import FatalError
+from cerbero.utils import shell
+
+
+# Files whose contents are part of the interface of a recipe
+CONTENT_EXTENSIONS = ['.pc', '.la', '.def', '.h', '.hh', '.hpp', '.vapi',
+                      '.gir', '.m4']
+LIBRARY_RE = re.compile(r'.*(\.so(\.[0-9]+)*|\.dylib|\.dll|\.a|\.lib)$')
+SYMBOL_RE = re.compile(r'^(?:[0-9a-fA-F]+\s+)?([A-Za-z])\s+(\S+)')
+AR_MAGIC = '!<arch>\n'
+AR_HEADER_SIZE = 60
+
+
+def _content_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def archive_hash(path):
+    '''
+    Hashes the members of a static archive: their names and contents, but
+    not the modification times, owners and modes the ar headers store,
+    which change each time the archive is created.
+
+    Recipes linking a static archive embed its code, so the whole contents
+    are part of its interface, not only the symbols.
+
+    @param path: path of the archive
+    @type path: str
+    @return: the hash
+    @rtype: str
+    '''
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        if f.read(len(AR_MAGIC)) != AR_MAGIC:
+            return _content_hash(path)
+        while True:
+            header = f.read(AR_HEADER_SIZE)
+            if len(header) < AR_HEADER_SIZE:
+                break
+            try:
+                size = int(header[48:58])
+            except ValueError:
+                # Not an ar archive after all
+                return _content_hash(path)
+            h.update(header[:16])
+            h.update(f.read(size))
+            # Members are aligned to even offsets
+            if size % 2:
+                f.read(1)
+    return h.hexdigest()
+
+
+def library_interface(path, platform):
+    '''
+    Gets the interface of a shared library: its soname or install name and
+    the symbols it exports, without the addresses of the symbols, which
+    change with any change in the code.
+
+    @param path: path of the library
+    @type path: str
+    @param platform: platform of the library
+    @type platform: L{cerbero.enums.Platform}
+    @return: the library interface, or None if it can't be read, like for
+             Windows DLLs
+    @rtype: str
+    '''
+    if platform in [Platform.DARWIN, Platform.IOS]:
+        name_cmd = 'otool -D "%s"'
+        nm_cmd = 'nm -g -U "%s"'
+    elif platform in [Platform.LINUX, Platform.ANDROID]:
+        name_cmd = 'objdump -p "%s"'
+        nm_cmd = 'nm -D --defined-only "%s"'
+    else:
+        return None
+    try:
+        name = ''
+        output = shell.check_call(name_cmd % path, fail=True)
+        if platform in [Platform.DARWIN, Platform.IOS]:
+            name = output.splitlines()[-1].strip()
+        else:
+            for line in output.splitlines():
+                if line.strip().startswith('SONAME'):
+                    name = line.split()[-1]
+        symbols = set()
+        for line in shell.check_call(nm_cmd % path, fail=True).splitlines():
+            match = SYMBOL_RE.match(line.strip())
+            if match:
+                symbols.add('%s %s' % match.groups())
+    except FatalError:
+        return None
+    return '%s\n%s' % (name, '\n'.join(sorted(symbols)))
+
+
+def interface_fingerprint(recipe, files=None):
+    '''
+    Computes a fingerprint of the public interface of a recipe installed in
+    its prefix: the contents of its headers, .pc and .la files and static
+    archives, and the soname and exported symbols of its shared libraries.
+
+    Recipes depending on it only need to be rebuilt when the fingerprint
+    changes.
+
+    @param recipe: the recipe
+    @type recipe: L{cerbero.build.recipe.Recipe}
+    @param files: files installed by the recipe, relative to the prefix.
+                  Defaults to the ones listed in the recipe.
+    @type files: list
+    @return: the fingerprint, or None if the recipe installs no interface
+             files
+    @rtype: str
+    '''
+    prefix = recipe.config.prefix
+    platform = recipe.config.target_platform
+    if files is None:
+        files = recipe.devel_files_list() + recipe.libraries()
+    entries = set()
+    for f in sorted(set(files)):
+        path = os.path.join(prefix, f)
+        if not os.path.isfile(path) or os.path.islink(path):
+            # links to libraries are covered by the soname
+            continue
+        if f.startswith('include/') or \
+                os.path.splitext(f)[1] in CONTENT_EXTENSIONS:
+            entries.add('file %s %s' % (f, _content_hash(path)))
+        elif f.endswith('.a'):
+            entries.add('archive %s %s' % (f, archive_hash(path)))
+        elif LIBRARY_RE.match(f):
+            interface = library_interface(path, platform)
+            if interface is None:
+                entries.add('library %s %s' % (f, _content_hash(path)))
+            else:
+                # The soname identifies the library, the file name changes
+                # with the version
+                entries.add('library %s' % hashlib.sha1(interface).hexdigest())
+    if not entries:
+        return None
+    return hashlib.sha1('\n'.join(sorted(entries))).hexdigest()
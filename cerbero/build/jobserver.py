@@ -0,0 +1,129 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import re
+import errno
+import multiprocessing
+
+from cerbero.config import Platform
+
+
+MAKEFLAGS = 'MAKEFLAGS'
+TOKEN = '+'
+# Options of MAKEFLAGS joining a jobserver. make < 4.2 only understands
+# --jobserver-fds, newer versions --jobserver-auth, and unknown options in
+# MAKEFLAGS are ignored.
+JOBSERVER_FLAGS_RE = re.compile(r'(^|\s)(-j[0-9]*|--jobserver-(fds|auth)=\S+)'
+                                r'(?=\s|$)')
+
+
+def supported(config):
+    '''
+    Whether the make jobserver can be used. On Windows, make uses
+    semaphores instead of pipes for the jobserver.
+    '''
+    return config.platform != Platform.WINDOWS
+
+
+def serial_makeflags(makeflags):
+    '''
+    Removes the jobserver from a MAKEFLAGS value, so that make runs one job
+    at a time
+
+    @param makeflags: the MAKEFLAGS value
+    @type makeflags: str
+    @return: the MAKEFLAGS value without the jobserver options
+    @rtype: str
+    '''
+    return JOBSERVER_FLAGS_RE.sub('', makeflags or '').strip()
+
+
+class JobServer (object):
+    '''
+    GNU make jobserver shared by all the recipes built in a build session,
+    so that the number of jobs run by all the make processes stays at the
+    configured number of jobs, however many recipes are built at the same
+    time.
+
+    The jobserver is a pipe with a token for each job. Every make process
+    can run a job without a token, so each recipe acquires a token while
+    it's built, which stands for the job its make processes run for free,
+    and the remaining tokens are shared through MAKEFLAGS.
+
+    @ivar jobs: total number of jobs
+    @type jobs: int
+    '''
+
+    def __init__(self, jobs):
+        self.jobs = max(1, jobs)
+        self._lock = multiprocessing.Lock()
+        self._read, self._write = os.pipe()
+        os.write(self._write, TOKEN * self.jobs)
+
+    def makeflags(self, makeflags=None):
+        '''
+        Gets the MAKEFLAGS value joining the jobserver
+
+        @param makeflags: the current MAKEFLAGS value
+        @type makeflags: str
+        @return: the new MAKEFLAGS value
+        @rtype: str
+        '''
+        fds = '%d,%d' % (self._read, self._write)
+        flags = serial_makeflags(makeflags)
+        return ('%s -j --jobserver-fds=%s --jobserver-auth=%s' %
+                (flags, fds, fds)).strip()
+
+    def acquire(self, tokens=1):
+        '''
+        Takes tokens, waiting for them to be released if there are not
+        enough. Several tokens are taken holding a lock, so that two
+        processes waiting for several tokens can't block each other.
+
+        @param tokens: number of tokens
+        @type tokens: int
+        '''
+        if tokens == 1:
+            self._take()
+            return
+        with self._lock:
+            for i in range(tokens):
+                self._take()
+
+    def release(self, tokens=1):
+        '''
+        Returns tokens taken with L{acquire}
+        '''
+        os.write(self._write, TOKEN * tokens)
+
+    def _take(self):
+        while True:
+            try:
+                if os.read(self._read, 1):
+                    return
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    raise
+
+    def close(self):
+        for fd in [self._read, self._write]:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
@@ -0,0 +1,413 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import threading
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+from cerbero.config import CONFIG_DIR
+from cerbero.utils import _, shell
+from cerbero.utils import messages as m
+
+
+PROC = '/proc'
+# Seconds between the samples of the memory used by the commands of a step
+SAMPLE_INTERVAL = 0.5
+
+
+def children_usage():
+    '''
+    Gets the resources used by the terminated children of this process
+
+    @return: user CPU time, system CPU time and peak RSS in KB
+    @rtype: tuple
+    '''
+    if resource is None:
+        return (0.0, 0.0, 0)
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    maxrss = usage.ru_maxrss
+    if sys.platform == 'darwin':
+        # reported in bytes instead of KB
+        maxrss /= 1024
+    return (usage.ru_utime, usage.ru_stime, maxrss)
+
+
+def processes():
+    '''
+    Lists the running processes, reading them from /proc
+
+    @return: pid -> (parent pid, RSS in KB)
+    @rtype: dict
+    '''
+    page_kb = os.sysconf('SC_PAGE_SIZE') / 1024
+    procs = {}
+    for name in os.listdir(PROC):
+        if not name.isdigit():
+            continue
+        try:
+            with open(os.path.join(PROC, name, 'stat'), 'r') as f:
+                stat = f.read()
+        except IOError:
+            # it already exited
+            continue
+        # The fields after the command name, which can contain spaces:
+        # state, ppid and, 20 fields later, the RSS in pages
+        fields = stat[stat.rindex(')') + 2:].split()
+        procs[int(name)] = (int(fields[1]), int(fields[21]) * page_kb)
+    return procs
+
+
+class MemorySampler (object):
+    '''
+    Samples in a thread the memory used by the commands run by a step,
+    summing the RSS of all the processes they spawned. Unlike the peak RSS
+    of the children, it's not a mark shared by all the steps run by the
+    process, nor the one of a single command.
+
+    The processes that were already running when the sampler started, like
+    the prefetch workers, and their children are not counted.
+
+    @ivar peak: highest RSS in KB sampled, or None
+    @type peak: int
+    '''
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.peak = None
+        self._interval = interval
+        self._pid = os.getpid()
+        self._ignored = set()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def supported():
+        '''
+        Whether the processes can be listed in this platform
+        '''
+        return hasattr(os, 'sysconf') and \
+            os.path.exists(os.path.join(PROC, str(os.getpid()), 'stat'))
+
+    def start(self):
+        self._ignored = set([pid for pid, (ppid, rss) in
+                             processes().iteritems() if ppid == self._pid])
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops sampling
+
+        @return: the highest RSS in KB sampled, or None
+        @rtype: int
+        '''
+        self._stopped.set()
+        self._thread.join()
+        return self.peak
+
+    def _run(self):
+        while True:
+            self._sample()
+            if self._stopped.wait(self._interval):
+                return
+
+    def _sample(self):
+        children = {}
+        procs = processes()
+        for pid, (ppid, rss) in procs.iteritems():
+            children.setdefault(ppid, []).append(pid)
+        pending = [x for x in children.get(self._pid, [])
+                   if x not in self._ignored]
+        if not pending:
+            return
+        total = 0
+        while pending:
+            pid = pending.pop()
+            total += procs[pid][1]
+            pending.extend(children.get(pid, []))
+        self.peak = max(self.peak, total)
+
+
+def files_size(prefix, files):
+    '''
+    Sums the size of a list of files relative to a prefix, ignoring the ones
+    that do not exist anymore
+    '''
+    size = 0
+    for f in files:
+        try:
+            size += os.lstat(os.path.join(prefix, f)).st_size
+        except OSError:
+            pass
+    return size
+
+
+class StepMeter (object):
+    '''
+    Measures the resources used by a build step: the wall time, the CPU
+    time and peak RSS of the commands it ran, and the bytes it wrote in the
+    prefix.
+
+    The peak RSS is sampled with a L{MemorySampler} where the processes can
+    be listed. The peak RSS of the children of the process, which catches
+    the commands too short to be sampled, is a high-water mark of all of
+    them, so it's only used when the step raised it.
+    '''
+
+    def __init__(self, prefix=None):
+        '''
+        @param prefix: prefix where the step installs files, if any
+        @type prefix: str
+        '''
+        self.prefix = prefix
+        self._stamp = None
+        if prefix is not None:
+            self._stamp = tempfile.NamedTemporaryFile()
+        self.start = time.time()
+        self._usage = children_usage()
+        self._sampler = None
+        if MemorySampler.supported():
+            self._sampler = MemorySampler()
+            self._sampler.start()
+
+    def stop(self, success, files=None):
+        '''
+        Stops measuring the step
+
+        @param success: whether the step succeeded
+        @type success: bool
+        @param files: files installed by the step relative to the prefix,
+                      found by modification time if not known
+        @type files: list
+        @return: the step measures
+        @rtype: dict
+        '''
+        wall = time.time() - self.start
+        utime, stime, maxrss = children_usage()
+        measures = {'start': self.start, 'wall': wall,
+                    'utime': utime - self._usage[0],
+                    'stime': stime - self._usage[1],
+                    'maxrss': None, 'bytes': None, 'success': success}
+        if maxrss > self._usage[2]:
+            measures['maxrss'] = maxrss
+        if self._sampler is not None:
+            peak = self._sampler.stop()
+            if peak is not None:
+                measures['maxrss'] = max(measures['maxrss'], peak)
+        if self._stamp is not None:
+            if files is None:
+                files = shell.find_newer_files(self.prefix, self._stamp.name)
+            measures['bytes'] = files_size(self.prefix, files)
+            self._stamp.close()
+        return measures
+
+
+class MetricsDB (object):
+    '''
+    Database storing the timings and resources used by the recipes and
+    steps cooked in each build
+
+    @ivar path: path of the database
+    @type path: str
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def from_config(config):
+        '''
+        Gets the metrics database of a configuration
+        '''
+        name = config.cache_file or 'cookbook'
+        return MetricsDB(os.path.join(CONFIG_DIR, '%s.metrics' % name))
+
+    def start_run(self, recipes, jobs):
+        '''
+        Records the start of a build
+
+        @param recipes: names of the recipes that need to be built
+        @type recipes: list
+        @param jobs: number of recipes built at the same time
+        @type jobs: int
+        @return: id of the run, or None if it couldn't be recorded
+        @rtype: int
+        '''
+        return self._write('INSERT INTO runs (start, jobs, recipes) '
+                           'VALUES (?, ?, ?)',
+                           (time.time(), jobs, ' '.join(recipes)))
+
+    def finish_run(self, run, success):
+        '''
+        Records the end of a build
+        '''
+        self._write('UPDATE runs SET end = ?, success = ? WHERE id = ?',
+                    (time.time(), success, run))
+
+    def add_step(self, run, recipe_name, step, measures):
+        '''
+        Records the measures of a step, as returned by L{StepMeter.stop}
+        '''
+        self._write('INSERT INTO steps (run, recipe, step, start, wall, '
+                    'utime, stime, maxrss, bytes, success) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (run, recipe_name, step, measures['start'],
+                     measures['wall'], measures['utime'], measures['stime'],
+                     measures['maxrss'], measures['bytes'],
+                     measures['success']))
+
+    def add_recipe(self, run, recipe_name, start, wall, success):
+        '''
+        Records the total time spent cooking a recipe
+        '''
+        self._write('INSERT INTO recipes (run, recipe, start, wall, success) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (run, recipe_name, start, wall, success))
+
+    def slowest_recipes(self, limit=None):
+        '''
+        Lists the recipes by their average build time
+
+        @return: list of (recipe, average wall time, number of builds)
+        @rtype: list
+        '''
+        return self._read('SELECT recipe, AVG(wall), COUNT(*) FROM recipes '
+                          'WHERE success GROUP BY recipe '
+                          'ORDER BY AVG(wall) DESC LIMIT ?',
+                          (limit or -1, ))
+
+    def slowest_steps(self, limit=None):
+        '''
+        Lists the steps by their average time
+
+        @return: list of (recipe, step, average wall time, average CPU time,
+                 peak RSS in KB)
+        @rtype: list
+        '''
+        return self._read('SELECT recipe, step, AVG(wall), '
+                          'AVG(utime + stime), MAX(maxrss) FROM steps '
+                          'WHERE success GROUP BY recipe, step '
+                          'ORDER BY AVG(wall) DESC LIMIT ?',
+                          (limit or -1, ))
+
+    def recipe_history(self, recipe_name):
+        '''
+        Lists the measures of a recipe in each build, oldest first
+
+        @return: list of (run, start, wall time, CPU time, peak RSS in KB,
+                 bytes installed, success)
+        @rtype: list
+        '''
+        return self._read('SELECT r.run, r.start, r.wall, '
+                          'SUM(s.utime + s.stime), MAX(s.maxrss), '
+                          'SUM(s.bytes), r.success '
+                          'FROM recipes r LEFT JOIN steps s '
+                          'ON s.run = r.run AND s.recipe = r.recipe '
+                          'WHERE r.recipe = ? GROUP BY r.run, r.recipe '
+                          'ORDER BY r.start', (recipe_name, ))
+
+    def recipe_estimates(self):
+        '''
+        Gets the average time it takes to build each recipe
+
+        @return: recipe name -> average wall time in seconds
+        @rtype: dict
+        '''
+        return dict([(x[0], x[1]) for x in self.slowest_recipes()])
+
+    def peak_memory(self):
+        '''
+        Gets the highest peak RSS measured for each recipe
+
+        @return: recipe name -> peak RSS in KB
+        @rtype: dict
+        '''
+        return dict(self._read('SELECT recipe, MAX(maxrss) FROM steps '
+                               'WHERE maxrss IS NOT NULL GROUP BY recipe'))
+
+    def last_run(self):
+        '''
+        Gets the last build recorded
+
+        @return: (id, start, end, jobs, recipes, success), where end is None
+                 if the build is still running or was interrupted
+        @rtype: tuple
+        '''
+        rows = self._read('SELECT id, start, end, jobs, recipes, success '
+                          'FROM runs ORDER BY id DESC LIMIT 1')
+        if not rows:
+            return None
+        run = list(rows[0])
+        run[4] = run[4].split()
+        return tuple(run)
+
+    def run_recipes(self, run):
+        '''
+        Gets the recipes already cooked in a build
+
+        @return: recipe name -> (wall time, success)
+        @rtype: dict
+        '''
+        rows = self._read('SELECT recipe, wall, success FROM recipes '
+                          'WHERE run = ?', (run, ))
+        return dict([(x[0], (x[1], x[2])) for x in rows])
+
+    def _connect(self):
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        conn = sqlite3.connect(self.path, timeout=60)
+        conn.execute('CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY '
+                     'KEY AUTOINCREMENT, start REAL, end REAL, jobs INTEGER, '
+                     'recipes TEXT, success INTEGER)')
+        conn.execute('CREATE TABLE IF NOT EXISTS recipes (run INTEGER, '
+                     'recipe TEXT, start REAL, wall REAL, success INTEGER)')
+        conn.execute('CREATE TABLE IF NOT EXISTS steps (run INTEGER, '
+                     'recipe TEXT, step TEXT, start REAL, wall REAL, '
+                     'utime REAL, stime REAL, maxrss INTEGER, bytes INTEGER, '
+                     'success INTEGER)')
+        return conn
+
+    def _write(self, query, args):
+        # Metrics are not worth failing a build for
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    return conn.execute(query, args).lastrowid
+            finally:
+                conn.close()
+        except (IOError, OSError, sqlite3.Error), ex:
+            m.warning(_("Could not save the build metrics: %s") % ex)
+            return None
+
+    def _read(self, query, args=()):
+        if not os.path.exists(self.path):
+            return []
+        conn = self._connect()
+        try:
+            return conn.execute(query, args).fetchall()
+        finally:
+            conn.close()
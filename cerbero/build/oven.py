@@ -16,16 +16,70 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import os
+import sys
 import tempfile
 import shutil
 import traceback
+import time
+import multiprocessing
+from Queue import Empty
 
+from cerbero.config import Platform
 from cerbero.errors import BuildStepError, FatalError
 from cerbero.build.recipe import Recipe, BuildSteps
+from cerbero.build.admission import AdmissionControl
+from cerbero.build.artifacts import ArtifactsCache
+from cerbero.build.ccache import CompilerCache
+from cerbero.build.scratch import ScratchSpace
+from cerbero.build.interface import interface_fingerprint
+from cerbero.build import jobserver
+from cerbero.build.jobserver import JobServer
+from cerbero.build.metrics import MetricsDB, StepMeter
+from cerbero.build.prefetch import Prefetcher
+from cerbero.build.scheduler import BuildQueue
 from cerbero.utils import _, shell
 from cerbero.utils import messages as m
 
 
+class CookBookProxy (object):
+    '''
+    Proxy of the L{cerbero.build.cookbook.CookBook} used by the recipes built
+    in a worker process. The status updates are sent to the main process,
+    which is the only one writing the cookbook status, and everything else
+    is read from the worker's copy of the cookbook.
+    '''
+
+    STATUS_METHODS = ['update_step_status', 'update_build_status',
+                      'reset_recipe_status', 'update_manifest',
+                      'update_interface', 'reset_steps']
+
+    def __init__(self, cookbook, queue):
+        self._cookbook = cookbook
+        self._queue = queue
+
+    def __getattr__(self, name):
+        if name in self.STATUS_METHODS:
+            return lambda *args: self._queue.put(('status', name, args))
+        return getattr(self._cookbook, name)
+
+
+class MetricsProxy (object):
+    '''
+    Proxy of the L{cerbero.build.metrics.MetricsDB} used by the recipes
+    built in a worker process, which sends the measures to the main process
+    '''
+
+    def __init__(self, queue):
+        self._queue = queue
+
+    def add_step(self, *args):
+        self._queue.put(('metrics', 'add_step', args))
+
+    def add_recipe(self, *args):
+        self._queue.put(('metrics', 'add_recipe', args))
+
+
 class Oven (object):
     '''
     This oven cooks recipes with all their ingredients
@@ -40,12 +94,17 @@ class Oven (object):
     @type: bool
     @ivar missing_files: check for files missing in the recipe
     @type missing_files: bool
+    @ivar jobs: maximum number of recipes cooked at the same time
+    @type jobs: int
+    @ivar prefetch: steps run in the background for the next recipes,
+                    'fetch', 'extract' or None to disable it
+    @type prefetch: str
     '''
 
     STEP_TPL = '[(%s/%s) %s -> %s ]'
 
     def __init__(self, recipes, cookbook, force=False, no_deps=False,
-                 missing_files=False, dry_run=False):
+                 missing_files=False, dry_run=False, jobs=1, prefetch=None):
         if isinstance(recipes, Recipe):
             recipes = [recipes]
         self.recipes = recipes
@@ -53,6 +112,26 @@ class Oven (object):
         self.force = force
         self.no_deps = no_deps
         self.missing_files = missing_files
+        self.jobs = max(1, jobs or 1)
+        self.prefetch = prefetch
+        self._prefetcher = None
+        self._install_lock = None
+        self._installing = False
+        self.artifacts = None
+        self.metrics = None
+        self.ccache = None
+        self.jobserver = None
+        self.admission = None
+        self.scratch = None
+        self._run = None
+        self._needs_build = {}  # recipe name -> whether it needs a build
+        self._ready = set()
+        self._make_jobs = {}  # recipe name -> limit of make jobs
+        if not dry_run:
+            self.artifacts = ArtifactsCache.from_config(cookbook)
+            self.metrics = MetricsDB.from_config(cookbook.get_config())
+            self.ccache = CompilerCache.from_config(cookbook.get_config())
+            self.scratch = ScratchSpace.from_config(cookbook.get_config())
         shell.DRY_RUN = dry_run
 
     def start_cooking(self):
@@ -72,46 +151,515 @@ class Oven (object):
         m.message(_("Building the following recipes: %s") %
                   ' '.join([x.name for x in ordered_recipes]))
 
-        i = 1
+        if self.ccache is not None:
+            self.ccache.setup()
+        config = self.cookbook.get_config()
+        # The shared git mirrors are fetched once in the build
+        config.start_session()
+        # The jobserver shares the make jobs of the recipes that can be
+        # built in parallel, with a token at least for each recipe cooked
+        # at the same time
+        if not shell.DRY_RUN and jobserver.supported(config) and \
+                config.allow_parallel_build:
+            self.jobserver = JobServer(max(self.jobs, config.num_of_cpus))
+        # Decided once, as checking it resets the status of the recipes
+        # to rebuild
+        self._needs_build = {}
+        self._ready = set()
         for recipe in ordered_recipes:
-            self._cook_recipe(recipe, i, len(ordered_recipes))
-            i += 1
+            self._needs_build[recipe.name] = self._check_needs_build(recipe)
+        needed = [x for x in ordered_recipes if self._needs_build[x.name]]
+        if not shell.DRY_RUN:
+            self.admission = AdmissionControl.from_config(config, needed,
+                                                          self.metrics)
+        if self.metrics is not None:
+            self._run = self.metrics.start_run([x.name for x in needed],
+                                               self.jobs)
+        if self.artifacts is not None and not self.force:
+            self.artifacts.download(needed)
+        if self.prefetch and not self.force and not shell.DRY_RUN:
+            self._prefetcher = Prefetcher(self.cookbook,
+                                          self.prefetch == 'extract')
+            self._prefetcher.start(needed)
+        success = False
+        try:
+            if self._can_cook_in_parallel():
+                self._cook_parallel(ordered_recipes)
+            else:
+                i = 1
+                for recipe in ordered_recipes:
+                    self._cook_recipe(recipe, i, len(ordered_recipes))
+                    i += 1
+            success = True
+        finally:
+            if self.metrics is not None and self._run is not None:
+                self.metrics.finish_run(self._run, success)
+            if self._prefetcher is not None:
+                self._prefetcher.stop()
+                self._prefetcher = None
+            if self.artifacts is not None:
+                self.artifacts.print_stats()
+            if self.ccache is not None:
+                self.ccache.print_stats()
+            if self.jobserver is not None:
+                self.jobserver.close()
+                self.jobserver = None
+
+    def _can_cook_in_parallel(self):
+        if self.jobs == 1:
+            return False
+        if self.cookbook.get_config().platform == Platform.WINDOWS or \
+                not hasattr(os, 'fork'):
+            m.warning(_("Parallel builds are not supported on this platform, "
+                        "building one recipe at a time"))
+            return False
+        if self.missing_files:
+            m.warning(_("--missing-files needs to build one recipe at a "
+                        "time, ignoring --jobs"))
+            return False
+        return True
+
+    def _cook_parallel(self, ordered_recipes):
+        '''
+        Cooks the recipes as a dependency graph, running up to C{self.jobs}
+        recipes with all their dependencies already built in worker
+        processes.
+        '''
+        recipes = dict([(r.name, r) for r in ordered_recipes])
+        deps = {}
+        for name in recipes:
+            deps[name] = self.cookbook.list_recipe_direct_deps(name)
+        build_queue = BuildQueue([r.name for r in ordered_recipes], deps)
+        events = multiprocessing.Queue()
+        self._install_lock = multiprocessing.Lock()
+        total = len(ordered_recipes)
+        count = 0
+        running = {}  # recipe name -> (worker process, count)
+        failures = []
+
+        def accept(name):
+            # Heavy recipes wait until there are enough resources to build
+            # them, but the ones already built don't need any
+            if self.admission is None or \
+                    not self._recipe_needs_build(recipes[name]):
+                return True
+            return self.admission.admit(name)
+
+        try:
+            while True:
+                while not failures and len(running) < self.jobs:
+                    name = build_queue.pop(accept)
+                    if name is None:
+                        break
+                    count += 1
+                    recipe = recipes[name]
+                    if not self._recipe_needs_build(recipe):
+                        m.build_step(count, total, name, _("already built"))
+                        build_queue.done(name)
+                        continue
+                    if self._prefetcher is not None:
+                        self._prefetcher.wait(recipe)
+                    if self.admission is not None:
+                        self.admission.start(name)
+                        # The workers don't know the recipes started later
+                        self._make_jobs[name] = self._limit_make_jobs(recipe)
+                    running[name] = (self._start_worker(recipe, count, total,
+                                                        events), count)
+                if not running:
+                    break
+                self._wait_workers(events, running, build_queue, failures,
+                                   total)
+        except KeyboardInterrupt:
+            for worker, count in running.values():
+                worker.terminate()
+            raise
+
+        if failures:
+            raise failures[0]
+
+    def _start_worker(self, recipe, count, total, events):
+        logfile = os.path.join(self.cookbook.get_config().logs,
+                               '%s.log' % recipe.name)
+        if not os.path.exists(os.path.dirname(logfile)):
+            os.makedirs(os.path.dirname(logfile))
+        m.build_step(count, total, recipe.name,
+                     _("building, log in %s") % logfile)
+        worker = multiprocessing.Process(target=self._cook_worker,
+            args=(recipe, count, total, events, logfile))
+        worker.start()
+        return worker
+
+    def _cook_worker(self, recipe, count, total, events, logfile):
+        # Runs in the worker process, where the output is redirected to the
+        # recipe's log file and the status updates forwarded to the main
+        # process
+        fd = os.open(logfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        os.close(fd)
+        self.cookbook = CookBookProxy(self.cookbook, events)
+        if self.metrics is not None:
+            self.metrics = MetricsProxy(events)
+        # The main process already waited for the prefetched sources
+        self._prefetcher = None
+        if self.artifacts is not None:
+            self.artifacts.reset_stats()
+        try:
+            self._cook_recipe(recipe, count, total)
+        except BuildStepError, e:
+            result = ('failed', recipe.name, (e.step, e.trace))
+        except Exception:
+            result = ('failed', recipe.name, (None, traceback.format_exc()))
+        else:
+            result = ('finished', recipe.name, None)
+        if self.artifacts is not None:
+            events.put(('artifacts', recipe.name, self.artifacts.get_stats()))
+        if self.ccache is not None and recipe.name in self.ccache.stats:
+            events.put(('ccache', recipe.name,
+                        self.ccache.stats[recipe.name]))
+        events.put(result)
+
+    def _wait_workers(self, events, running, build_queue, failures, total):
+        try:
+            self._handle_event(events.get(timeout=1), running, build_queue,
+                               failures, total)
+        except Empty:
+            # A worker could have died without notifying it. Its last
+            # events, if any, are already in the queue once it's dead.
+            dead = [x for x in running if not running[x][0].is_alive()]
+            if not dead:
+                return
+            while True:
+                try:
+                    event = events.get_nowait()
+                except Empty:
+                    break
+                self._handle_event(event, running, build_queue, failures,
+                                   total)
+            for name in dead:
+                if name in running:
+                    self._handle_event(('failed', name, (None,
+                        _("The build process exited unexpectedly"))),
+                        running, build_queue, failures, total)
+
+    def _handle_event(self, event, running, build_queue, failures, total):
+        action, name, args = event
+        if action == 'status':
+            # Status updates from all the workers are serialized here, name
+            # being the cookbook method to call
+            getattr(self.cookbook, name)(*args)
+            if name == 'update_step_status':
+                recipe_name, step = args[:2]
+                m.build_step(running[recipe_name][1], total, recipe_name,
+                             step)
+            return
+        if action == 'artifacts':
+            self.artifacts.add_stats(*args)
+            return
+        if action == 'ccache':
+            self.ccache.add_stats(name, *args)
+            return
+        if action == 'metrics':
+            getattr(self.metrics, name)(*args)
+            return
+
+        worker, count = running.pop(name)
+        worker.join()
+        if self.admission is not None:
+            self.admission.finish(name)
+        if action == 'finished':
+            m.build_step(count, total, name, _("built"))
+            build_queue.done(name)
+            return
+
+        step, trace = args
+        logfile = os.path.join(self.cookbook.get_config().logs,
+                               '%s.log' % name)
+        trace = '%s\n%s' % (trace, _("See the build log in %s") % logfile)
+        failures.append(BuildStepError(name, step, trace))
+        m.error(_("Recipe '%s' failed at the build step '%s'") % (name, step))
+        if running:
+            m.message(_("Waiting for %d running recipes to finish") %
+                      len(running))
+
+    def _recipe_needs_build(self, recipe):
+        '''
+        Whether a recipe needs to be built, as decided when the build
+        started. The interfaces of its dependencies are checked again the
+        first time it's called, once they are built, and the workers get
+        the decision already made by the main process.
+        '''
+        name = recipe.name
+        if name not in self._needs_build:
+            self._needs_build[name] = self._check_needs_build(recipe)
+        elif name not in self._ready and self._interface_changed(recipe):
+            self._needs_build[name] = True
+        self._ready.add(name)
+        return self._needs_build[name]
+
+    def _check_needs_build(self, recipe):
+        if self.scratch is not None and self.scratch.is_lost(recipe):
+            m.message(_("The build tree of %s in the scratch space is gone, "
+                        "extracting it again") % recipe.name)
+            self.scratch.release(recipe)
+            self.cookbook.reset_steps(recipe.name, self._tree_steps(recipe))
+        if self.force:
+            return True
+        if self._interface_changed(recipe):
+            return True
+        return self.cookbook.recipe_needs_build(recipe.name)
+
+    def _interface_changed(self, recipe):
+        # Recipes are only rebuilt for their dependencies when the public
+        # interface they were built against changed
+        changed = self.cookbook.changed_deps_interfaces(recipe.name)
+        if not changed:
+            return False
+        m.message(_("%s needs to be rebuilt, the interface of %s "
+                    "changed") % (recipe.name, ', '.join(changed)))
+        self.cookbook.reset_recipe_status(recipe.name)
+        return True
 
     def _cook_recipe(self, recipe, count, total):
-        if not self.cookbook.recipe_needs_build(recipe.name) and \
-                not self.force:
+        if not self._recipe_needs_build(recipe):
             m.build_step(count, total, recipe.name, _("already built"))
             return
 
-        if self.missing_files:
-            # create a temp file that will be used to find newer files
-            tmp = tempfile.NamedTemporaryFile()
+        if self._prefetcher is not None:
+            self._prefetcher.wait(recipe)
+
+        start = time.time()
+        steps = [step for desc, step in recipe.steps]
+        install_steps = []
+        if BuildSteps.INSTALL[1] in steps:
+            install_steps = steps[steps.index(BuildSteps.INSTALL[1]):]
+        tracked = self._tracks_installed_files(recipe)
+        # temp file used to find the files installed by recipes without a
+        # manifest
+        tmp = None
+        restored = False
+        cooked = False
+        # Workers only send the status updates to the main process, their
+        # copy of the cookbook doesn't have the new manifest
+        manifest = None
 
         recipe.force = self.force
-        for desc, step in recipe.steps:
-            m.build_step(count, total, recipe.name, step)
-            # check if the current step needs to be done
-            if self.cookbook.step_done(recipe.name, step) and not self.force:
-                m.action(_("Step done"))
-                continue
+        if self.ccache is not None:
+            self.ccache.start_recipe(recipe)
+        try:
+            for step in steps:
+                if step in install_steps and not self._installing:
+                    self._start_install()
+                    if not tracked and (self.missing_files or
+                                        self.artifacts is not None):
+                        tmp = tempfile.NamedTemporaryFile()
+                m.build_step(count, total, recipe.name, step)
+                # check if the current step needs to be done
+                if self.cookbook.step_done(recipe.name, step) and \
+                        not self.force:
+                    m.action(_("Step done"))
+                else:
+                    self._run_measured_step(recipe, step,
+                                            step in install_steps, tracked)
+                    if step == BuildSteps.INSTALL[1] and tracked:
+                        manifest = recipe.installed_files
+                        self.cookbook.update_manifest(recipe.name, manifest)
+                if step == BuildSteps.FETCH[1] and self._restore(recipe):
+                    restored = True
+                    if tracked:
+                        manifest = self.artifacts.recipe_files(recipe)
+                    break
+            if tracked and manifest is None:
+                # installed in a previous build
+                manifest = self.cookbook.recipe_manifest(recipe.name)
+            self.cookbook.update_build_status(recipe.name,
+                                              recipe.built_version())
+            self._update_interface(recipe, manifest)
+            cooked = True
+            # The build tree is kept when the build fails to debug it
+            if self.scratch is not None and self.scratch.clean(recipe):
+                self.cookbook.reset_steps(recipe.name,
+                                          self._tree_steps(recipe))
+
+            if restored or not (self.missing_files or
+                                self.artifacts is not None):
+                return
+            if tracked:
+                files = manifest
+                if files is None:
+                    # installed before manifests were recorded
+                    return
+                prefix_files = files
+            elif tmp is not None:
+                prefix = self.cookbook.get_config().prefix
+                files = shell.find_newer_files(recipe.config.prefix,
+                                               tmp.name)
+                prefix_files = files
+                if recipe.config.prefix != prefix:
+                    prefix_files = shell.find_newer_files(prefix, tmp.name)
+            else:
+                return
+            if self.artifacts is not None:
+                self.artifacts.store(recipe, prefix_files,
+                                     time.time() - start)
+            if self.missing_files:
+                self._print_missing_files(recipe, files)
+        finally:
+            if tmp is not None:
+                tmp.close()
+            self._finish_install()
+            if self.ccache is not None:
+                self.ccache.finish_recipe(recipe)
+            # Restored recipes would spoil the build time estimates
+            if self.metrics is not None and not restored:
+                self.metrics.add_recipe(self._run, recipe.name, start,
+                                        time.time() - start, cooked)
+
+    def _update_interface(self, recipe, files):
+        deps = self.cookbook.list_recipe_deps(recipe.name)
+        deps_interfaces = dict([(x.name,
+                                 self.cookbook.recipe_interface(x.name))
+                                for x in deps if x.name != recipe.name])
+        self.cookbook.update_interface(recipe.name,
+            interface_fingerprint(recipe, files), deps_interfaces)
+
+    def _tracks_installed_files(self, recipe):
+        # The manifest lists the files installed by the install step, but
+        # not the ones a custom post install step could add
+        return recipe.can_stage_install() and not recipe.has_post_install()
+
+    def _run_measured_step(self, recipe, step, installs, tracked):
+        '''
+        Runs a step recording the resources it used in the metrics database
+        '''
+        if self.metrics is None:
+            self._run_step(recipe, step)
+            return
+        meter = StepMeter(installs and recipe.config.prefix or None)
+        success = False
+        try:
+            self._run_step(recipe, step)
+            success = True
+        finally:
+            files = None
+            if installs and tracked:
+                # Only the install step adds files, listed in its manifest
+                files = []
+                if success and step == BuildSteps.INSTALL[1]:
+                    files = recipe.installed_files or []
+            self.metrics.add_step(self._run, recipe.name, step,
+                                  meter.stop(success, files))
+
+    def _run_step(self, recipe, step):
+        try:
+            # call step function
+            stepfunc = getattr(recipe, step)
+            if not stepfunc:
+                raise FatalError(_('Step %s not found') % step)
+            # Steps like configure modify the recipe attributes they use,
+            # the inputs are the ones of the recipe as it's loaded
+            fingerprint = recipe.step_fingerprint(step)
+            if step == BuildSteps.EXTRACT[1] and self.scratch is not None:
+                self.scratch.release(recipe)
+            if step == BuildSteps.COMPILE[1]:
+                self._compile(recipe, stepfunc)
+            else:
+                stepfunc()
+            # The tree is moved before it's configured, as the build files
+            # can use its absolute path
+            if step == BuildSteps.EXTRACT[1] and self.scratch is not None:
+                self.scratch.place(recipe)
+            # update status successfully
+            self.cookbook.update_step_status(recipe.name, step, fingerprint)
+        except FatalError:
+            self._handle_build_step_error(recipe, step)
+        except Exception:
+            raise BuildStepError(recipe, step, traceback.format_exc())
 
+    def _compile(self, recipe, stepfunc):
+        '''
+        Runs the compile step taking a token from the jobserver, which
+        stands for the job make runs without a token. The make processes of
+        the recipe join the jobserver to run more jobs, unless the recipe
+        can't be built in parallel.
+        '''
+        # Only recipes with a make build type can be built in parallel, the
+        # rest run a single job without taking tokens
+        if self.jobserver is None or \
+                not getattr(recipe, 'allow_parallel_build', False):
+            stepfunc()
+            return
+        config = self.cookbook.get_config()
+        makeflags = os.environ.get(jobserver.MAKEFLAGS, None)
+        if recipe.name in self._make_jobs:
+            limit = self._make_jobs[recipe.name]
+        else:
+            limit = self._limit_make_jobs(recipe)
+        if limit is not None:
+            # The recipe runs its own jobs with all the tokens they need,
+            # without sharing them with the other recipes
+            tokens = min(limit, self.jobserver.jobs)
+            flags = '%s -j%d' % (jobserver.serial_makeflags(makeflags),
+                                 tokens)
+        else:
+            tokens = 1
+            flags = self.jobserver.makeflags(makeflags)
+        self.jobserver.acquire(tokens)
+        try:
+            config.set_build_env(jobserver.MAKEFLAGS, flags.strip())
             try:
-                # call step function
-                stepfunc = getattr(recipe, step)
-                if not stepfunc:
-                    raise FatalError(_('Step %s not found') % step)
                 stepfunc()
-                # update status successfully
-                self.cookbook.update_step_status(recipe.name, step)
-            except FatalError:
-                self._handle_build_step_error(recipe, step)
-            except Exception:
-                raise BuildStepError(recipe, step, traceback.format_exc())
-        self.cookbook.update_build_status(recipe.name, recipe.built_version())
+            finally:
+                config.set_build_env(jobserver.MAKEFLAGS, makeflags)
+        finally:
+            self.jobserver.release(tokens)
 
-        if self.missing_files:
-            self._print_missing_files(recipe, tmp)
-            tmp.close()
+    def _limit_make_jobs(self, recipe):
+        if self.admission is None or \
+                not getattr(recipe, 'allow_parallel_build', False):
+            return None
+        return self.admission.make_jobs(recipe.name)
+
+    def _tree_steps(self, recipe):
+        # Steps using the build tree, which need to be run again when it's
+        # removed
+        return [x[1] for x in recipe.steps if x[1] != BuildSteps.FETCH[1]]
+
+    def _start_install(self):
+        # Recipes cooked in parallel install into the shared prefix one at
+        # a time, which also lets us track the files installed by each one
+        if self._install_lock is not None:
+            self._install_lock.acquire()
+        self._installing = True
+
+    def _finish_install(self):
+        if self._installing and self._install_lock is not None:
+            self._install_lock.release()
+        self._installing = False
+
+    def _restore(self, recipe):
+        '''
+        Restores a recipe from the artifacts cache, marking all its steps
+        as done
+        '''
+        if self.artifacts is None or self.force:
+            return False
+        self._start_install()
+        try:
+            if not self.artifacts.restore(recipe):
+                return False
+        finally:
+            self._finish_install()
+        files = self.artifacts.recipe_files(recipe)
+        if files is not None and self._tracks_installed_files(recipe):
+            self.cookbook.update_manifest(recipe.name, files)
+        for desc, step in recipe.steps:
+            if not self.cookbook.step_done(recipe.name, step):
+                self.cookbook.update_step_status(recipe.name, step,
+                        recipe.step_fingerprint(step))
+        return True
 
     def _handle_build_step_error(self, recipe, step):
         if step in [BuildSteps.FETCH, BuildSteps.EXTRACT]:
@@ -121,10 +669,9 @@ class Oven (object):
             self.cookbook.reset_recipe_status(recipe.name)
         raise BuildStepError(recipe, step)
 
-    def _print_missing_files(self, recipe, tmp):
+    def _print_missing_files(self, recipe, files):
         recipe_files = set(recipe.files_list())
-        installed_files = set(shell.find_newer_files(recipe.config.prefix,
-                                                     tmp.name))
+        installed_files = set(files)
         not_in_recipe = list(installed_files - recipe_files)
         not_installed = list(recipe_files - installed_files)
 
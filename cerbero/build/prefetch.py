@@ -0,0 +1,185 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import os
+import subprocess
+import multiprocessing
+import traceback
+
+from cerbero.build.recipe import BuildSteps
+from cerbero.build.scratch import ScratchSpace
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+DEFAULT_PREFETCH_JOBS = 2
+
+# Cookbook used by the prefetch workers, which is inherited when the pool
+# forks them
+_cookbook = None
+
+
+def _init_worker(logfile):
+    # Run with the lowest CPU and I/O priority to not slow down the recipes
+    # being built
+    try:
+        os.nice(19)
+    except OSError:
+        pass
+    try:
+        subprocess.call(['ionice', '-c', '3', '-p', str(os.getpid())],
+                        stdout=open(os.devnull, 'w'),
+                        stderr=subprocess.STDOUT)
+    except OSError:
+        pass
+    fd = os.open(logfile, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+    os.dup2(fd, 1)
+    os.dup2(fd, 2)
+    os.close(fd)
+
+
+def _prefetch_recipe(recipe_name, steps):
+    done = []
+    try:
+        recipe = _cookbook.get_recipe(recipe_name)
+        scratch = None
+        if BuildSteps.EXTRACT[1] in steps:
+            scratch = ScratchSpace.from_config(_cookbook.get_config())
+        for step in steps:
+            m.action(_("Prefetching %s: %s") % (recipe_name, step))
+            if step == BuildSteps.EXTRACT[1] and scratch is not None:
+                scratch.release(recipe)
+            getattr(recipe, step)()
+            if step == BuildSteps.EXTRACT[1] and scratch is not None:
+                scratch.place(recipe)
+            done.append(step)
+    except Exception:
+        return (recipe_name, done, traceback.format_exc())
+    return (recipe_name, done, None)
+
+
+class Prefetcher (object):
+    '''
+    Runs the fetch step, and optionally the extract one, of the recipes
+    that are going to be built in a pool of background processes with a low
+    priority, while the current recipe is being built.
+
+    The completed steps are recorded in the cookbook so that they are
+    skipped when the recipe is cooked. Prefetch errors are only reported
+    when the recipe is reached, and the steps that failed are run again
+    as usual.
+
+    @ivar cookbook: cookbook with the recipes status
+    @type cookbook: L{cerbero.build.cookbook.CookBook}
+    @ivar extract: also extract the sources
+    @type extract: bool
+    @ivar jobs: number of background processes
+    @type jobs: int
+    '''
+
+    def __init__(self, cookbook, extract=False, jobs=DEFAULT_PREFETCH_JOBS):
+        self.cookbook = cookbook
+        self.extract = extract
+        self.jobs = jobs
+        self._pool = None
+        self._results = {}  # recipe name -> AsyncResult
+        self._errors = {}  # recipe name -> error
+
+    def start(self, recipes):
+        '''
+        Starts fetching the sources of the recipes in the background,
+        in the same order they are going to be built.
+
+        @param recipes: list of recipes to prefetch
+        @type recipes: list
+        '''
+        global _cookbook
+        _cookbook = self.cookbook
+        logfile = os.path.join(self.cookbook.get_config().logs,
+                               'prefetch.log')
+        if not os.path.exists(os.path.dirname(logfile)):
+            os.makedirs(os.path.dirname(logfile))
+        self._pool = multiprocessing.Pool(self.jobs, _init_worker,
+                                          (logfile, ))
+        for recipe in recipes:
+            steps = self._steps(recipe)
+            if not steps:
+                continue
+            self._results[recipe.name] = self._pool.apply_async(
+                _prefetch_recipe, (recipe.name, steps))
+        self._pool.close()
+
+    def collect(self):
+        '''
+        Records in the cookbook the recipes already prefetched, without
+        blocking
+        '''
+        for name in [x for x in self._results if self._results[x].ready()]:
+            self._record(self._results.pop(name).get())
+
+    def wait(self, recipe):
+        '''
+        Waits for the prefetch of a recipe to finish, recording its status.
+        Reports the error if the prefetch failed, in which case the steps
+        that failed must be run again.
+
+        @param recipe: recipe to wait for
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        '''
+        if recipe.name in self._results:
+            if not self._results[recipe.name].ready():
+                m.action(_("Waiting for %s sources to be prefetched") %
+                         recipe.name)
+            self._record(self._results.pop(recipe.name).get())
+        self.collect()
+        if recipe.name in self._errors:
+            m.warning(_("Prefetching %s failed, retrying:\n%s") %
+                      (recipe.name, self._errors.pop(recipe.name)))
+
+    def stop(self):
+        '''
+        Stops the background processes, discarding pending prefetches
+        '''
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self._results = {}
+
+    def _steps(self, recipe):
+        candidates = [BuildSteps.FETCH[1]]
+        if self.extract:
+            candidates.append(BuildSteps.EXTRACT[1])
+        steps = []
+        for desc, step in recipe.steps:
+            if step not in candidates:
+                continue
+            if self.cookbook.step_done(recipe.name, step):
+                continue
+            steps.append(step)
+        return steps
+
+    def _record(self, result):
+        name, done, error = result
+        recipe = self.cookbook.get_recipe(name)
+        for step in done:
+            self.cookbook.update_step_status(name, step,
+                                             recipe.step_fingerprint(step))
+        if error is not None:
+            self._errors[name] = error
@@ -17,13 +17,20 @@
 # Boston, MA 02111-1307, USA.
 
 import os
+import pickle
+import hashlib
 import logging
+import multiprocessing
 import shutil
+import signal
 import tempfile
 import time
+import traceback
+from Queue import Empty
 
 from cerbero.build import build, source
 from cerbero.build.filesprovider import FilesProvider
+from cerbero.build.tarballstore import TarballStore
 from cerbero.config import Platform
 from cerbero.errors import FatalError
 from cerbero.ide.vs.genlib import GenLib
@@ -84,6 +91,40 @@ class BuildSteps(object):
                 BuildSteps.POST_INSTALL]
 
 
+# Recipe attributes each step depends on. A step needs to be run again when
+# any of them changes, and so do the steps after it.
+STEP_INPUTS = {
+    BuildSteps.FETCH[1]: ['version', 'url', 'tarball_name', 'remotes',
+                          'commit', 'revision'],
+    BuildSteps.EXTRACT[1]: ['tarball_dirname', 'strip', 'patches'],
+    BuildSteps.CONFIGURE[1]: ['config_sh', 'configure_tpl',
+                              'configure_options', 'autoreconf',
+                              'autoreconf_sh', 'new_env', 'append_env',
+                              'use_system_libs', 'srcdir'],
+    BuildSteps.COMPILE[1]: ['make', 'allow_parallel_build'],
+    BuildSteps.INSTALL[1]: ['make_install', 'stage_install',
+                            'install_prefix'],
+}
+# Attributes added after the ones above, only part of the inputs when
+# they are set, so that adding them doesn't restart every recipe
+OPTIONAL_STEP_INPUTS = {
+    BuildSteps.FETCH[1]: ['tarball_checksum'],
+    BuildSteps.EXTRACT[1]: ['git_sparse_paths'],
+}
+
+
+def _code_fingerprint(code):
+    # The bytecode and constants of a function, without the line numbers,
+    # so that moving a method around the recipe does not change it
+    parts = [code.co_code, repr(code.co_names)]
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            parts.append(_code_fingerprint(const))
+        else:
+            parts.append(repr(const))
+    return '\n'.join(parts)
+
+
 class Recipe(FilesProvider):
     '''
     Base class for recipes.
@@ -107,6 +148,9 @@ class Recipe(FilesProvider):
     @type platform_deps: dict
     @cvar runtime_dep: runtime dep common to all recipes
     @type runtime_dep: bool
+    @cvar memory_hint: memory in MB used by the heaviest job of the build,
+                       used to schedule it until it's measured
+    @type memory_hint: int
     '''
 
     __metaclass__ = MetaRecipe
@@ -122,6 +166,7 @@ class Recipe(FilesProvider):
     platform_deps = None
     force = False
     runtime_dep = False
+    memory_hint = None
     _default_steps = BuildSteps()
 
     def __init__(self, config):
@@ -171,6 +216,14 @@ class Recipe(FilesProvider):
         '''
         pass
 
+    def has_post_install(self):
+        '''
+        Whether the recipe defines its own post installation step, which
+        might install files
+        '''
+        return type(self).post_install.im_func is not \
+            Recipe.post_install.im_func
+
     def built_version(self):
         '''
         Gets the current built version of the recipe.
@@ -195,6 +248,65 @@ class Recipe(FilesProvider):
             deps.extend(self.platform_deps[self.config.target_platform])
         return deps
 
+    def step_fingerprint(self, step):
+        '''
+        Gets a fingerprint of the inputs of a step: the recipe attributes it
+        uses, listed in L{STEP_INPUTS} and L{OPTIONAL_STEP_INPUTS}, the
+        contents of the patches and the checksum of the tarball, hashing it
+        only if it's not declared nor in the tarball store, for the extract
+        step, the dependencies for the configure step, and the code
+        of the step when the recipe overrides it.
+
+        It's saved in the cookbook when the step is done, so that after
+        editing a recipe the build restarts from the first step whose
+        fingerprint changed.
+
+        @param step: name of the step
+        @type step: str
+        @return: the fingerprint
+        @rtype: str
+        '''
+        inputs = [step, self.stype.__name__, self.btype.__name__]
+        for attr in STEP_INPUTS.get(step, []):
+            value = getattr(self, attr, None)
+            if isinstance(value, dict):
+                value = sorted(value.items())
+            inputs.append('%s=%r' % (attr, value))
+        for attr in OPTIONAL_STEP_INPUTS.get(step, []):
+            value = getattr(self, attr, None)
+            if value is not None:
+                inputs.append('%s=%r' % (attr, value))
+        if step == BuildSteps.EXTRACT[1]:
+            paths = [x for x in getattr(self, 'patches', [])]
+            checksum = getattr(self, 'tarball_checksum', None)
+            url = getattr(self, 'url', None)
+            if checksum is None and url is not None:
+                store = TarballStore.from_config(self.config)
+                if store is not None:
+                    checksum = store.url_checksum(url)
+            if checksum is not None:
+                # The checksum of the tarball was verified or computed when
+                # it was downloaded, no need to hash it again
+                inputs.append(checksum)
+            elif getattr(self, 'download_path', None) is not None:
+                paths.append(self.download_path)
+            for path in paths:
+                if not os.path.isabs(path):
+                    path = self.relative_path(path)
+                if os.path.isfile(path):
+                    inputs.append(shell.file_hash(path).encode('hex'))
+        elif step == BuildSteps.CONFIGURE[1]:
+            inputs.append('deps=%r' % sorted(self.list_deps()))
+        # Steps implemented in the recipe itself
+        for cls in type(self).__mro__:
+            if cls.__module__.startswith('cerbero.'):
+                break
+            func = cls.__dict__.get(step)
+            if func is not None and hasattr(func, 'func_code'):
+                inputs.append(_code_fingerprint(func.func_code))
+                break
+        return hashlib.sha1('\n'.join(inputs)).hexdigest()
+
     def list_licenses_by_categories(self, categories):
         licenses = {}
         for c in categories:
@@ -258,6 +370,25 @@ class Recipe(FilesProvider):
         self._steps = [x for x in self._steps if x not in steps]
 
 
+def _recipe_state(recipe):
+    '''
+    Gets the attributes of a recipe a step can change, pickled, so that the
+    worker processes running the steps can send back the changed ones. The
+    configuration is not part of it, as it's shared with the main process.
+    '''
+    state = {}
+    for name, value in vars(recipe).iteritems():
+        if name == 'config':
+            continue
+        try:
+            # Unlike the newer ones, the first protocol refuses objects that
+            # can't be sent to another process, like open files
+            state[name] = pickle.dumps(value)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            pass
+    return state
+
+
 class MetaUniversalRecipe(type):
     '''
     Wraps all the build steps for the universal recipe to be called for each
@@ -265,9 +396,8 @@ class MetaUniversalRecipe(type):
     '''
 
     def __init__(cls, name, bases, ns):
-        step_func = ns.get('_do_step')
         for _, step in BuildSteps():
-            setattr(cls, step, lambda self, name=step: step_func(self, name))
+            setattr(cls, step, lambda self, name=step: self._do_step(name))
 
 
 class UniversalRecipe(object):
@@ -305,6 +435,25 @@ class UniversalRecipe(object):
     def is_empty(self):
         return len(self._recipes) == 0
 
+    @property
+    def installed_files(self):
+        '''
+        Files installed by the last install of all the architectures,
+        relative to the prefix, or None if they are not known for any of
+        them
+        '''
+        files = set()
+        for arch, recipe in self._recipes.iteritems():
+            arch_files = getattr(recipe, 'installed_files', None)
+            if arch_files is None:
+                return None
+            files.update(self._arch_installed_files(arch, arch_files))
+        return sorted(files)
+
+    def _arch_installed_files(self, arch, files):
+        # All the architectures are installed in the same prefix
+        return files
+
     @property
     def steps(self):
         if self.is_empty():
@@ -325,13 +474,102 @@ class UniversalRecipe(object):
                 setattr(o, name, value)
 
     def _do_step(self, step):
+        if self._parallel_step(step):
+            self._run_parallel(step)
+            return
         for arch, recipe in self._recipes.iteritems():
-            config = self._config.arch_config[arch]
-            config.do_setup_env()
-            stepfunc = getattr(recipe, step)
+            self._run_arch_step(step, arch, recipe)
 
-            # Call the step function
-            stepfunc()
+    def _run_arch_step(self, step, arch, recipe):
+        config = self._config.arch_config[arch]
+        config.do_setup_env()
+        stepfunc = getattr(recipe, step)
+
+        # Call the step function
+        stepfunc()
+
+    def _parallel_step(self, step):
+        '''
+        Whether all the architectures can run this step at the same time,
+        each one in its own worker process with its own environment
+
+        @param step: name of the step
+        @type step: str
+        @return: True if the step can be run in parallel
+        @rtype: bool
+        '''
+        if len(self._recipes) < 2 or self._config.platform == Platform.WINDOWS:
+            return False
+        # The sources are fetched in the local sources directory, which is
+        # shared by all the architectures
+        return step != BuildSteps.FETCH[1]
+
+    def _run_parallel(self, step):
+        results = multiprocessing.Queue()
+        workers = {}
+        try:
+            for arch, recipe in self._recipes.iteritems():
+                worker = multiprocessing.Process(target=self._arch_worker,
+                    args=(step, arch, recipe, results))
+                worker.start()
+                workers[arch] = worker
+            failed = self._wait_workers(workers, results)
+        finally:
+            # Stop the workers still running if any of them failed
+            for worker in workers.values():
+                self._stop_worker(worker)
+        if failed is not None:
+            raise FatalError(_("Step %s failed for the architecture %s") %
+                             (step, failed))
+
+    def _arch_worker(self, step, arch, recipe, results):
+        # Runs in a new process group, so that stopping the worker stops the
+        # commands it spawned too
+        os.setpgrp()
+        try:
+            state = _recipe_state(recipe)
+            self._run_arch_step(step, arch, recipe)
+            # The step runs in a copy of the recipe, the attributes it
+            # changed, like the configure options or the installed files,
+            # are sent back for the next steps
+            changed = {}
+            for name, value in _recipe_state(recipe).iteritems():
+                if state.get(name) != value:
+                    changed[name] = getattr(recipe, name)
+        except Exception:
+            trace = traceback.format_exc()
+            m.error('%s: %s' % (arch, trace))
+            results.put((arch, None, trace))
+        else:
+            results.put((arch, changed, None))
+
+    def _wait_workers(self, workers, results):
+        # Returns the architecture of the first worker failing, if any
+        pending = set(workers.keys())
+        while pending:
+            try:
+                arch, changed, trace = results.get(timeout=1)
+            except Empty:
+                # A worker could have died without reporting. The results of
+                # the finished workers are in the queue once they are dead.
+                dead = [x for x in pending if not workers[x].is_alive()]
+                if dead and results.empty():
+                    return dead[0]
+                continue
+            pending.discard(arch)
+            if trace is not None:
+                return arch
+            vars(self._recipes[arch]).update(changed)
+        return None
+
+    def _stop_worker(self, worker):
+        if worker.is_alive():
+            try:
+                os.killpg(worker.pid, signal.SIGTERM)
+            except OSError:
+                # the worker didn't create its process group yet
+                worker.terminate()
+        worker.join()
 
 
 class UniversalFlatRecipe(UniversalRecipe):
@@ -374,54 +612,80 @@ class UniversalFlatRecipe(UniversalRecipe):
             generator.merge_files(ainputs,
                     [os.path.join(self._config.prefix, arch)])
 
-    def _do_step(self, step):
+    def _arch_installed_files(self, arch, files):
+        # The files are installed in the architecture prefix and merged in
+        # the prefix
+        return files + [os.path.join(arch, f) for f in files]
+
+    def _parallel_step(self, step):
+        if not UniversalRecipe._parallel_step(self, step):
+            return False
+        # Installs without a staging directory are listed from the files
+        # added to the shared prefix, one architecture at a time
+        recipes = self._recipes.values()
+        if step == BuildSteps.INSTALL[1]:
+            return all([r.can_stage_install() for r in recipes])
+        if step == BuildSteps.POST_INSTALL[1]:
+            return not any([r.has_post_install() for r in recipes])
+        return True
+
+    def _run_arch_step(self, step, arch, recipe):
         # For the universal build we need to configure both architectures with
         # with the same final prefix, but we want to install each architecture
         # on a different path (eg: /path/to/prefix/x86).
 
         archs_prefix = self._recipes.keys()
 
-        for arch, recipe in self._recipes.iteritems():
-            config = self._config.arch_config[arch]
-            config.do_setup_env()
-            stepfunc = getattr(recipe, step)
-
-            # Create a stamp file to list installed files based on the
-            # modification time of this file
-            if step in [BuildSteps.INSTALL[1], BuildSteps.POST_INSTALL[1]]:
-                time.sleep(2) #wait 2 seconds to make sure new files get the
-                              #proper time difference, this fixes an issue of
-                              #the next recipe to be built listing the previous
-                              #recipe files as their own
-                tmp = tempfile.NamedTemporaryFile()
-                # the modification time resolution depends on the filesystem,
-                # where FAT32 has a resolution of 2 seconds and ext4 1 second
-                t = time.time() - 2
-                os.utime(tmp.name, (t, t))
-
-            # Call the step function
-            stepfunc()
+        config = self._config.arch_config[arch]
+        config.do_setup_env()
+        stepfunc = getattr(recipe, step)
 
-            # Move installed files to the architecture prefix
-            if step in [BuildSteps.INSTALL[1], BuildSteps.POST_INSTALL[1]]:
-                installed_files = shell.find_newer_files(self._config.prefix,
-                                                         tmp.name, True)
-                tmp.close()
-                for f in installed_files:
-
-                    def not_in_prefix(src):
-                        for p in archs_prefix + ['Libraries']:
-                            if src.startswith(p):
-                                return True
-                        return False
-
-                    # skip files that are installed in the arch prefix
-                    if not_in_prefix(f):
-                        continue
-                    src = os.path.join(self._config.prefix, f)
-
-                    dest = os.path.join(self._config.prefix,
-                                        recipe.config.target_arch, f)
-                    if not os.path.exists(os.path.dirname(dest)):
-                        os.makedirs(os.path.dirname(dest))
-                    shutil.move(src, dest)
+        if step == BuildSteps.INSTALL[1] and recipe.can_stage_install():
+            # Merge the staged files directly in the architecture prefix
+            recipe.install_prefix = os.path.join(self._config.prefix,
+                                                 recipe.config.target_arch)
+            stepfunc()
+            return
+        if step == BuildSteps.POST_INSTALL[1] and \
+                not recipe.has_post_install():
+            return
+
+        # Create a stamp file to list installed files based on the
+        # modification time of this file
+        if step in [BuildSteps.INSTALL[1], BuildSteps.POST_INSTALL[1]]:
+            time.sleep(2) #wait 2 seconds to make sure new files get the
+                          #proper time difference, this fixes an issue of
+                          #the next recipe to be built listing the previous
+                          #recipe files as their own
+            tmp = tempfile.NamedTemporaryFile()
+            # the modification time resolution depends on the filesystem,
+            # where FAT32 has a resolution of 2 seconds and ext4 1 second
+            t = time.time() - 2
+            os.utime(tmp.name, (t, t))
+
+        # Call the step function
+        stepfunc()
+
+        # Move installed files to the architecture prefix
+        if step in [BuildSteps.INSTALL[1], BuildSteps.POST_INSTALL[1]]:
+            installed_files = shell.find_newer_files(self._config.prefix,
+                                                     tmp.name, True)
+            tmp.close()
+            for f in installed_files:
+
+                def not_in_prefix(src):
+                    for p in archs_prefix + ['Libraries']:
+                        if src.startswith(p):
+                            return True
+                    return False
+
+                # skip files that are installed in the arch prefix
+                if not_in_prefix(f):
+                    continue
+                src = os.path.join(self._config.prefix, f)
+
+                dest = os.path.join(self._config.prefix,
+                                    recipe.config.target_arch, f)
+                if not os.path.exists(os.path.dirname(dest)):
+                    os.makedirs(os.path.dirname(dest))
+                shutil.move(src, dest)
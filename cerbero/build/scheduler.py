@@ -0,0 +1,197 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import heapq
+from collections import defaultdict
+
+from cerbero.errors import FatalError
+from cerbero.utils import _
+
+
+def longest_paths(names, deps, weights=None):
+    '''
+    Computes for each node of a dependency graph the length of the longest
+    path of nodes that depend on it, including the node itself.
+
+    @param names: list of nodes in build order (dependencies first)
+    @type names: list
+    @param deps: node name -> list of dependencies of this node
+    @type deps: dict
+    @param weights: node name -> weight of the node, defaults to 1
+    @type weights: dict
+    @return: node name -> length of the longest remaining path
+    @rtype: dict
+    '''
+    weights = weights or {}
+    rdeps = defaultdict(set)
+    for name in names:
+        for dep in deps.get(name, []):
+            rdeps[dep].add(name)
+    paths = {}
+    # Walking the build order backwards ensures that all the reverse
+    # dependencies of a node are processed before the node itself
+    for name in reversed(names):
+        tail = [paths[x] for x in rdeps[name]]
+        paths[name] = weights.get(name, 1) + max(tail or [0])
+    return paths
+
+
+def critical_path(names, deps, weights=None):
+    '''
+    Gets the critical path of a dependency graph, the chain of dependent
+    nodes with the highest weight, which bounds the time needed to build it
+    no matter how many nodes are built at the same time.
+
+    @param names: list of nodes in build order (dependencies first)
+    @type names: list
+    @param deps: node name -> list of dependencies of this node
+    @type deps: dict
+    @param weights: node name -> weight of the node, defaults to 1
+    @type weights: dict
+    @return: list of nodes in the path, dependencies first
+    @rtype: list
+    '''
+    if not names:
+        return []
+    paths = longest_paths(names, deps, weights)
+    rdeps = defaultdict(set)
+    for name in names:
+        for dep in deps.get(name, []):
+            rdeps[dep].add(name)
+    order = dict((name, i) for i, name in enumerate(names))
+    # The longest remaining path always continues with the reverse
+    # dependency with the longest remaining path
+    node = max(names, key=lambda x: (paths[x], -order[x]))
+    path = [node]
+    while rdeps[node]:
+        node = max(rdeps[node], key=lambda x: (paths[x], -order[x]))
+        path.append(node)
+    return path
+
+
+def simulate_build(names, deps, weights, jobs):
+    '''
+    Simulates a build of a dependency graph with the same scheduling used
+    to cook recipes in parallel
+
+    @param names: list of nodes in build order (dependencies first)
+    @type names: list
+    @param deps: node name -> list of dependencies of this node
+    @type deps: dict
+    @param weights: node name -> time it takes to build the node
+    @type weights: dict
+    @param jobs: number of nodes built at the same time
+    @type jobs: int
+    @return: the time it takes to build all the nodes
+    @rtype: float
+    '''
+    queue = BuildQueue(names, deps, weights)
+    running = []  # heap of (end time, node name)
+    now = 0
+    while queue.pending() or running:
+        while len(running) < jobs:
+            name = queue.pop()
+            if name is None:
+                break
+            heapq.heappush(running, (now + weights.get(name, 1), name))
+        now, name = heapq.heappop(running)
+        queue.done(name)
+    return now
+
+
+class BuildQueue (object):
+    '''
+    Keeps track of the recipes of a build that are ready to be cooked,
+    which are the ones with all their dependencies already cooked.
+
+    Ready recipes are returned by the length of the longest path of recipes
+    that still need them, so that the recipes in the critical path are
+    started as soon as possible.
+
+    @ivar priorities: recipe name -> length of the longest remaining path
+    @type priorities: dict
+    '''
+
+    def __init__(self, names, deps, weights=None):
+        '''
+        @param names: recipes names in build order (dependencies first)
+        @type names: list
+        @param deps: recipe name -> list of the recipe dependencies
+        @type deps: dict
+        @param weights: recipe name -> estimated cost of the recipe
+        @type weights: dict
+        '''
+        self._order = dict((name, i) for i, name in enumerate(names))
+        self._deps = {}
+        self._rdeps = defaultdict(set)
+        for name in names:
+            self._deps[name] = set([x for x in deps.get(name, [])
+                                    if x in self._order])
+            for dep in self._deps[name]:
+                if self._order[dep] > self._order[name]:
+                    raise FatalError(_("Dependency Cycle"))
+                self._rdeps[dep].add(name)
+        self.priorities = longest_paths(names, self._deps, weights)
+        self._pending = set(names)
+        self._ready = []
+        for name in names:
+            if not self._deps[name]:
+                self._push(name)
+
+    def pop(self, accept=None):
+        '''
+        Gets the next recipe ready to be cooked
+
+        @param accept: function telling whether a recipe can be cooked now,
+                       the recipes rejected stay ready
+        @type accept: function
+        @return: the recipe name or None if no recipe is ready
+        @rtype: str
+        '''
+        for item in sorted(self._ready):
+            name = item[2]
+            if accept is not None and not accept(name):
+                continue
+            self._ready.remove(item)
+            heapq.heapify(self._ready)
+            self._pending.remove(name)
+            return name
+        return None
+
+    def done(self, name):
+        '''
+        Marks a recipe as cooked, which might make ready the recipes
+        depending on it
+
+        @param name: name of the recipe
+        @type name: str
+        '''
+        for rdep in self._rdeps[name]:
+            self._deps[rdep].discard(name)
+            if not self._deps[rdep]:
+                self._push(rdep)
+
+    def pending(self):
+        '''
+        Number of recipes that still need to be returned by L{pop}
+        '''
+        return len(self._pending)
+
+    def _push(self, name):
+        heapq.heappush(self._ready,
+                       (-self.priorities[name], self._order[name], name))
@@ -0,0 +1,185 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+
+from cerbero.config import Platform
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+# Room left in the scratch space for the files generated by the build,
+# relative to the size of the sources
+BUILD_GROWTH = 3
+DEFAULT_MAX_SIZE = 1024
+
+
+def tree_size(path):
+    '''
+    Gets the size in bytes of the files in a directory tree
+    '''
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def build_dirs(recipe):
+    '''
+    Gets the build directories of a recipe, one per architecture for
+    universal recipes
+    '''
+    recipes = getattr(recipe, '_recipes', None)
+    if recipes:
+        return [x.build_dir for x in recipes.values()]
+    return [recipe.build_dir]
+
+
+def is_placed(recipe):
+    '''
+    Whether the build tree of a recipe was moved to a scratch space
+    '''
+    return any([os.path.islink(x) for x in build_dirs(recipe)])
+
+
+def free_space(path):
+    '''
+    Gets the space in bytes available in the file system of a path
+    '''
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+class ScratchSpace (object):
+    '''
+    Builds the recipes with small source trees in a fast scratch file
+    system, like a tmpfs, instead of in the sources directory.
+
+    After the sources are extracted, the tree is moved to the scratch space
+    and replaced with a link, so that the recipes keep using the same build
+    directory. Trees bigger than the maximum size, or not fitting in the
+    scratch space with the files generated by the build, stay on disk.
+
+    The tree is removed once the recipe is built, and kept if the build
+    fails. When it's lost, like after a reboot, the recipe is extracted
+    again.
+
+    @ivar path: directory of the scratch space
+    @type path: str
+    @ivar max_size: maximum size of the sources in bytes
+    @type max_size: int
+    '''
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+    @staticmethod
+    def from_config(config):
+        '''
+        Creates the scratch space of a configuration
+
+        @return: the scratch space or None if it's not enabled
+        @rtype: L{ScratchSpace}
+        '''
+        path = getattr(config, 'scratch_dir', None)
+        if not path or config.platform == Platform.WINDOWS:
+            return None
+        max_size = getattr(config, 'scratch_max_size', None)
+        if max_size is None:
+            max_size = DEFAULT_MAX_SIZE
+        return ScratchSpace(os.path.abspath(path), max_size * 1024 * 1024)
+
+    def scratch_dir(self, build_dir):
+        '''
+        Gets the directory in the scratch space for a build directory
+        '''
+        return os.path.join(self.path, build_dir.lstrip(os.sep))
+
+    def is_lost(self, recipe):
+        '''
+        Whether the build tree of a recipe was in the scratch space but it's
+        gone, and the recipe needs to be extracted again
+        '''
+        return any([os.path.islink(x) and not os.path.exists(x)
+                    for x in build_dirs(recipe)])
+
+    def release(self, recipe):
+        '''
+        Removes the build tree of a recipe from the scratch space, before
+        extracting it again
+        '''
+        for build_dir in build_dirs(recipe):
+            if not os.path.islink(build_dir):
+                continue
+            os.remove(build_dir)
+            scratch_dir = self.scratch_dir(build_dir)
+            if os.path.exists(scratch_dir):
+                shutil.rmtree(scratch_dir)
+
+    def place(self, recipe):
+        '''
+        Moves the extracted tree of a recipe to the scratch space when it
+        fits in it
+
+        @return: True if the tree was moved
+        @rtype: bool
+        '''
+        placed = False
+        for build_dir in build_dirs(recipe):
+            if os.path.islink(build_dir) or not os.path.isdir(build_dir):
+                continue
+            size = tree_size(build_dir)
+            if size > self.max_size:
+                m.message(_("Building %s on disk, its sources are bigger "
+                            "than the scratch space maximum size") %
+                          recipe.name)
+                continue
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            if free_space(self.path) < size * BUILD_GROWTH:
+                m.message(_("Building %s on disk, there is not enough room "
+                            "left in the scratch space") % recipe.name)
+                continue
+            scratch_dir = self.scratch_dir(build_dir)
+            if os.path.exists(scratch_dir):
+                shutil.rmtree(scratch_dir)
+            elif not os.path.exists(os.path.dirname(scratch_dir)):
+                os.makedirs(os.path.dirname(scratch_dir))
+            m.action(_("Building %s in %s") % (recipe.name, scratch_dir))
+            shutil.move(build_dir, scratch_dir)
+            os.symlink(scratch_dir, build_dir)
+            placed = True
+        return placed
+
+    def clean(self, recipe):
+        '''
+        Frees the scratch space used by a recipe after it was built
+
+        @return: True if the build tree was removed
+        @rtype: bool
+        '''
+        if not is_placed(recipe):
+            return False
+        self.release(recipe)
+        return True
@@ -19,8 +19,10 @@
 import os
 import shutil
 
-from cerbero.config import Platform
+from cerbero.config import Platform, FetchPolicy
 from cerbero.utils import git, svn, shell, _
+from cerbero.utils import download
+from cerbero.build.tarballstore import TarballStore
 from cerbero.errors import FatalError, InvalidRecipeError
 import cerbero.utils.messages as m
 
@@ -75,6 +77,8 @@ class Tarball (Source):
     @type patches: list
     @cvar strip: number passed to the --strip 'patch' option
     @type patches: int
+    @cvar tarball_checksum: sha256 checksum of the tarball
+    @type tarball_checksum: str
     '''
 
     url = None
@@ -82,6 +86,7 @@ class Tarball (Source):
     strip = 1
     tarball_name = None
     tarball_dirname = None
+    tarball_checksum = None
 
     def __init__(self):
         Source.__init__(self)
@@ -104,8 +109,12 @@ class Tarball (Source):
                  (self.url, self.download_path))
         if not os.path.exists(self.repo_dir):
             os.makedirs(self.repo_dir)
-        if self.url.startswith('file://'):
-            shutil.copy(self.url[7:], self.download_path)
+        store = TarballStore.from_config(self.config)
+        if store is not None:
+            store.fetch(self.url, self.download_path, self.tarball_checksum,
+                        check_cert=False)
+        elif self.url.startswith('file://'):
+            download.link_file(self.url[7:], self.download_path)
         else:
             shell.download(self.url, self.download_path, check_cert=False)
 
@@ -126,10 +135,28 @@ class Tarball (Source):
 class GitCache (Source):
     '''
     Base class for source handlers using a Git repository
+
+    @cvar remotes: remote name -> url
+    @type remotes: dict
+    @cvar commit: commit, tag or remote branch built
+    @type commit: str
+    @cvar git_fetch_policy: how the repository is fetched, overriding the
+                            one of the configuration
+    @type git_fetch_policy: L{cerbero.enums.FetchPolicy}
+    @cvar git_sparse_paths: patterns of the paths checked out, like
+                            '/src/', to skip the rest of huge repositories
+    @type git_sparse_paths: list
+
+    With the full fetch policy and the git_mirrors configuration set, the
+    remotes are fetched in mirrors shared by all the recipes using them,
+    once per build session (see L{cerbero.config.Config.start_session}), and
+    the repository of the recipe uses their objects.
     '''
 
     remotes = None
     commit = None
+    git_fetch_policy = None
+    git_sparse_paths = None
 
     def __init__(self):
         Source.__init__(self)
@@ -143,14 +170,60 @@ class GitCache (Source):
     def fetch(self, checkout=True):
         if not os.path.exists(self.repo_dir):
             git.init(self.repo_dir)
+        policy = self.git_fetch_policy or \
+            getattr(self.config, 'git_fetch_policy', None) or FetchPolicy.FULL
+        mirrors = None
+        if policy == FetchPolicy.FULL:
+            mirrors = getattr(self.config, 'git_mirrors', None)
         for remote, url in self.remotes.iteritems():
-            git.add_remote(self.repo_dir, remote, url)
-        # fetch remote branches
-        git.fetch(self.repo_dir, fail=False)
+            git.add_remote(self.repo_dir, remote, url,
+                           fetch=policy == FetchPolicy.FULL and not mirrors)
+        commit = self.config.recipe_commit(self.name) or self.commit
+        if mirrors:
+            self._fetch_mirrors(mirrors)
+        elif policy == FetchPolicy.FULL:
+            # fetch remote branches
+            git.fetch(self.repo_dir, fail=False)
+        else:
+            # built_version() uses the commit of the recipe
+            for c in sorted(set([x for x in [commit, self.commit] if x])):
+                self._fetch_commit(c, policy)
         if checkout:
-            commit = self.config.recipe_commit(self.name) or self.commit
+            git.sparse_checkout(self.repo_dir, self.git_sparse_paths)
             git.checkout(self.repo_dir, commit)
 
+    def _fetch_mirrors(self, mirrors):
+        # Recipes using the same remotes, like the static variants of the
+        # GStreamer ones, share the objects of a mirror of each remote
+        for remote, url in self.remotes.iteritems():
+            mirror_dir = os.path.join(mirrors, git.mirror_name(url) + '.git')
+            git.update_mirror(mirror_dir, url,
+                              getattr(self.config, 'session_start', None))
+            git.add_alternate(self.repo_dir, os.path.join(mirror_dir,
+                                                          'objects'))
+            git.fetch_mirror(self.repo_dir, mirror_dir, remote, fail=False)
+
+    def _fetch_commit(self, commit, policy):
+        remote, refspec = git.commit_refspec(commit, self.remotes.keys())
+        depth = None
+        blob_filter = None
+        if policy == FetchPolicy.SHALLOW:
+            depth = 1
+        elif policy == FetchPolicy.BLOBLESS:
+            blob_filter = 'blob:none'
+        git.fetch_ref(self.repo_dir, remote, refspec, depth, blob_filter,
+                      fail=False)
+        if git.resolve(self.repo_dir, commit, fail=False) is not None:
+            return
+        # Short hashes, commits not reachable from the tip of a branch, or
+        # servers not allowing to fetch commits by hash
+        m.message(_("%s was not found fetching only %s, fetching the whole "
+                    "history of %s") % (commit, refspec, self.name))
+        git.unshallow(self.repo_dir, fail=False)
+        if git.resolve(self.repo_dir, commit, fail=False) is None:
+            raise FatalError(_("Commit %s of %s was not found in its "
+                               "remotes") % (commit, self.name))
+
     def built_version(self):
         return '%s+git~%s' % (self.version, git.get_hash(self.repo_dir, self.commit))
 
@@ -234,7 +307,8 @@ class Git (GitCache):
             return
 
         # checkout the current version
-        git.local_checkout(self.build_dir, self.repo_dir, self.commit)
+        git.local_checkout(self.build_dir, self.repo_dir, self.commit,
+                           sparse_paths=self.git_sparse_paths)
         return True
 
 
@@ -0,0 +1,120 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+class InstallStaging (object):
+    '''
+    Installs a recipe in a staging directory using DESTDIR and merges it
+    afterwards into the prefix, which gives the exact list of files
+    installed by the recipe.
+
+    @ivar prefix: prefix the recipe is configured with
+    @type prefix: str
+    @ivar staging_dir: directory used as DESTDIR
+    @type staging_dir: str
+    '''
+
+    def __init__(self, recipe):
+        '''
+        @param recipe: the recipe to install
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        '''
+        self.prefix = os.path.abspath(recipe.config.prefix)
+        self.staging_dir = recipe.build_dir + '-staging'
+        self._old_destdir = None
+
+    def start(self):
+        '''
+        Creates an empty staging directory and makes it the DESTDIR used
+        by the install commands
+        '''
+        if os.path.exists(self.staging_dir):
+            shutil.rmtree(self.staging_dir)
+        os.makedirs(self.staging_dir)
+        self._old_destdir = os.environ.get('DESTDIR')
+        os.environ['DESTDIR'] = self.staging_dir
+
+    def finish(self, prefix=None):
+        '''
+        Merges the staging directory into the prefix
+
+        @param prefix: prefix where the files installed in the recipe's
+                       prefix are merged, defaults to the recipe's prefix
+        @type prefix: str
+        @return: files installed in the prefix, relative to it
+        @rtype: list
+        '''
+        self._restore_env()
+        prefix = prefix or self.prefix
+        manifest = []
+        for dirpath, dirnames, filenames in os.walk(self.staging_dir):
+            # symlinks to directories are listed as directories
+            filenames += [d for d in dirnames if
+                          os.path.islink(os.path.join(dirpath, d))]
+            for f in filenames:
+                src = os.path.join(dirpath, f)
+                path = '/' + os.path.relpath(src, self.staging_dir)
+                if path.startswith(self.prefix + '/'):
+                    rel = os.path.relpath(path, self.prefix)
+                    dest = os.path.join(prefix, rel)
+                    manifest.append(rel)
+                else:
+                    # installed outside the prefix
+                    dest = path
+                self._move(src, dest)
+        shutil.rmtree(self.staging_dir)
+        if not manifest:
+            m.warning(_("Nothing was installed in %s, the install commands "
+                        "might not support DESTDIR") % self.staging_dir)
+        return sorted(manifest)
+
+    def abort(self):
+        '''
+        Discards the staging directory after a failed install
+        '''
+        self._restore_env()
+        if os.path.exists(self.staging_dir):
+            shutil.rmtree(self.staging_dir)
+
+    def _restore_env(self):
+        if self._old_destdir is None:
+            os.environ.pop('DESTDIR', None)
+        else:
+            os.environ['DESTDIR'] = self._old_destdir
+
+    def _move(self, src, dest):
+        dirname = os.path.dirname(dest)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        if os.path.lexists(dest) and not os.path.isdir(dest):
+            os.remove(dest)
+        try:
+            os.rename(src, dest)
+        except OSError:
+            # the prefix is in a different filesystem
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dest)
+                os.remove(src)
+            else:
+                shutil.move(src, dest)
@@ -0,0 +1,207 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import hashlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from cerbero.errors import FatalError
+from cerbero.utils import _, shell
+from cerbero.utils import download
+from cerbero.utils import messages as m
+
+
+ALGORITHM = 'sha256'
+
+
+def file_checksum(path):
+    '''
+    Computes the checksum of a file, as used by the tarball store
+    '''
+    digest = hashlib.new(ALGORITHM)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(download.CHUNK_SIZE), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TarballStore (object):
+    '''
+    Content-addressed store of the downloaded tarballs, shared by all the
+    configurations and home directories. The tarballs are saved by their
+    sha256 checksum, which is verified once when they are downloaded, and
+    the download path of the recipes is a link to them.
+
+    Tarballs of recipes without a tarball_checksum are stored too, and
+    found again by their url. They are not downloaded again if the file
+    served at that url changes upstream: such recipes must declare a
+    tarball_checksum, or change their url, to get the new tarball.
+
+    @ivar path: directory of the store
+    @type path: str
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def from_config(config):
+        '''
+        Creates the tarball store of a configuration
+
+        @return: the store or None if it's not enabled
+        @rtype: L{TarballStore}
+        '''
+        path = getattr(config, 'tarball_store', None)
+        if not path:
+            return None
+        return TarballStore(os.path.abspath(path))
+
+    def tarball_path(self, checksum):
+        '''
+        Gets the path of a tarball in the store
+        '''
+        checksum = checksum.lower()
+        return os.path.join(self.path, ALGORITHM, checksum[:2], checksum)
+
+    def fetch(self, url, destination, checksum=None, check_cert=True):
+        '''
+        Makes a tarball available in a path, downloading it to the store if
+        it's not there yet
+
+        @param url: url of the tarball
+        @type url: str
+        @param destination: path linked to the tarball in the store
+        @type destination: str
+        @param checksum: sha256 checksum of the tarball, or None if it's not
+                         known
+        @type checksum: str
+        @return: the checksum of the tarball
+        @rtype: str
+        '''
+        if checksum is None:
+            checksum = self.url_checksum(url)
+        if checksum is not None and self._link(checksum, destination):
+            m.action(_("Using %s from the tarball store") %
+                     os.path.basename(destination))
+            return checksum
+        if os.path.isfile(destination) and not os.path.islink(destination):
+            # Downloaded before the store was used, checked only once
+            digest = file_checksum(destination)
+            if checksum is None or digest == checksum.lower():
+                self._add(destination, digest)
+                self._save_url_checksum(url, digest)
+                self._link(digest, destination)
+                return digest
+        tmp = os.path.join(self.path, 'tmp', hashlib.sha1(url).hexdigest())
+        lock = self._lock(tmp)
+        try:
+            # It could have been downloaded while waiting for the lock
+            stored = checksum or self.url_checksum(url)
+            if stored is not None and self._link(stored, destination):
+                return stored
+            if download.supported(url):
+                digest = download.download(url, tmp, checksum,
+                                           check_cert=check_cert)
+            else:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                if url.startswith('file://'):
+                    download.link_file(url[7:], tmp)
+                else:
+                    shell.download(url, tmp, check_cert=check_cert)
+                digest = file_checksum(tmp)
+                if checksum is not None and digest != checksum.lower():
+                    os.remove(tmp)
+                    raise FatalError(_("The %s checksum of %s is %s instead "
+                                       "of %s") % (ALGORITHM, url, digest,
+                                                   checksum))
+            self._add(tmp, digest)
+            self._save_url_checksum(url, digest)
+        finally:
+            lock.close()
+        self._link(digest, destination)
+        return digest
+
+    def _add(self, path, checksum):
+        stored = self.tarball_path(checksum)
+        if not os.path.exists(os.path.dirname(stored)):
+            os.makedirs(os.path.dirname(stored))
+        if os.path.exists(stored):
+            os.remove(path)
+            return
+        # rename is atomic, the tarball is complete when it's in the store
+        os.rename(path, stored)
+
+    def _link(self, checksum, destination):
+        stored = self.tarball_path(checksum)
+        if not os.path.exists(stored):
+            return False
+        if os.path.islink(destination) and \
+                os.path.realpath(destination) == os.path.realpath(stored):
+            return True
+        if os.path.lexists(destination):
+            os.remove(destination)
+        elif not os.path.exists(os.path.dirname(destination)):
+            os.makedirs(os.path.dirname(destination))
+        if hasattr(os, 'symlink'):
+            os.symlink(stored, destination)
+        else:
+            download.link_file(stored, destination)
+        return True
+
+    def _url_index(self, url):
+        return os.path.join(self.path, 'urls', hashlib.sha1(url).hexdigest())
+
+    def url_checksum(self, url):
+        '''
+        Gets the checksum of the tarball stored for a url
+
+        @param url: url of the tarball
+        @type url: str
+        @return: the checksum or None if it was never downloaded
+        @rtype: str
+        '''
+        index = self._url_index(url)
+        if not os.path.exists(index):
+            return None
+        with open(index, 'r') as f:
+            return f.read().strip() or None
+
+    def _save_url_checksum(self, url, checksum):
+        index = self._url_index(url)
+        if not os.path.exists(os.path.dirname(index)):
+            os.makedirs(os.path.dirname(index))
+        with open(index + '.tmp', 'w') as f:
+            f.write(checksum)
+        if os.path.exists(index):
+            os.remove(index)
+        os.rename(index + '.tmp', index)
+
+    def _lock(self, path):
+        # Other processes, or builds of other home directories, could be
+        # downloading the same tarball
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        lock = open(path + '.lock', 'w')
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
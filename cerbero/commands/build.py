@@ -38,7 +38,13 @@ class Build(Command):
                            'listed in the recipe')),
                 ArgparseArgument('--dry-run', action='store_true',
                     default=False,
-                    help=_('only print commands instead of running them '))]
+                    help=_('only print commands instead of running them ')),
+                ArgparseArgument('-j', '--jobs', type=int, default=1,
+                    help=_('number of recipes to build at the same time')),
+                ArgparseArgument('--prefetch', choices=['fetch', 'extract'],
+                    default=None,
+                    help=_('fetch, or fetch and extract, the sources of the '
+                           'next recipes in the background'))]
             if force is None:
                 args.append(
                     ArgparseArgument('--force', action='store_true',
@@ -61,16 +67,18 @@ class Build(Command):
         if self.no_deps is None:
             self.no_deps = args.no_deps
         self.runargs(config, args.recipe, args.missing_files, self.force,
-                     self.no_deps, dry_run=args.dry_run)
+                     self.no_deps, dry_run=args.dry_run, jobs=args.jobs,
+                     prefetch=args.prefetch)
 
     def runargs(self, config, recipes, missing_files=False, force=False,
-                no_deps=False, cookbook=None, dry_run=False):
+                no_deps=False, cookbook=None, dry_run=False, jobs=1,
+                prefetch=None):
         if cookbook is None:
             cookbook = CookBook(config)
 
         oven = Oven(recipes, cookbook, force=self.force,
                     no_deps=self.no_deps, missing_files=missing_files,
-                    dry_run=dry_run)
+                    dry_run=dry_run, jobs=jobs, prefetch=prefetch)
         oven.start_cooking()
 
 
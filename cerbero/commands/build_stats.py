@@ -0,0 +1,123 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import time
+
+from cerbero.commands import Command, register_command
+from cerbero.build.metrics import MetricsDB
+from cerbero.utils import _, N_, ArgparseArgument
+from cerbero.utils import messages as m
+
+
+def format_time(seconds):
+    seconds = int(round(seconds or 0))
+    if seconds >= 3600:
+        return '%dh%02dm%02ds' % (seconds / 3600, seconds % 3600 / 60,
+                                  seconds % 60)
+    if seconds >= 60:
+        return '%dm%02ds' % (seconds / 60, seconds % 60)
+    return '%ds' % seconds
+
+
+def format_size(kbytes):
+    if kbytes is None:
+        return '-'
+    return '%.1f MB' % (float(kbytes) / 1024)
+
+
+class BuildStats(Command):
+    doc = N_('Show the time and resources used by the recipes in the builds')
+    name = 'build-stats'
+
+    def __init__(self):
+        Command.__init__(self,
+            [ArgparseArgument('recipe', nargs='?', default=None,
+                              help=_('show the measures of this recipe in '
+                                     'each build')),
+             ArgparseArgument('--limit', type=int, default=10,
+                              help=_('number of recipes and steps listed')),
+            ])
+
+    def run(self, config, args):
+        metrics = MetricsDB.from_config(config)
+        if args.recipe is not None:
+            self.history(metrics, args.recipe)
+            return
+        self.slowest(metrics, args.limit)
+        self.last_build(metrics)
+
+    def slowest(self, metrics, limit):
+        m.message(_("Slowest recipes:"))
+        for name, wall, builds in metrics.slowest_recipes(limit):
+            m.message('  %-30s %10s  (%d builds)' %
+                      (name, format_time(wall), builds))
+        m.message(_("Slowest steps:"))
+        for name, step, wall, cpu, maxrss in metrics.slowest_steps(limit):
+            m.message('  %-30s %-13s %10s  cpu %10s  peak %s' %
+                      (name, step, format_time(wall), format_time(cpu),
+                       format_size(maxrss)))
+
+    def history(self, metrics, recipe_name):
+        rows = metrics.recipe_history(recipe_name)
+        if not rows:
+            m.message(_("No builds recorded for %s") % recipe_name)
+            return
+        m.message(_("Builds of %s:") % recipe_name)
+        for run, start, wall, cpu, maxrss, size, success in rows:
+            if size is not None:
+                size = size / 1024
+            m.message('  %s %10s  cpu %10s  peak %10s  installed %10s  %s' %
+                      (time.strftime('%Y-%m-%d %H:%M', time.localtime(start)),
+                       format_time(wall), format_time(cpu),
+                       format_size(maxrss), format_size(size),
+                       success and _("ok") or _("failed")))
+
+    def last_build(self, metrics):
+        run = metrics.last_run()
+        if run is None:
+            m.message(_("No builds recorded yet"))
+            return
+        run_id, start, end, jobs, recipes, success = run
+        cooked = metrics.run_recipes(run_id)
+        started = time.strftime('%Y-%m-%d %H:%M', time.localtime(start))
+        if end is not None:
+            m.message(_("Last build: started %s, took %s and %s, "
+                        "%d recipes cooked") % (started,
+                      format_time(end - start),
+                      success and _("succeeded") or _("failed"),
+                      len(cooked)))
+            return
+        # The build is still running, or it was interrupted. The pending
+        # recipes are estimated with their previous builds.
+        pending = [x for x in recipes if x not in cooked]
+        estimates = metrics.recipe_estimates()
+        known = [estimates[x] for x in pending if x in estimates]
+        average = 0
+        if estimates:
+            average = sum(estimates.values()) / len(estimates)
+        remaining = sum([estimates.get(x, average) for x in pending])
+        m.message(_("Current build: started %s, %d of %d recipes cooked "
+                    "in %s") % (started, len(recipes) - len(pending),
+                    len(recipes), format_time(time.time() - start)))
+        m.message(_("Estimated time left: %s with %d jobs (%d recipes "
+                    "without previous builds)") %
+                  (format_time(remaining / max(1, jobs or 1)), jobs or 1,
+                   len(pending) - len(known)))
+
+
+register_command(BuildStats)
@@ -0,0 +1,92 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import time
+
+from cerbero.commands import Command, register_command
+from cerbero.build.artifacts import LocalCache
+from cerbero.errors import FatalError
+from cerbero.utils import _, N_, ArgparseArgument
+from cerbero.utils import messages as m
+
+
+MB = 1024 * 1024
+
+
+class Cache(Command):
+    doc = N_('Show statistics or prune the artifacts cache')
+    name = 'cache'
+
+    def __init__(self):
+        Command.__init__(self,
+            [ArgparseArgument('action', choices=['stats', 'prune'],
+                              help=_('action to perform')),
+             ArgparseArgument('--size', type=float, default=None,
+                              help=_('size in MB the cache is pruned to, '
+                                     'defaults to artifacts_cache_size')),
+             ArgparseArgument('--all', action='store_true', default=False,
+                              help=_('remove all the entries of the cache')),
+            ])
+
+    def run(self, config, args):
+        if not config.artifacts_cache:
+            raise FatalError(_("The artifacts cache is not enabled, set "
+                               "the artifacts_cache property to use it"))
+        max_size = config.artifacts_cache_size
+        if max_size is not None:
+            max_size = int(max_size * MB)
+        cache = LocalCache(config.artifacts_cache, max_size)
+        if args.action == 'stats':
+            self.stats(config, cache)
+        else:
+            self.prune(cache, args.size, args.all)
+
+    def stats(self, config, cache):
+        entries = cache.entries()
+        size = sum([x[1] for x in entries])
+        m.message(_("Local cache: %s") % cache.path)
+        m.message(_("Entries: %d") % len(entries))
+        if cache.max_size is not None:
+            m.message(_("Size: %.1f MB of %.1f MB") %
+                      (float(size) / MB, float(cache.max_size) / MB))
+        else:
+            m.message(_("Size: %.1f MB") % (float(size) / MB))
+        if entries:
+            m.message(_("Least recently used: %s") %
+                      time.ctime(entries[0][2]))
+            m.message(_("Most recently used: %s") %
+                      time.ctime(entries[-1][2]))
+        if config.artifacts_remote:
+            m.message(_("Remote cache: %s") % config.artifacts_remote)
+
+    def prune(self, cache, size, all):
+        if all:
+            max_size = 0
+        elif size is not None:
+            max_size = int(size * MB)
+        else:
+            max_size = cache.max_size
+        if max_size is None:
+            raise FatalError(_("No size to prune the cache to, use --size "
+                               "or set the artifacts_cache_size property"))
+        removed = cache.prune(max_size)
+        m.message(_("Removed %d entries, the cache uses %.1f MB now") %
+                  (len(removed), float(cache.size()) / MB))
+
+
+register_command(Cache)
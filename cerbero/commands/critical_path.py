@@ -0,0 +1,115 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+from cerbero.commands import Command, register_command
+from cerbero.commands.build_stats import format_time
+from cerbero.build.cookbook import CookBook
+from cerbero.build.metrics import MetricsDB
+from cerbero.build.scheduler import critical_path, simulate_build
+from cerbero.packages.packagesstore import PackagesStore
+from cerbero.utils import _, N_, ArgparseArgument
+from cerbero.utils import messages as m
+
+
+DEFAULT_JOBS = [2, 4, 8, 16]
+
+
+class CriticalPath(Command):
+    doc = N_('Analyze how much faster the build of a recipe or a package '
+             'could get building recipes in parallel')
+    name = 'critical-path'
+
+    def __init__(self):
+        Command.__init__(self,
+            [ArgparseArgument('name', nargs=1,
+                              help=_('name of the recipe or package')),
+             ArgparseArgument('--package', action='store_true',
+                              default=False,
+                              help=_('analyze the recipes of a package')),
+             ArgparseArgument('-j', '--jobs', type=int, action='append',
+                              help=_('number of jobs to estimate the '
+                                     'speedup for, can be repeated')),
+             ArgparseArgument('--limit', type=int, default=10,
+                              help=_('number of recipes of the critical '
+                                     'path listed')),
+            ])
+
+    def run(self, config, args):
+        name = args.name[0]
+        if args.package:
+            store = PackagesStore(config)
+            cookbook = store.cookbook
+            recipes = store.get_package(name).recipes_dependencies()
+        else:
+            cookbook = CookBook(config)
+            recipes = [name]
+        names = []
+        for recipe_name in recipes:
+            for dep in cookbook.list_recipe_deps(recipe_name):
+                if dep.name not in names:
+                    names.append(dep.name)
+        deps = dict([(x, cookbook.list_recipe_direct_deps(x))
+                     for x in names])
+        weights, unknown = self._weights(config, names)
+        self.analyze(names, deps, weights, args.jobs or DEFAULT_JOBS,
+                     args.limit)
+        if unknown:
+            m.message(_("%d recipes have no recorded build time and were "
+                        "estimated with the average: %s") %
+                      (len(unknown), ' '.join(unknown)))
+
+    def analyze(self, names, deps, weights, jobs, limit):
+        work = float(sum([weights[x] for x in names]))
+        path = critical_path(names, deps, weights)
+        span = sum([weights[x] for x in path])
+        m.message(_("Recipes: %d") % len(names))
+        m.message(_("Total work: %s") % format_time(work))
+        m.message(_("Critical path: %s, %d recipes") %
+                  (format_time(span), len(path)))
+        m.message('  %s' % ' -> '.join(path))
+        if work == 0:
+            return
+        m.message(_("Speedup:"))
+        for n in sorted(jobs):
+            # No schedule can beat the critical path or the work divided
+            # between the jobs
+            bound = work / max(span, float(work) / n)
+            simulated = simulate_build(names, deps, weights, n)
+            m.message(_("  %3d jobs: at most %.1fx, %.1fx (%s) with the "
+                        "build scheduler") % (n, bound,
+                        work / max(simulated, 1e-9), format_time(simulated)))
+        m.message(_("Recipes lengthening the critical path the most:"))
+        for name in sorted(path, key=lambda x: -weights[x])[:limit]:
+            m.message('  %-30s %10s  %3d%%' %
+                      (name, format_time(weights[name]),
+                       100 * weights[name] / max(span, 1e-9)))
+
+    def _weights(self, config, names):
+        # Build times recorded by the oven, the recipes never built are
+        # estimated with the average
+        estimates = MetricsDB.from_config(config).recipe_estimates()
+        known = [estimates[x] for x in names if x in estimates]
+        average = 1.0
+        if known:
+            average = sum(known) / len(known)
+        unknown = [x for x in names if x not in estimates]
+        weights = dict([(x, estimates.get(x, average)) for x in names])
+        return weights, unknown
+
+
+register_command(CriticalPath)
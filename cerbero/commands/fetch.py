@@ -16,23 +16,64 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import os
+import itertools
+import multiprocessing
+import traceback
 
 from cerbero.commands import Command, register_command
 from cerbero.build.cookbook import CookBook
+from cerbero.config import Platform
+from cerbero.errors import FatalError
 from cerbero.packages.packagesstore import PackagesStore
-from cerbero.utils import _, N_, ArgparseArgument, remove_list_duplicates
+from cerbero.utils import _, N_, ArgparseArgument, remove_list_duplicates,\
+    url_host
 from cerbero.utils import messages as m
 
 
+DEFAULT_JOBS_PER_HOST = 2
+
+# Recipes being fetched and semaphores throttling the connections to each
+# host, inherited by the fetch workers when the pool forks them
+_recipes = {}
+_throttles = {}
+
+
+def _recipe_host(recipe):
+    remotes = getattr(recipe, 'remotes', None)
+    if remotes:
+        return url_host(remotes.get('origin', remotes.values()[0]))
+    return url_host(getattr(recipe, 'url', None))
+
+
+def _fetch_recipe(args):
+    name, count, total = args
+    recipe = _recipes[name]
+    try:
+        with _throttles[_recipe_host(recipe)]:
+            m.build_step(count, total, recipe, 'Fetch')
+            recipe.fetch()
+        return (recipe.built_version(), None)
+    except Exception:
+        return (None, traceback.format_exc())
+
+
 class Fetch(Command):
 
     def __init__(self, args=[]):
         args.append(ArgparseArgument('--reset-rdeps', action='store_true',
                     default=False, help=_('reset the status of reverse '
                     'dependencies too')))
+        args.append(ArgparseArgument('-j', '--jobs', type=int, default=1,
+                    help=_('number of recipes to fetch at the same time')))
+        args.append(ArgparseArgument('--jobs-per-host', type=int,
+                    default=DEFAULT_JOBS_PER_HOST,
+                    help=_('maximum number of recipes fetched at the same '
+                           'time from the same host')))
         Command.__init__(self, args)
 
-    def fetch(self, cookbook, recipes, no_deps, reset_rdeps):
+    def fetch(self, cookbook, recipes, no_deps, reset_rdeps, jobs=1,
+              jobs_per_host=DEFAULT_JOBS_PER_HOST):
         fetch_recipes = []
         if not recipes:
             fetch_recipes = cookbook.get_recipes_list()
@@ -44,25 +85,80 @@ class Fetch(Command):
             fetch_recipes = remove_list_duplicates (fetch_recipes)
         m.message(_("Fetching the following recipes: %s") %
                   ' '.join([x.name for x in fetch_recipes]))
+        # The shared git mirrors are fetched once for all the recipes
+        cookbook.get_config().start_session()
         to_rebuild = []
-        for i in range(len(fetch_recipes)):
-            recipe = fetch_recipes[i]
-            m.build_step(i + 1, len(fetch_recipes), recipe, 'Fetch')
-            recipe.fetch()
+        to_check = []
+        for recipe, cv in self._fetch_recipes(cookbook, fetch_recipes, jobs,
+                                              jobs_per_host):
             bv = cookbook.recipe_built_version(recipe.name)
-            cv = recipe.built_version()
             if bv != cv:
                 to_rebuild.append(recipe)
                 cookbook.reset_recipe_status(recipe.name)
                 if reset_rdeps:
-                     for r in cookbook.list_recipe_reverse_deps(recipe.name):
+                    for r in cookbook.list_recipe_reverse_deps(recipe.name,
+                                                               True):
+                        # Reverse dependencies built against a known
+                        # interface are only rebuilt if it changes
+                        if cookbook.recipe_built_against(r.name,
+                                                         recipe.name):
+                            to_check.append(r)
+                            continue
                         to_rebuild.append(r)
                         cookbook.reset_recipe_status(r.name)
 
+        to_rebuild = remove_list_duplicates(to_rebuild)
+        to_check = [x for x in remove_list_duplicates(to_check)
+                    if x not in to_rebuild]
         if to_rebuild:
             m.message(_("These recipes have been updated and will "
                         "be rebuilt:\n%s") %
                         '\n'.join([x.name for x in to_rebuild]))
+        if to_check:
+            m.message(_("These recipes will be rebuilt if the interface of "
+                        "their updated dependencies changes:\n%s") %
+                        '\n'.join([x.name for x in to_check]))
+
+    def _fetch_recipes(self, cookbook, recipes, jobs, jobs_per_host):
+        '''
+        Fetches the recipes, yielding each recipe with its current version
+        in the same order they were passed
+        '''
+        total = len(recipes)
+        if jobs > 1 and (cookbook.get_config().platform == Platform.WINDOWS
+                         or not hasattr(os, 'fork')):
+            m.warning(_("Parallel fetches are not supported on this "
+                        "platform, fetching one recipe at a time"))
+            jobs = 1
+        if jobs <= 1:
+            for i in range(len(recipes)):
+                recipe = recipes[i]
+                m.build_step(i + 1, total, recipe, 'Fetch')
+                recipe.fetch()
+                yield recipe, recipe.built_version()
+            return
+
+        global _recipes, _throttles
+        _recipes = dict([(r.name, r) for r in recipes])
+        _throttles = {}
+        for recipe in recipes:
+            host = _recipe_host(recipe)
+            if host not in _throttles:
+                _throttles[host] = multiprocessing.BoundedSemaphore(
+                    max(1, jobs_per_host))
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.imap(_fetch_recipe, [(recipes[i].name, i + 1,
+                total) for i in range(total)])
+            for recipe, (cv, error) in itertools.izip(recipes, results):
+                if error is not None:
+                    raise FatalError(_("Error fetching %s:\n%s") %
+                                     (recipe.name, error))
+                yield recipe, cv
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
 
 
 class FetchRecipes(Fetch):
@@ -82,7 +178,7 @@ class FetchRecipes(Fetch):
     def run(self, config, args):
         cookbook = CookBook(config)
         return self.fetch(cookbook, args.recipes, args.no_deps,
-                args.reset_rdeps)
+                args.reset_rdeps, args.jobs, args.jobs_per_host)
 
 
 class FetchPackage(Fetch):
@@ -102,7 +198,8 @@ class FetchPackage(Fetch):
         for package_name in args.packages:
             package = store.get_package(package_name)
             recipes += package.recipes_dependencies()
-        return self.fetch(store.cookbook, recipes, False, args.reset_rdeps)
+        return self.fetch(store.cookbook, recipes, False, args.reset_rdeps,
+                args.jobs, args.jobs_per_host)
 
 
 register_command(FetchRecipes)
@@ -53,6 +53,11 @@ class Package(Command):
                     'create this package (conflicts with --skip-deps-build)')),
             ArgparseArgument('-k', '--keep-temp', action='store_true',
                 default=False, help=_('Keep temporary files for debug')),
+            ArgparseArgument('-j', '--jobs', type=int, default=1,
+                help=_('Number of recipes to build at the same time')),
+            ArgparseArgument('--prefetch', choices=['fetch', 'extract'],
+                default=None, help=_('Fetch, or fetch and extract, the '
+                    'sources of the next recipes in the background')),
             ])
 
     def run(self, config, args):
@@ -64,7 +69,7 @@ class Package(Command):
                     "--only-build-deps"))
 
         if not args.skip_deps_build:
-            self._build_deps(config, p)
+            self._build_deps(config, p, args.jobs, args.prefetch)
 
         if args.only_build_deps:
             return
@@ -85,10 +90,10 @@ class Package(Command):
         m.action(_("Package successfully created in %s") %
                  ' '.join([os.path.abspath(x) for x in paths]))
 
-    def _build_deps(self, config, package):
+    def _build_deps(self, config, package, jobs=1, prefetch=None):
         build_command = build.Build()
         build_command.runargs(config, package.recipes_dependencies(),
-            cookbook=self.store.cookbook)
+            cookbook=self.store.cookbook, jobs=jobs, prefetch=prefetch)
 
 
 register_command(Package)
@@ -19,6 +19,9 @@
 import os
 import sys
 import copy
+import time
+import cPickle as pickle
+from distutils.spawn import find_executable
 
 from cerbero import enums
 from cerbero.errors import FatalError, ConfigurationError
@@ -37,15 +40,63 @@ DEFAULT_ALLOW_PARALLEL_BUILD = False
 DEFAULT_PACKAGER = "Default <default@change.me>"
 CERBERO_UNINSTALLED = 'CERBERO_UNINSTALLED'
 CERBERO_PREFIX = 'CERBERO_PREFIX'
+HOST_FACTS_CACHE = os.path.join(CONFIG_DIR, 'host-facts.cache')
 
 
 Platform = enums.Platform
 Architecture = enums.Architecture
 Distro = enums.Distro
 DistroVersion = enums.DistroVersion
+FetchPolicy = enums.FetchPolicy
 License = enums.License
 
 
+_host_facts = None
+
+
+def probe_tool(tool, probe, cache_file=None):
+    '''
+    Gets a fact about a tool of the host, like its version. The probe is run
+    only once per process and its result is persisted across runs, keyed by
+    the path and modification time of the tool's binary.
+
+    @param tool: name of the tool's binary
+    @type tool: str
+    @param probe: function probing the fact
+    @type probe: function
+    @param cache_file: file where the facts are persisted
+    @type cache_file: str
+    @return: the result of the probe
+    '''
+    global _host_facts
+    cache_file = cache_file or HOST_FACTS_CACHE
+    path = find_executable(tool)
+    if path is None:
+        return probe()
+    key = (tool, path, os.path.getmtime(path))
+    if _host_facts is None:
+        _host_facts = {}
+        try:
+            with open(cache_file, 'rb') as f:
+                _host_facts.update(pickle.load(f))
+        except Exception:
+            pass
+    if key not in _host_facts:
+        _host_facts[key] = probe()
+        # Write it atomically, other cerbero instances could be reading it
+        try:
+            if not os.path.exists(os.path.dirname(cache_file)):
+                os.makedirs(os.path.dirname(cache_file))
+            tmp = '%s.%s' % (cache_file, os.getpid())
+            with open(tmp, 'wb') as f:
+                pickle.dump(_host_facts, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, cache_file)
+        except (IOError, OSError), e:
+            m.warning(_("Could not save the host facts in %s: %s") %
+                      (cache_file, e))
+    return _host_facts[key]
+
+
 class Variants(object):
 
     __disabled_variants = ['x11', 'alsa', 'pulse', 'cdparanoia', 'v4l2', 'sdl']
@@ -88,7 +139,12 @@ class Config (object):
                    'universal_archs', 'osx_target_sdk_version', 'variants',
                    'build_tools_prefix', 'build_tools_sources',
                    'build_tools_cache', 'home_dir', 'recipes_commits',
-                   'ios_platform', 'extra_build_tools', 'target_arch_flags']
+                   'ios_platform', 'extra_build_tools', 'target_arch_flags',
+                   'logs', 'artifacts_cache', 'artifacts_cache_size',
+                   'artifacts_remote', 'ccache_dir', 'ccache_max_size',
+                   'max_memory', 'max_load', 'scratch_dir',
+                   'scratch_max_size', 'git_fetch_policy', 'git_mirrors',
+                   'tarball_store']
 
     def __init__(self):
         self._check_uninstalled()
@@ -97,9 +153,12 @@ class Config (object):
             setattr(self, a, None)
 
         self.arch_config = {self.target_arch: self}
+        # Start of the current build session, see start_session()
+        self.session_start = None
         # Store raw os.environ data
         self._raw_environ = os.environ.copy()
         self._pre_environ = os.environ.copy()
+        self._env_cache = None
 
     def load(self, filename=None):
 
@@ -156,19 +215,72 @@ class Config (object):
 
     def do_setup_env(self):
         self._restore_environment()
-        self._create_path(self.prefix)
-        self._create_path(os.path.join(self.prefix, 'share', 'aclocal'))
-        self._create_path(os.path.join(
-            self.build_tools_prefix, 'share', 'aclocal'))
 
         libdir = os.path.join(self.prefix, 'lib%s' % self.lib_suffix)
         self.libdir = libdir
         os.environ[CERBERO_PREFIX] = self.prefix
 
-        self.env = self.get_env(self.prefix, libdir, self.py_prefix)
+        # The environment only depends on the paths and on the base
+        # environment once the config is loaded, so switching between
+        # configs only needs to swap the cached variables
+        if self._env_cache is None or \
+                self._env_cache[0] is not self._raw_environ:
+            self._env_cache = (self._raw_environ, {})
+        key = (self.prefix, libdir, self.py_prefix)
+        env_cache = self._env_cache[1]
+        if key not in env_cache:
+            self._create_path(self.prefix)
+            self._create_path(os.path.join(self.prefix, 'share', 'aclocal'))
+            self._create_path(os.path.join(
+                self.build_tools_prefix, 'share', 'aclocal'))
+            env_cache[key] = self.get_env(self.prefix, libdir,
+                                          self.py_prefix)
+
+        self.env = env_cache[key].copy()
         # set all the variables
-        for e, v in self.env.iteritems():
-            os.environ[e] = v
+        os.environ.update(self.env)
+
+    def set_build_env(self, name, value):
+        '''
+        Sets a variable in the base environment of the build, which is kept
+        when the environment is set up again, like when switching between
+        the architectures of a universal build
+
+        @param name: name of the variable
+        @type name: str
+        @param value: value of the variable or None to unset it
+        @type value: str
+        '''
+        for config in [self] + self.arch_config.values():
+            for env in [config._raw_environ, os.environ]:
+                if value is None:
+                    env.pop(name, None)
+                else:
+                    env[name] = value
+
+    def start_session(self):
+        '''
+        Starts a build session, like a build of the oven or a fetch of
+        several recipes, in which the shared git mirrors are fetched only
+        once. The processes forked to cook the recipes inherit it.
+        '''
+        session_start = time.time()
+        for config in [self] + self.arch_config.values():
+            config.session_start = session_start
+
+    def ccache_toolchain_dir(self):
+        '''
+        Gets the compiler cache directory of this configuration. Each
+        toolchain has its own cache, as objects built by different
+        toolchains can never be shared.
+
+        @return: the cache directory or None if ccache is not used
+        @rtype: str
+        '''
+        if not self.use_ccache or not self.ccache_dir:
+            return None
+        return os.path.join(self.ccache_dir, '%s_%s' %
+                            (self.target_platform, self.target_arch))
 
     def get_env(self, prefix, libdir, py_prefix):
         # Get paths for environment variables
@@ -258,6 +370,9 @@ class Config (object):
                'MONO_GAC_PREFIX': prefix,
                'GSTREAMER_SDK_ROOT': prefix
                }
+        ccache_dir = self.ccache_toolchain_dir()
+        if ccache_dir is not None:
+            env['CCACHE_DIR'] = ccache_dir
         return env
 
     def load_defaults(self):
@@ -302,6 +417,10 @@ class Config (object):
         self.set_property('build_tools_cache', None)
         self.set_property('recipes_commits', {})
         self.set_property('extra_build_tools', {})
+        self.set_property('scratch_max_size', 1024)
+        self.set_property('git_fetch_policy', FetchPolicy.FULL)
+        self.set_property('tarball_store', os.path.join(CONFIG_DIR,
+                                                        'tarballs'))
 
     def set_property(self, name, value, force=False):
         if name not in self._properties:
@@ -424,6 +543,8 @@ class Config (object):
         self.set_property('build_tools_sources',
                 os.path.join(self.home_dir, 'sources', 'build-tools'))
         self.set_property('build_tools_cache', 'build-tools')
+        self.set_property('logs', os.path.join(self.home_dir, 'logs'))
+        self.set_property('ccache_dir', os.path.join(self.home_dir, 'ccache'))
 
     def _find_data_dir(self):
         if self.uninstalled:
@@ -449,7 +570,8 @@ class Config (object):
         return os.path.abspath(p)
 
     def _perl_version(self):
-        version = shell.check_call("perl -e 'print \"$]\";'")
+        probe = lambda: shell.check_call("perl -e 'print \"$]\";'")
+        version = probe_tool('perl', probe)
         # FIXME: when perl's mayor is >= 10
         mayor = version[0]
         minor = str(int(version[2:5]))
@@ -89,6 +89,13 @@ class DistroVersion:
     ANDROID_JELLY_BEAN = 'android_jelly_bean'  # API Level 16
 
 
+class FetchPolicy:
+    ''' Enumeration of the ways of fetching git repositories '''
+    FULL = 'full'  # all the branches and tags with their history
+    SHALLOW = 'shallow'  # only the last commit of the ref built
+    BLOBLESS = 'blobless'  # the history of the ref built without files
+
+
 class LicenseDescription:
 
     def __init__(self, acronym, pretty_name):
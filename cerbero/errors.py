@@ -48,6 +48,9 @@ class CommandError(CerberoException):
 class BuildStepError(CerberoException):
 
     def __init__(self, recipe, step, trace=''):
+        self.recipe = recipe
+        self.step = step
+        self.trace = trace
         CerberoException.__init__(self, _("Recipe '%s' failed at the build "
             "step '%s'\n%s") % (recipe, step, trace))
 
@@ -143,5 +143,4 @@ if sys.platform.startswith('win'):
 
 if sys.platform.startswith('darwin'):
     import cerbero.utils.shell as cshell
-    del cshell.download
-    cshell.download = cshell.download_curl
+    cshell.download_tool = cshell.download_curl
@@ -30,6 +30,7 @@ except ImportError:
 import gettext
 import platform as pplatform
 import re
+import urlparse
 
 from cerbero.enums import Platform, Architecture, Distro, DistroVersion
 from cerbero.errors import FatalError
@@ -88,12 +89,24 @@ def fix_winpath(path):
     return path.replace('\\', '/')
 
 
+_system_info = None
+
+
 def system_info():
     '''
     Get the sysem information.
     Return a tuple with the platform type, the architecture and the
     distribution
+
+    The host is only probed once per process.
     '''
+    global _system_info
+    if _system_info is None:
+        _system_info = _probe_system_info()
+    return _system_info
+
+
+def _probe_system_info():
 
     # Get the platform info
     platform = sys.platform
@@ -258,6 +271,27 @@ def remove_list_duplicates(seq):
     return [x for x in seq if x not in seen and not seen_add(x)]
 
 
+def url_host(url):
+    '''
+    Gets the host name of a URL, also supporting the scp-like syntax used
+    by git (user@host:path)
+
+    @param url: the URL
+    @type url: str
+    @return: the host name or an empty string for local paths
+    @rtype: str
+    '''
+    if url is None:
+        return ''
+    host = urlparse.urlparse(url).hostname
+    if host:
+        return host
+    match = re.match(r'^(?:[^@/]+@)?([^:/]+):', url)
+    if match and '://' not in url and len(match.group(1)) > 1:
+        return match.group(1)
+    return ''
+
+
 def parse_file(filename, dict):
     try:
         execfile(filename, dict)
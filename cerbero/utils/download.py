@@ -0,0 +1,396 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import hashlib
+import httplib
+import threading
+import urlparse
+from multiprocessing.pool import ThreadPool
+try:
+    import ssl
+except ImportError:
+    ssl = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from cerbero.errors import FatalError
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+SCHEMES = ['http', 'https']
+PART_SUFFIX = '.part'
+# Validator of the version of the file being downloaded to a .part file
+VALIDATOR_SUFFIX = '.part.validator'
+CHUNK_SIZE = 64 * 1024
+# Number of files downloaded at the same time by download_all
+DEFAULT_JOBS = 4
+MAX_REDIRECTS = 10
+RETRIES = 3
+TIMEOUT = 60
+DEFAULT_ALGORITHM = 'sha256'
+USER_AGENT = 'cerbero'
+REDIRECTS = [301, 302, 303, 307, 308]
+# ioctl cloning a file in file systems with reflinks, like btrfs and XFS
+FICLONE = 0x40049409
+
+
+def supported(url):
+    '''
+    Whether an url can be downloaded with the L{Downloader}
+    '''
+    return urlparse.urlparse(url).scheme in SCHEMES
+
+
+def link_file(src, dest):
+    '''
+    Makes a file available in another path without copying it: the file
+    is cloned in file systems with reflinks, hardlinked otherwise, and
+    only copied when the paths are in different file systems.
+
+    @param src: path of the file
+    @type src: str
+    @param dest: destination path
+    @type dest: str
+    '''
+    if os.path.exists(dest):
+        os.remove(dest)
+    if fcntl is not None:
+        try:
+            with open(src, 'rb') as s:
+                with open(dest, 'wb') as d:
+                    fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return
+        except (IOError, OSError):
+            if os.path.exists(dest):
+                os.remove(dest)
+    try:
+        os.link(src, dest)
+        return
+    except (AttributeError, OSError):
+        pass
+    shutil.copy(src, dest)
+
+
+class ConnectionPool (object):
+    '''
+    Keeps the connections to the servers open between downloads, so that
+    the downloads from the same host reuse them
+
+    @ivar check_cert: check the certificates of https servers
+    @type check_cert: bool
+    '''
+
+    def __init__(self, check_cert=True):
+        self.check_cert = check_cert
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get(self, scheme, netloc):
+        '''
+        Gets an idle connection to a host, or a new one
+
+        @return: the connection and whether it was used before
+        @rtype: tuple
+        '''
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked processes can't share the sockets of the parent
+                self._idle = {}
+                self._pid = os.getpid()
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return (idle.pop(), True)
+        if scheme == 'https':
+            kwargs = {}
+            if not self.check_cert and \
+                    hasattr(ssl, '_create_unverified_context'):
+                kwargs['context'] = ssl._create_unverified_context()
+            conn = httplib.HTTPSConnection(netloc, timeout=TIMEOUT, **kwargs)
+        else:
+            conn = httplib.HTTPConnection(netloc, timeout=TIMEOUT)
+        return (conn, False)
+
+    def put(self, scheme, netloc, conn):
+        '''
+        Returns a connection whose response was read completely
+        '''
+        with self._lock:
+            self._idle.setdefault((scheme, netloc), []).append(conn)
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = {}
+
+
+class Downloader (object):
+    '''
+    Downloads files over http and https, reusing the connections to each
+    host and computing the checksum of the files while they are written.
+
+    Files are downloaded to a .part file, renamed once completed, so that
+    interrupted downloads are resumed with range requests instead of
+    restarted. The ranges are only used if the server still has the same
+    version of the file, which is checked with its ETag or modification
+    time. Downloaders can be shared by several threads, and download several
+    files at the same time with L{download_all}.
+
+    @ivar pool: connections to the servers
+    @type pool: L{ConnectionPool}
+    '''
+
+    def __init__(self, check_cert=True):
+        self.pool = ConnectionPool(check_cert)
+
+    def download(self, url, destination, checksum=None,
+                 algorithm=DEFAULT_ALGORITHM):
+        '''
+        Downloads a file
+
+        @param url: url of the file
+        @type url: str
+        @param destination: path where the file is saved
+        @type destination: str
+        @param checksum: expected checksum of the file, or None to not
+                         check it
+        @type checksum: str
+        @param algorithm: hash algorithm of the checksum
+        @type algorithm: str
+        @return: the checksum of the file
+        @rtype: str
+        '''
+        dirname = os.path.dirname(destination)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        part = destination + PART_SUFFIX
+        error = None
+        for i in range(RETRIES):
+            try:
+                digest = self._fetch(url, part, algorithm)
+                break
+            except (IOError, httplib.HTTPException), e:
+                error = e
+                m.warning(_("Download of %s interrupted: %s") % (url, e))
+        else:
+            raise FatalError(_("Could not download %s: %s") % (url, error))
+        self._remove_validator(part)
+        if checksum is not None and digest != checksum.lower():
+            os.remove(part)
+            raise FatalError(_("The %s checksum of %s is %s instead of %s") %
+                             (algorithm, url, digest, checksum))
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(part, destination)
+        return digest
+
+    def download_all(self, downloads, jobs=DEFAULT_JOBS,
+                     algorithm=DEFAULT_ALGORITHM):
+        '''
+        Downloads several files, up to jobs at the same time, reusing the
+        connections of the pool
+
+        @param downloads: list of (url, destination, checksum)
+        @type downloads: list
+        @param jobs: number of files downloaded at the same time
+        @type jobs: int
+        @return: destination -> checksum of the file
+        @rtype: dict
+        '''
+        if not downloads:
+            return {}
+        # Transfers are I/O bound, threads are enough here
+        pool = ThreadPool(max(1, min(jobs, len(downloads))))
+        try:
+            digests = pool.map(lambda x: self.download(x[0], x[1], x[2],
+                                                       algorithm), downloads)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip([x[1] for x in downloads], digests))
+
+    def close(self):
+        self.pool.close()
+
+    def _fetch(self, url, part, algorithm):
+        digest = hashlib.new(algorithm)
+        offset = 0
+        validator = self._read_validator(part)
+        if validator is None and os.path.exists(part):
+            # Without a validator, the .part file could be from another
+            # version of the file
+            os.remove(part)
+        if os.path.exists(part):
+            # Resume the download hashing what was already downloaded
+            with open(part, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+                    digest.update(chunk)
+                    offset += len(chunk)
+        response, conn, key = self._request(url, offset, validator)
+        if response.status == 416:
+            # The .part file is not a part of the file anymore
+            response.read()
+            self._release(response, conn, key)
+            os.remove(part)
+            self._remove_validator(part)
+            return self._fetch(url, part, algorithm)
+        try:
+            mode = 'ab'
+            if response.status != 206:
+                # The server sends the whole file, because it changed or
+                # doesn't support ranges
+                mode = 'wb'
+                digest = hashlib.new(algorithm)
+                self._write_validator(part, response)
+            length = response.getheader('content-length')
+            written = 0
+            with open(part, mode) as f:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    digest.update(chunk)
+                    written += len(chunk)
+            if length is not None and written != int(length):
+                raise httplib.IncompleteRead('%d bytes read, %s expected' %
+                                             (written, length))
+        except:
+            conn.close()
+            raise
+        self._release(response, conn, key)
+        return digest.hexdigest()
+
+    def _read_validator(self, part):
+        try:
+            with open(self._validator_path(part), 'r') as f:
+                return f.read().strip() or None
+        except IOError:
+            return None
+
+    def _write_validator(self, part, response):
+        # Weak ETags can't be used in If-Range
+        validator = response.getheader('etag')
+        if validator is None or validator.startswith('W/'):
+            validator = response.getheader('last-modified')
+        if validator is None:
+            self._remove_validator(part)
+            return
+        with open(self._validator_path(part), 'w') as f:
+            f.write(validator)
+
+    def _remove_validator(self, part):
+        if os.path.exists(self._validator_path(part)):
+            os.remove(self._validator_path(part))
+
+    def _validator_path(self, part):
+        return part[:-len(PART_SUFFIX)] + VALIDATOR_SUFFIX
+
+    def _request(self, url, offset, validator=None):
+        for i in range(MAX_REDIRECTS):
+            parsed = urlparse.urlparse(url)
+            if parsed.scheme not in SCHEMES:
+                raise FatalError(_("Can't download %s, only %s urls are "
+                                   "supported") % (url, ', '.join(SCHEMES)))
+            key = (parsed.scheme, parsed.netloc)
+            path = parsed.path or '/'
+            if parsed.query:
+                path += '?' + parsed.query
+            headers = {'User-Agent': USER_AGENT}
+            if offset:
+                headers['Range'] = 'bytes=%d-' % offset
+                # The whole file is sent if it changed since then
+                headers['If-Range'] = validator
+            conn, reused = self.pool.get(*key)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+            except (IOError, httplib.HTTPException):
+                conn.close()
+                if not reused:
+                    raise
+                # The server closed the idle connection, retry with a new one
+                conn, reused = self.pool.get(*key)
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+            if response.status in REDIRECTS:
+                location = response.getheader('location')
+                response.read()
+                self._release(response, conn, key)
+                if not location:
+                    raise FatalError(_("Redirection without location "
+                                       "downloading %s") % url)
+                url = urlparse.urljoin(url, location)
+                continue
+            if response.status not in [200, 206, 416]:
+                conn.close()
+                raise FatalError(_("Could not download %s: %s %s") %
+                                 (url, response.status, response.reason))
+            return response, conn, key
+        raise FatalError(_("Too many redirections downloading %s") % url)
+
+    def _release(self, response, conn, key):
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.put(key[0], key[1], conn)
+
+
+# Downloaders shared by all the downloads of the process, one for servers
+# with checked certificates and one for the rest
+_downloaders = {}
+
+
+def _downloader(check_cert):
+    if check_cert not in _downloaders:
+        _downloaders[check_cert] = Downloader(check_cert)
+    return _downloaders[check_cert]
+
+
+def download(url, destination, checksum=None, check_cert=True,
+             algorithm=DEFAULT_ALGORITHM):
+    '''
+    Downloads a file with a L{Downloader} shared by all the downloads of
+    the process
+
+    @return: the checksum of the file
+    @rtype: str
+    '''
+    return _downloader(check_cert).download(url, destination, checksum,
+                                            algorithm)
+
+
+def download_all(downloads, check_cert=True, jobs=DEFAULT_JOBS,
+                 algorithm=DEFAULT_ALGORITHM):
+    '''
+    Downloads several files at the same time with a L{Downloader} shared by
+    all the downloads of the process
+
+    @param downloads: list of (url, destination, checksum)
+    @type downloads: list
+    @return: destination -> checksum of the file
+    @rtype: dict
+    '''
+    return _downloader(check_cert).download_all(downloads, jobs, algorithm)
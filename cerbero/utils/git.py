@@ -17,13 +17,21 @@
 # Boston, MA 02111-1307, USA.
 
 import os
+import re
 import shutil
+import urlparse
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from cerbero.config import Platform
-from cerbero.utils import shell
+from cerbero.errors import FatalError
+from cerbero.utils import shell, url_host
 
 
 GIT = 'git'
+HASH_RE = re.compile(r'^[0-9a-f]{40}$')
 
 
 def init(git_dir):
@@ -112,6 +120,106 @@ def fetch(git_dir, fail=True):
     return shell.call('%s fetch --all' % GIT, git_dir, fail=fail)
 
 
+def fetch_ref(git_dir, remote, refspec, depth=None, blob_filter=None,
+              fail=True):
+    '''
+    Fetch a single ref from a remote
+
+    @param git_dir: path of the git repository
+    @type git_dir: str
+    @param remote: name of the remote
+    @type remote: str
+    @param refspec: the refspec or commit hash to fetch
+    @type refspec: str
+    @param depth: number of commits of history to fetch, or None for all
+    @type depth: int
+    @param blob_filter: partial clone filter, like 'blob:none', which is
+                        kept in the remote for later fetches
+    @type blob_filter: str
+    @param fail: raise an error if the command failed
+    @type fail: false
+    '''
+    options = ''
+    if depth is not None:
+        options += ' --depth=%d' % depth
+    if blob_filter is not None:
+        options += ' --filter=%s' % blob_filter
+    return shell.call('%s fetch%s %s %s' % (GIT, options, remote, refspec),
+                      git_dir, fail=fail)
+
+
+def unshallow(git_dir, fail=True):
+    '''
+    Fetch all refs from all the remotes with their whole history, in a
+    repository fetched with a limited depth
+
+    @param git_dir: path of the git repository
+    @type git_dir: str
+    @param fail: raise an error if the command failed
+    @type fail: false
+    '''
+    if not os.path.exists(os.path.join(git_dir, '.git', 'shallow')):
+        return fetch(git_dir, fail=fail)
+    return shell.call('%s fetch --all --unshallow' % GIT, git_dir, fail=fail)
+
+
+def commit_refspec(commit, remotes):
+    '''
+    Get the remote and the refspec fetching only a commit, which can be a
+    remote branch like 'origin/master', a tag or a commit hash
+
+    @param commit: the commit
+    @type commit: str
+    @param remotes: names of the remotes
+    @type remotes: list
+    @return: the remote and the refspec
+    @rtype: tuple
+    '''
+    if '/' in commit:
+        remote, branch = commit.split('/', 1)
+        if remote in remotes:
+            return (remote, '+refs/heads/%s:refs/remotes/%s/%s' %
+                    (branch, remote, branch))
+    if HASH_RE.match(commit):
+        return ('origin', commit)
+    return ('origin', '+refs/tags/%s:refs/tags/%s' % (commit, commit))
+
+
+def is_partial(git_dir):
+    '''
+    Whether the repository was fetched without some of its objects, which
+    are fetched from the remote when they are needed
+
+    @param git_dir: path of the git repository
+    @type git_dir: str
+    '''
+    output = shell.check_call("%s config --get-regexp "
+                              "'remote\\..*\\.promisor'" % GIT, git_dir)
+    return 'true' in output
+
+
+def sparse_checkout(git_dir, paths):
+    '''
+    Restrict the working tree to a list of paths, using the patterns of
+    .gitignore files, like '/src/', for the next checkouts
+
+    @param git_dir: path of the git repository
+    @type git_dir: str
+    @param paths: patterns of the paths, or None to check out everything
+    @type paths: list
+    '''
+    info_dir = os.path.join(git_dir, '.git', 'info')
+    if not paths:
+        shell.call('%s config --unset core.sparseCheckout' % GIT, git_dir,
+                   fail=False)
+        return
+    if not os.path.exists(info_dir):
+        os.makedirs(info_dir)
+    with open(os.path.join(info_dir, 'sparse-checkout'), 'w') as f:
+        f.write('\n'.join(paths) + '\n')
+    shell.call('%s config core.sparseCheckout true' % GIT, git_dir)
+
+
 def checkout(git_dir, commit):
     '''
     Reset a git repository to a given commit
@@ -138,27 +246,79 @@ def get_hash(git_dir, commit):
                             (GIT, commit), git_dir)
 
 
-def local_checkout(git_dir, local_git_dir, commit):
+def resolve(git_dir, commit, fail=True):
+    '''
+    Get the hash of the commit a reference points to, following annotated
+    tags
+
+    @param git_dir: path of the git repository
+    @type git_dir: str
+    @param commit: the commit, branch or tag
+    @type commit: str
+    @param fail: raise an error if the commit is not in the repository
+    @type fail: false
+    @return: the commit hash, or None if it's not found and fail is False
+    @rtype: str
+    '''
+    try:
+        return shell.check_call('%s rev-parse --verify -q "%s^{commit}"' %
+                                (GIT, commit), git_dir, fail=True).strip()
+    except FatalError:
+        if fail:
+            raise
+        return None
+
+
+def local_checkout(git_dir, local_git_dir, commit, shared=True,
+                   sparse_paths=None):
     '''
     Clone a repository for a given commit in a different location
 
+    A shared clone uses the objects of the source repository instead of
+    copying them, so it only costs the size of the working tree. It
+    breaks if the commit is removed from the source repository, like
+    when a branch is rewritten and its old commits are pruned, but the
+    checkout is then done again.
+
     @param git_dir: destination path of the git repository
     @type git_dir: str
     @param local_git_dir: path of the source git repository
     @type local_git_dir: str
     @param commit: the commit to checkout
     @type commit: false
+    @param shared: share the objects of the source repository
+    @type shared: bool
+    @param sparse_paths: only check out these paths, see L{sparse_checkout}
+    @type sparse_paths: list
     '''
+    if shared:
+        # The remote branches of the source repository are not cloned
+        commit_hash = resolve(local_git_dir, commit)
+        if is_partial(local_git_dir):
+            # The missing files can only be fetched by the source
+            # repository, which gets the ones of the commit checking it out
+            checkout(local_git_dir, commit_hash)
+        shell.call('%s clone --shared --no-checkout %s .' %
+                   (GIT, local_git_dir), git_dir)
+        sparse_checkout(git_dir, sparse_paths)
+        return shell.call('%s checkout -q -B build %s' % (GIT, commit_hash),
+                          git_dir)
     # reset to a commit in case it's the first checkout and the masterbranch is
     # missing
     shell.call('%s reset --hard %s' % (GIT, commit), local_git_dir)
     shell.call('%s branch build' % GIT, local_git_dir, fail=False)
     shell.call('%s checkout build' % GIT, local_git_dir)
     shell.call('%s reset --hard %s' % (GIT, commit), local_git_dir)
-    return shell.call('%s clone %s -b build .' % (GIT, local_git_dir), git_dir)
+    if not sparse_paths:
+        return shell.call('%s clone %s -b build .' % (GIT, local_git_dir),
+                          git_dir)
+    shell.call('%s clone --no-checkout %s -b build .' % (GIT, local_git_dir),
+               git_dir)
+    sparse_checkout(git_dir, sparse_paths)
+    return shell.call('%s reset -q --hard build' % GIT, git_dir)
 
 
-def add_remote(git_dir, name, url):
+def add_remote(git_dir, name, url, fetch=True):
     '''
     Add a remote to a git repository
 
@@ -168,11 +328,117 @@ def add_remote(git_dir, name, url):
     @type name: str
     @param url: url of the remote
     @type url: str
+    @param fetch: fetch all the refs of the remote
+    @type fetch: bool
     '''
-    shell.call('%s remote add -f %s %s' % (GIT, name, url), git_dir,
+    options = fetch and ' -f' or ''
+    shell.call('%s remote add%s %s %s' % (GIT, options, name, url), git_dir,
                fail=False)
 
 
+def mirror_name(url):
+    '''
+    Get a name for the repository of a remote, which is the same for the
+    different urls of a repository, like git://host/repo.git,
+    https://host/repo and user@host:repo.git
+
+    @param url: url of the remote
+    @type url: str
+    @return: the name, a relative path
+    @rtype: str
+    '''
+    host = url_host(url)
+    if '://' in url:
+        path = urlparse.urlparse(url).path
+    elif host:
+        path = url.split(':', 1)[1]
+    else:
+        path = url
+    path = path.replace('\\', '/').replace(':', '_').strip('/')
+    if path.endswith('.git'):
+        path = path[:-4]
+    return '%s/%s' % (host.lower() or 'local', path)
+
+
+def update_mirror(mirror_dir, url, fetched_since=None):
+    '''
+    Fetch all the branches and tags of a remote in a bare repository
+    holding the objects shared by the repositories using the remote
+
+    The mirror is never pruned, as the repositories using its objects
+    can point to commits removed from the remote.
+
+    @param mirror_dir: path of the mirror
+    @type mirror_dir: str
+    @param url: url of the remote
+    @type url: str
+    @param fetched_since: skip the fetch if the mirror was fetched after this
+                          time, like in the same build session
+    @type fetched_since: float
+    '''
+    if not os.path.exists(mirror_dir):
+        os.makedirs(mirror_dir)
+    lock = open(os.path.join(mirror_dir, 'cerbero.lock'), 'w')
+    try:
+        # Wait for other processes fetching the same mirror
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(os.path.join(mirror_dir, 'config')):
+            shell.call('%s init -q --bare' % GIT, mirror_dir)
+            shell.call('%s config gc.auto 0' % GIT, mirror_dir)
+        shell.call('%s config remote.origin.url %s' % (GIT, url), mirror_dir)
+        fetch_head = os.path.join(mirror_dir, 'FETCH_HEAD')
+        if fetched_since is not None and os.path.exists(fetch_head) and \
+                os.path.getmtime(fetch_head) >= fetched_since:
+            return
+        shell.call("%s fetch origin '+refs/heads/*:refs/heads/*' "
+                   "'+refs/tags/*:refs/tags/*'" % GIT, mirror_dir, fail=False)
+    finally:
+        lock.close()
+
+
+def add_alternate(git_dir, objects_dir):
+    '''
+    Use the objects of another repository, which are then not copied when
+    fetching from it
+
+    @param git_dir: path of the git repository
+    @type git_dir: str
+    @param objects_dir: objects directory of the other repository
+    @type objects_dir: str
+    '''
+    alternates = os.path.join(git_dir, '.git', 'objects', 'info',
+                              'alternates')
+    lines = []
+    if os.path.exists(alternates):
+        with open(alternates, 'r') as f:
+            lines = f.read().splitlines()
+    if objects_dir in lines:
+        return
+    if not os.path.exists(os.path.dirname(alternates)):
+        os.makedirs(os.path.dirname(alternates))
+    with open(alternates, 'a') as f:
+        f.write(objects_dir + '\n')
+
+
+def fetch_mirror(git_dir, mirror_dir, remote, fail=True):
+    '''
+    Fetch the branches and tags of a mirror as the ones of a remote
+
+    @param git_dir: path of the git repository
+    @type git_dir: str
+    @param mirror_dir: path of the mirror
+    @type mirror_dir: str
+    @param remote: name of the remote
+    @type remote: str
+    @param fail: raise an error if the command failed
+    @type fail: false
+    '''
+    return shell.call("%s fetch %s '+refs/heads/*:refs/remotes/%s/*' "
+                      "'+refs/tags/*:refs/tags/*'" % (GIT, mirror_dir, remote),
+                      git_dir, fail=fail)
+
+
 def check_line_endings(platform):
     '''
     Checks if on windows we don't use the automatic line endings conversion
@@ -31,6 +31,7 @@ import hashlib
 
 from cerbero.enums import Platform
 from cerbero.utils import _, system_info, to_unixpath
+from cerbero.utils import download as downloader
 from cerbero.utils import messages as m
 from cerbero.errors import FatalError
 
@@ -161,6 +162,25 @@ def unpack(filepath, output_dir):
 
 
 def download(url, destination=None, recursive=False, check_cert=True):
+    '''
+    Downloads a file, with the native downloader for http and https urls
+    and with wget, or cURL on OS X, for the rest and recursive downloads
+
+    @param url: url to download
+    @type: str
+    @param destination: destination where the file will be saved
+    @type destination: str
+    '''
+    if recursive or destination is None or not downloader.supported(url):
+        return download_tool(url, destination, recursive, check_cert)
+    if os.path.exists(destination):
+        logging.info("File %s already downloaded." % destination)
+        return
+    logging.info("Downloading %s", url)
+    downloader.download(url, destination, check_cert=check_cert)
+
+
+def download_wget(url, destination=None, recursive=False, check_cert=True):
     '''
     Downloads a file with wget
 
@@ -224,6 +244,9 @@ def download_curl(url, destination=None, recursive=False, check_cert=True):
             raise e
 
 
+download_tool = download_wget
+
+
 def _splitter(string, base_url):
     lines = string.split('\n')
     for line in lines:
@@ -0,0 +1,105 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import unittest
+
+from cerbero.build import admission
+from cerbero.build.admission import AdmissionControl
+from test.test_common import DummyConfig
+
+
+GB = 1024 * 1024
+
+
+class Recipe(object):
+
+    def __init__(self, name, memory_hint=None):
+        self.name = name
+        self.memory_hint = memory_hint
+
+
+class Metrics(object):
+
+    def peak_memory(self):
+        return {'heavy': 3 * GB, 'light': GB / 2}
+
+
+class AdmissionControlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.admission = AdmissionControl(8 * GB, None, 8,
+            {'heavy': 3 * GB, 'light': GB / 2})
+
+    def testFromConfig(self):
+        config = DummyConfig()
+        config.max_memory = 4096
+        config.allow_parallel_build = True
+        config.num_of_cpus = 4
+        recipes = [Recipe('heavy', 1024), Recipe('hinted', 2048),
+                   Recipe('unknown')]
+        control = AdmissionControl.from_config(config, recipes, Metrics())
+        self.assertEquals(control.memory, 4 * GB)
+        self.assertEquals(control.jobs, 4)
+        # measures are preferred to hints
+        self.assertEquals(control.estimates, {'heavy': 3 * GB,
+                                              'hinted': 2 * GB})
+
+    def testMemory(self):
+        # The first recipe is always admitted
+        self.assertTrue(self.admission.admit('heavy'))
+        self.admission.start('heavy')
+        self.assertTrue(self.admission.admit('heavy2'))
+        self.admission.estimates['heavy2'] = 3 * GB
+        self.admission.start('heavy2')
+        # recipes without estimates are never delayed
+        self.assertTrue(self.admission.admit('heavy3'))
+        self.admission.estimates['heavy3'] = 3 * GB
+        self.assertFalse(self.admission.admit('heavy3'))
+        self.assertTrue(self.admission.admit('light'))
+        self.admission.finish('heavy')
+        self.assertTrue(self.admission.admit('heavy3'))
+
+    def testLoad(self):
+        load = admission.system_load
+        admission.system_load = lambda: 10.0
+        try:
+            self.admission.max_load = 8
+            self.assertTrue(self.admission.admit('light'))
+            self.admission.start('light')
+            self.assertFalse(self.admission.admit('other'))
+            self.admission.max_load = 12
+            self.assertTrue(self.admission.admit('other'))
+        finally:
+            admission.system_load = load
+
+    def testMakeJobs(self):
+        self.assertEquals(self.admission.make_jobs('unknown'), None)
+        self.assertEquals(self.admission.make_jobs('light'), None)
+        self.assertEquals(self.admission.make_jobs('heavy'), 2)
+        self.admission.start('heavy')
+        self.admission.start('other')
+        self.admission.estimates['other'] = 4 * GB
+        # at least one job
+        self.assertEquals(self.admission.make_jobs('heavy'), 1)
+        self.assertEquals(self.admission.make_jobs('light'), 2)
+
+    def testNoLimit(self):
+        control = AdmissionControl(None, None, 8, {'heavy': 3 * GB})
+        control.start('heavy')
+        self.assertTrue(control.admit('heavy2'))
+        self.assertEquals(control.make_jobs('heavy'), None)
@@ -0,0 +1,366 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+
+from cerbero.build import recipe
+from cerbero.build.artifacts import ArtifactsCache, DirectoryBackend, \
+    HTTPBackend, LocalCache, entry_name, metadata_name, unsafe_member
+from cerbero.build.build import BuildType
+from cerbero.build.cookbook import CookBook
+from cerbero.build.oven import Oven
+from cerbero.build.source import SourceType
+from test.test_common import DummyConfig
+
+
+class ArtifactRecipe(recipe.Recipe):
+
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+    version = '1.0'
+
+    def install(self):
+        self.installed = True
+        libdir = os.path.join(self.config.prefix, 'lib')
+        if not os.path.exists(libdir):
+            os.makedirs(libdir)
+        with open(os.path.join(libdir, 'lib%s.so' % self.name), 'w') as f:
+            f.write(self.name)
+
+
+class StagedRecipe(ArtifactRecipe):
+
+    def can_stage_install(self):
+        return True
+
+    def install(self):
+        ArtifactRecipe.install(self)
+        self.installed_files = ['lib/lib%s.so' % self.name]
+
+
+class CacheRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Minimal stand-in of a remote cache server supporting GET and PUT
+    '''
+
+    def _path(self):
+        return os.path.join(self.server.root, self.path.lstrip('/'))
+
+    def do_HEAD(self):
+        self.send_response(os.path.exists(self._path()) and 200 or 404)
+        self.end_headers()
+
+    def do_GET(self):
+        path = self._path()
+        if not os.path.exists(path):
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', os.path.getsize(path))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def do_PUT(self):
+        path = self._path()
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        length = int(self.headers['Content-Length'])
+        with open(path, 'wb') as f:
+            f.write(self.rfile.read(length))
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class CacheServer(object):
+
+    def __init__(self, root):
+        self.httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                               CacheRequestHandler)
+        self.httpd.root = root
+        self.url = 'http://127.0.0.1:%d/cache' % self.httpd.server_port
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class BackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'src')
+        with open(self.src, 'w') as f:
+            f.write('content')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _test_backend(self, backend):
+        dest = os.path.join(self.tmp, 'dest', 'file')
+        self.assertFalse(backend.exists('ab/abcd.tar.gz'))
+        self.assertFalse(backend.get('ab/abcd.tar.gz', dest))
+        self.assertFalse(os.path.exists(dest))
+        backend.put(self.src, 'ab/abcd.tar.gz')
+        self.assertTrue(backend.exists('ab/abcd.tar.gz'))
+        self.assertTrue(backend.get('ab/abcd.tar.gz', dest))
+        with open(dest, 'r') as f:
+            self.assertEquals(f.read(), 'content')
+
+    def testDirectoryBackend(self):
+        backend = DirectoryBackend(os.path.join(self.tmp, 'shared'))
+        self._test_backend(backend)
+        # no temporary files are left behind
+        self.assertEquals(os.listdir(os.path.join(self.tmp, 'shared', 'ab')),
+                          ['abcd.tar.gz'])
+
+    def testHTTPBackend(self):
+        server = CacheServer(os.path.join(self.tmp, 'server'))
+        try:
+            self._test_backend(HTTPBackend(server.url))
+        finally:
+            server.stop()
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, 'server',
+            'cache', 'ab', 'abcd.tar.gz')))
+
+    def testPrune(self):
+        cache = LocalCache(os.path.join(self.tmp, 'cache'), 15)
+        for i, key in enumerate(['aa1', 'bb2', 'cc3']):
+            cache.put(self.src, entry_name(key))
+            os.utime(cache.filepath(entry_name(key)), (i, i))
+        # using an entry makes it the most recently used one
+        cache.touch(entry_name('aa1'))
+        self.assertEquals([x[0] for x in cache.entries()],
+                          ['bb2', 'cc3', 'aa1'])
+        self.assertEquals(cache.size(), 21)
+        self.assertEquals(cache.prune(), ['bb2'])
+        self.assertEquals([x[0] for x in cache.entries()], ['cc3', 'aa1'])
+        self.assertEquals(cache.prune(0), ['cc3', 'aa1'])
+        self.assertEquals(cache.entries(), [])
+
+
+class ArtifactsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmp, 'prefix')
+        os.makedirs(self.prefix)
+        self.config = DummyConfig()
+        self.config.prefix = self.prefix
+        self.config.cache_file = os.path.join(self.tmp, 'cache')
+        self.config.logs = os.path.join(self.tmp, 'logs')
+        self.config.artifacts_cache = os.path.join(self.tmp, 'artifacts')
+        self.cookbook = self._create_cookbook()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _create_cookbook(self, recipe_class=ArtifactRecipe):
+        cookbook = CookBook(self.config, False)
+        cookbook.set_status({})
+        for name, deps in [('a', []), ('b', ['a'])]:
+            # the recipe's metaclass only adds the build and source
+            # classes to classes named 'Recipe'
+            r = type('Recipe', (recipe_class, ), {'name': name,
+                     'deps': deps, '__module__': __name__})
+            r = r(self.config)
+            r.__file__ = __file__
+            cookbook.add_recipe(r)
+        return cookbook
+
+    def _installed_files(self):
+        return sorted(os.listdir(os.path.join(self.prefix, 'lib')))
+
+    def testKey(self):
+        cache = ArtifactsCache(self.cookbook, self.config.artifacts_cache)
+        a = self.cookbook.get_recipe('a')
+        b = self.cookbook.get_recipe('b')
+        key_a = cache.recipe_key(a)
+        key_b = cache.recipe_key(b)
+        self.assertNotEquals(key_a, key_b)
+        self.assertEquals(key_a, cache.recipe_key(a))
+
+        # a change in a dependency changes the key of the recipe
+        a.version = '2.0'
+        cache = ArtifactsCache(self.cookbook, self.config.artifacts_cache)
+        self.assertNotEquals(key_a, cache.recipe_key(a))
+        self.assertNotEquals(key_b, cache.recipe_key(b))
+        a.version = '1.0'
+
+        # and also the configuration
+        self.config.target_arch = 'arm'
+        cache = ArtifactsCache(self.cookbook, self.config.artifacts_cache)
+        self.assertNotEquals(key_a, cache.recipe_key(a))
+
+    def testStoreAndRestore(self):
+        oven = Oven(['b'], self.cookbook)
+        oven.start_cooking()
+        self.assertEquals(oven.artifacts.misses, 2)
+        self.assertEquals(self._installed_files(), ['liba.so', 'libb.so'])
+
+        # build again in a clean prefix restoring from the cache
+        shutil.rmtree(self.prefix)
+        os.makedirs(self.prefix)
+        os.remove(self.config.cache_file)
+        self.cookbook = self._create_cookbook()
+        oven = Oven(['b'], self.cookbook)
+        oven.start_cooking()
+        self.assertEquals(oven.artifacts.hits, 2)
+        self.assertEquals(oven.artifacts.misses, 0)
+        self.assertEquals(self._installed_files(), ['liba.so', 'libb.so'])
+        for name in ['a', 'b']:
+            r = self.cookbook.get_recipe(name)
+            self.assertFalse(hasattr(r, 'installed'))
+            for desc, step in r.steps:
+                self.assertTrue(self.cookbook.step_done(name, step))
+
+    def testParallelRestore(self):
+        oven = Oven(['b'], self.cookbook, jobs=2)
+        oven.start_cooking()
+        self.assertEquals(oven.artifacts.misses, 2)
+
+        shutil.rmtree(self.prefix)
+        os.makedirs(self.prefix)
+        os.remove(self.config.cache_file)
+        self.cookbook = self._create_cookbook()
+        oven = Oven(['b'], self.cookbook, jobs=2)
+        oven.start_cooking()
+        self.assertEquals(oven.artifacts.hits, 2)
+        self.assertEquals(self._installed_files(), ['liba.so', 'libb.so'])
+
+    def testParallelManifest(self):
+        self.cookbook = self._create_cookbook(StagedRecipe)
+        oven = Oven(['b'], self.cookbook, jobs=2)
+        oven.start_cooking()
+        # the workers store the recipes with the manifest of the install
+        self.assertEquals(len(oven.artifacts.local.entries()), 2)
+        self.assertEquals(oven.artifacts.recipe_files(
+            self.cookbook.get_recipe('b')), ['lib/libb.so'])
+        interface = self.cookbook.recipe_interface('a')
+
+        self._clean_build()
+        self.cookbook = self._create_cookbook(StagedRecipe)
+        oven = Oven(['b'], self.cookbook)
+        oven.start_cooking()
+        self.assertEquals(self.cookbook.recipe_interface('a'), interface)
+        self.assertEquals(self.cookbook.recipe_manifest('a'), ['lib/liba.so'])
+
+    def _clean_build(self):
+        shutil.rmtree(self.prefix)
+        os.makedirs(self.prefix)
+        shutil.rmtree(self.config.artifacts_cache)
+        os.remove(self.config.cache_file)
+        self.cookbook = self._create_cookbook()
+
+    def testRemoteCache(self):
+        server = CacheServer(os.path.join(self.tmp, 'server'))
+        self.config.artifacts_remote = server.url
+        try:
+            oven = Oven(['b'], self.cookbook)
+            oven.start_cooking()
+            self.assertEquals(oven.artifacts.misses, 2)
+            key = oven.artifacts.recipe_key(self.cookbook.get_recipe('b'))
+
+            # a builder with an empty local cache restores from the remote
+            self._clean_build()
+            oven = Oven(['b'], self.cookbook, jobs=2)
+            oven.start_cooking()
+            self.assertEquals(oven.artifacts.hits, 2)
+            self.assertEquals(self._installed_files(),
+                              ['liba.so', 'libb.so'])
+            self.assertTrue(oven.artifacts.local.exists(entry_name(key)))
+            self.assertTrue(oven.artifacts.local.exists(metadata_name(key)))
+        finally:
+            server.stop()
+
+    def testSharedDirectoryCache(self):
+        self.config.artifacts_remote = os.path.join(self.tmp, 'shared')
+        oven = Oven(['b'], self.cookbook)
+        oven.start_cooking()
+        self._clean_build()
+        oven = Oven(['b'], self.cookbook)
+        oven.start_cooking()
+        self.assertEquals(oven.artifacts.hits, 2)
+        self.assertEquals(self._installed_files(), ['liba.so', 'libb.so'])
+
+    def testDownloadKeysNotKept(self):
+        self.config.artifacts_remote = os.path.join(self.tmp, 'shared')
+        cache = ArtifactsCache.from_config(self.cookbook)
+        cache.download([self.cookbook.get_recipe('a'),
+                        self.cookbook.get_recipe('b')])
+        # the sources could change when they are fetched
+        self.assertEquals(cache._keys, {})
+
+    def _add_member(self, tf, name, linkname=None):
+        info = tarfile.TarInfo(name)
+        if linkname is not None:
+            info.type = tarfile.SYMTYPE
+            info.linkname = linkname
+        tf.addfile(info)
+
+    def testUnsafeMember(self):
+        path = os.path.join(self.tmp, 'entry.tar')
+        for name, linkname, unsafe in [
+                ('lib/liba.so', None, False),
+                ('lib/liba.so.1', 'liba.so', False),
+                ('lib/libb.so', os.path.join(self.prefix, 'lib/liba.so'),
+                 False),
+                ('../liba.so', None, True),
+                ('lib/../../liba.so', None, True),
+                ('/tmp/liba.so', None, True),
+                ('lib/liba.so.2', '../../liba.so', True),
+                ('lib/liba.so.3', '/etc/passwd', True)]:
+            tf = tarfile.open(path, 'w')
+            self._add_member(tf, name, linkname)
+            tf.close()
+            tf = tarfile.open(path, 'r')
+            self.assertEquals(unsafe_member(tf, self.prefix),
+                              unsafe and name or None)
+            tf.close()
+
+    def testRestoreUnsafeEntry(self):
+        cache = ArtifactsCache(self.cookbook, self.config.artifacts_cache)
+        a = self.cookbook.get_recipe('a')
+        key = cache.recipe_key(a)
+        path = os.path.join(self.tmp, 'entry.tar.gz')
+        tf = tarfile.open(path, 'w:gz')
+        tf.add(__file__, '../outside')
+        tf.close()
+        cache.local.put(path, entry_name(key))
+        self.assertFalse(cache.restore(a))
+        self.assertEquals(cache.misses, 1)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'outside')))
+
+    def testRestoreFiles(self):
+        oven = Oven(['a'], self.cookbook)
+        oven.start_cooking()
+        self.assertEquals(oven.artifacts.recipe_files(
+            self.cookbook.get_recipe('a')), ['lib/liba.so'])
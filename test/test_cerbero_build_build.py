@@ -94,3 +94,53 @@ class ModifyEnvTest(unittest.TestCase):
         self.assertEquals(val, self.val1 + self.val2)
         val = self.mk.get_env_var_nested(self.var)
         self.assertEquals(val, self.val1 + self.val2)
+
+
+class CMake(build.CMake):
+
+    srcdir = ''
+    build_dir = ''
+
+    def __init__(self, config):
+        self.config = config
+        build.CMake.__init__(self)
+
+
+class CMakeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = DummyConfig()
+        self.config.lib_suffix = ''
+        self.config.use_ccache = False
+        self.cmake = CMake(self.config)
+        self._configure = build.MakefilesBase.configure
+        build.MakefilesBase.configure = lambda x: None
+        self._environ = os.environ.copy()
+
+    def tearDown(self):
+        build.MakefilesBase.configure = self._configure
+        os.environ.clear()
+        os.environ.update(self._environ)
+
+    def testCompilers(self):
+        os.environ['CC'] = 'gcc -m32'
+        os.environ['CXX'] = 'g++ -m32'
+        self.cmake.configure()
+        self.assertTrue('-DCMAKE_C_COMPILER=gcc ' in
+                        self.cmake.configure_options)
+        self.assertTrue('-DCMAKE_CXX_COMPILER=g++ ' in
+                        self.cmake.configure_options)
+        self.assertFalse('LAUNCHER' in self.cmake.configure_options)
+
+    def testCompilerCache(self):
+        os.environ['CC'] = 'ccache gcc'
+        os.environ['CXX'] = 'ccache  g++'
+        self.cmake.configure()
+        self.assertTrue('-DCMAKE_C_COMPILER=gcc ' in
+                        self.cmake.configure_options)
+        self.assertTrue('-DCMAKE_CXX_COMPILER=g++ ' in
+                        self.cmake.configure_options)
+        self.assertTrue('-DCMAKE_C_COMPILER_LAUNCHER=ccache ' in
+                        self.cmake.configure_options)
+        self.assertTrue('-DCMAKE_CXX_COMPILER_LAUNCHER=ccache ' in
+                        self.cmake.configure_options)
@@ -0,0 +1,90 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build.ccache import CompilerCache, parse_stats_log, STATSLOG
+from cerbero.config import Config, CERBERO_UNINSTALLED
+
+
+STATS_LOG = '''# /src/a.c
+direct_cache_hit
+# /src/b.c
+preprocessed_cache_hit
+# /src/c.c
+cache_miss
+# /src/d
+called_for_link
+'''
+
+
+class Recipe(object):
+    name = 'test'
+
+
+class CompilerCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self._environ = os.environ.copy()
+        os.environ[CERBERO_UNINSTALLED] = '1'
+        self.config = Config()
+        self.config.load_defaults()
+        self.config.home_dir = self.tmp
+        self.config._load_last_defaults()
+        self.config.use_ccache = True
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environ)
+        shutil.rmtree(self.tmp)
+
+    def testParseStatsLog(self):
+        path = os.path.join(self.tmp, 'stats')
+        self.assertEquals(parse_stats_log(path), (0, 0))
+        with open(path, 'w') as f:
+            f.write(STATS_LOG)
+        self.assertEquals(parse_stats_log(path), (2, 1))
+
+    def testCacheDirs(self):
+        ccache = CompilerCache(self.config)
+        self.assertEquals(ccache.cache_dirs(),
+            [os.path.join(self.tmp, 'ccache', '%s_%s' %
+             (self.config.target_platform, self.config.target_arch))])
+        self.config.use_ccache = False
+        self.assertEquals(CompilerCache.from_config(self.config), None)
+
+    def testRecipeStats(self):
+        ccache = CompilerCache(self.config)
+        recipe = Recipe()
+        ccache.start_recipe(recipe)
+        path = os.environ[STATSLOG]
+        with open(path, 'w') as f:
+            f.write(STATS_LOG)
+        self.assertEquals(ccache.finish_recipe(recipe), (2, 1))
+        self.assertFalse(STATSLOG in os.environ)
+        self.assertFalse(os.path.exists(path))
+        self.assertEquals(ccache.stats, {'test': (2, 1)})
+        # Recipes not compiling anything are not listed
+        recipe.name = 'other'
+        ccache.start_recipe(recipe)
+        self.assertEquals(ccache.finish_recipe(recipe), (0, 0))
+        self.assertEquals(ccache.stats, {'test': (2, 1)})
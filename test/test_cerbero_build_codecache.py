@@ -0,0 +1,77 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build.codecache import CodeCache
+
+
+class CodeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp, 'cache')
+        self.filepath = os.path.join(self.tmp, 'test.recipe')
+        self._write('value = 1')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, content, mtime=1000):
+        with open(self.filepath, 'w') as f:
+            f.write(content)
+        os.utime(self.filepath, (mtime, mtime))
+
+    def _eval(self, cache):
+        d = {}
+        exec cache.get_code(self.filepath) in d
+        return d['value']
+
+    def testCompileOncePerProcess(self):
+        cache = CodeCache(self.cache_dir)
+        code = cache.get_code(self.filepath)
+        self.assertTrue(code is cache.get_code(self.filepath))
+        self.assertEquals(self._eval(cache), 1)
+
+    def testCacheOnDisk(self):
+        self._eval(CodeCache(self.cache_dir))
+        self.assertEquals(len(os.listdir(self.cache_dir)), 1)
+        cache = CodeCache(self.cache_dir)
+        self.assertEquals(cache._load(self.filepath)[0], 1000)
+        self.assertEquals(self._eval(cache), 1)
+
+    def testInvalidation(self):
+        cache = CodeCache(self.cache_dir)
+        self.assertEquals(self._eval(cache), 1)
+        # touched without changes
+        self._write('value = 1', 2000)
+        self.assertEquals(self._eval(CodeCache(self.cache_dir)), 1)
+        self.assertEquals(CodeCache(self.cache_dir)._load(self.filepath)[0],
+                          2000)
+        # modified
+        self._write('value = 2', 3000)
+        self.assertEquals(self._eval(cache), 2)
+        self.assertEquals(self._eval(CodeCache(self.cache_dir)), 2)
+
+    def testSyntaxError(self):
+        self._write('value = ')
+        cache = CodeCache(self.cache_dir)
+        self.failUnlessRaises(SyntaxError, cache.get_code, self.filepath)
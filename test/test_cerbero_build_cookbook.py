@@ -16,10 +16,14 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import os
+import shutil
 import unittest
 import tempfile
+import time
 import pickle
 
+from cerbero.build.codecache import CodeCache
 from cerbero.build.cookbook import CookBook
 from cerbero.errors import RecipeNotFoundError
 from test.test_common import DummyConfig as Config
@@ -44,15 +48,27 @@ class PackageTest(unittest.TestCase):
         self.cookbook._restore_cache()
         self.assertEquals(self.cookbook.status, {})
 
-    def testSaveCache(self):
-        tmp = tempfile.NamedTemporaryFile()
-        status = {'test': 'test'}
-        self.cookbook.set_status(status)
-        self.cookbook.get_config().cache_file = tmp.name
-        self.cookbook.save()
-        with open(self.cookbook._cache_file(self.config), 'rb') as f:
-            loaded_status = pickle.load(f)
-            self.assertEquals(status, loaded_status)
+    def testLoadCorrupted(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.config.cache_file = os.path.join(tmpdir, 'cache')
+            with open(self.config.cache_file, 'wb') as f:
+                f.write('not a pickle')
+            self.cookbook._restore_cache()
+            self.assertEquals(self.cookbook.status, {})
+            # moved aside, so that a new database is used
+            self.assertFalse(os.path.exists(self.config.cache_file))
+            self.assertTrue(os.path.exists(self.config.cache_file + '.old'))
+            recipe = Recipe1(self.config)
+            recipe.__file__ = __file__
+            self.cookbook.add_recipe(recipe)
+            self.cookbook.update_step_status(recipe.name, 'fetch')
+            self.cookbook.set_status({})
+            self.cookbook._restore_cache()
+            self.assertEquals(self.cookbook.status[recipe.name].steps,
+                              ['fetch'])
+        finally:
+            shutil.rmtree(tmpdir)
 
     def testLoad(self):
         tmp = tempfile.NamedTemporaryFile()
@@ -62,6 +78,37 @@ class PackageTest(unittest.TestCase):
             pickle.dump(status, f)
         self.cookbook._restore_cache()
         self.assertEquals(status, self.cookbook.status)
+        # the pickled cache is migrated to the new format
+        self.assertFalse(self.cookbook._is_pickle(tmp.name))
+        self.cookbook.set_status({})
+        self.cookbook._restore_cache()
+        self.assertEquals(status, self.cookbook.status)
+
+    def testConcurrentUpdates(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.config.cache_file = os.path.join(tmpdir, 'cache')
+            cookbooks = []
+            for i in range(2):
+                cookbook = CookBook(self.config, False)
+                recipe = Recipe1(self.config)
+                recipe.__file__ = __file__
+                cookbook.add_recipe(recipe)
+                cookbook._restore_cache()
+                cookbooks.append(cookbook)
+            cookbooks[0].update_step_status(recipe.name, 'fetch')
+            cookbooks[1].update_step_status(recipe.name, 'extract')
+            cookbooks[0].update_build_status(recipe.name, '1.0')
+            cookbook = CookBook(self.config, False)
+            cookbook._restore_cache()
+            status = cookbook.status[recipe.name]
+            self.assertEquals(status.steps, ['fetch', 'extract'])
+            self.assertEquals(status.built_version, '1.0')
+            cookbooks[1].reset_recipe_status(recipe.name)
+            cookbook._restore_cache()
+            self.assertEquals(cookbook.status, {})
+        finally:
+            shutil.rmtree(tmpdir)
 
     def testAddGetRecipe(self):
         recipe = Recipe1(self.config)
@@ -121,3 +168,155 @@ class PackageTest(unittest.TestCase):
         status = self.cookbook._recipe_status(recipe.name)
         self.assertEquals(status.steps, [])
         self.assertTrue(self.cookbook.status[recipe.name].needs_build)
+
+
+RECIPE = '''
+class Recipe(recipe.Recipe):
+    name = '%s'
+    version = '%s'
+    deps = %r
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+'''
+
+
+class LazyLoadingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = Config()
+        self.config.cache_file = os.path.join(self.tmp, 'cache')
+        self.config.recipes_dir = os.path.join(self.tmp, 'recipes')
+        self.config.arch_config = {self.config.target_arch: self.config}
+        self.config.do_setup_env = lambda: None
+        external = os.path.join(self.tmp, 'external')
+        self.config.get_recipes_repos = lambda: {
+            'default': (self.config.recipes_dir, 0),
+            'external': (external, 1)}
+        self._add_recipe('recipes', 'a', 'a', [])
+        self._add_recipe('recipes', 'b', 'b', ['a'])
+        # the file name doesn't need to match the recipe name
+        self._add_recipe('recipes', 'other', 'c', ['b'])
+        self._add_recipe('external', 'a', 'a', [], '2.0')
+        self.cookbook = CookBook(self.config,
+            code_cache=CodeCache(os.path.join(self.tmp, 'code-cache')))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _add_recipe(self, repo, filename, name, deps, version='1.0',
+                    extra=''):
+        path = os.path.join(self.tmp, repo)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        filepath = os.path.join(path, '%s.recipe' % filename)
+        with open(filepath, 'w') as f:
+            f.write(RECIPE % (name, version, deps) + extra)
+        return filepath
+
+    def _edit_recipe(self, extra):
+        filepath = self._add_recipe('recipes', 'd', 'd', ['a'], extra=extra)
+        mtime = time.time() + 10
+        os.utime(filepath, (mtime, mtime))
+        return CookBook(self.config,
+            code_cache=CodeCache(os.path.join(self.tmp, 'code-cache')))
+
+    def testLoadOnDemand(self):
+        self.assertEquals(self.cookbook.recipes, {})
+        self.assertEquals(self.cookbook.get_recipe('c').name, 'c')
+        self.assertEquals(self.cookbook.recipes.keys(), ['c'])
+        self.assertEquals([x.name for x in
+                           self.cookbook.list_recipe_deps('b')], ['a', 'b'])
+        self.assertEquals(sorted(self.cookbook.recipes.keys()),
+                          ['a', 'b', 'c'])
+        self.failUnlessRaises(RecipeNotFoundError, self.cookbook.get_recipe,
+                              'd')
+
+    def testEditedRecipe(self):
+        options = "    configure_options = '--enable-%s'\n"
+        self._add_recipe('recipes', 'd', 'd', ['a'], extra=options % 'foo')
+        self.cookbook._load_recipes()
+        recipe = self.cookbook.get_recipe('d')
+        steps = [x[1] for x in recipe.steps]
+        for step in steps:
+            self.cookbook.update_step_status('d', step,
+                                             recipe.step_fingerprint(step))
+        self.cookbook.update_build_status('d', '1.0')
+
+        # Edits not changing the inputs of any step keep the status
+        cookbook = self._edit_recipe(options % 'foo' + '    # comment\n')
+        cookbook.get_recipe('d')
+        self.assertEquals(cookbook.status['d'].steps, steps)
+        self.assertFalse(cookbook.recipe_needs_build('d'))
+
+        # The build restarts from the configure step
+        cookbook = self._edit_recipe(options % 'bar')
+        cookbook.get_recipe('d')
+        self.assertEquals(cookbook.status['d'].steps, ['fetch', 'extract'])
+        self.assertTrue(cookbook.recipe_needs_build('d'))
+        # and only once
+        cookbook = CookBook(self.config,
+            code_cache=CodeCache(os.path.join(self.tmp, 'code-cache')))
+        cookbook.get_recipe('d')
+        self.assertEquals(cookbook.status['d'].steps, ['fetch', 'extract'])
+
+    def testEditedRecipeWithResetSteps(self):
+        options = "    configure_options = '--enable-%s'\n"
+        self._add_recipe('recipes', 'd', 'd', ['a'], extra=options % 'foo')
+        self.cookbook._load_recipes()
+        recipe = self.cookbook.get_recipe('d')
+        steps = [x[1] for x in recipe.steps]
+        for step in steps:
+            self.cookbook.update_step_status('d', step,
+                                             recipe.step_fingerprint(step))
+        self.cookbook.update_build_status('d', '1.0')
+        # The build tree was removed after the build
+        self.cookbook.reset_steps('d', steps[1:])
+        self.assertEquals(self.cookbook.status['d'].steps, ['fetch'])
+        self.assertFalse(self.cookbook.recipe_needs_build('d'))
+
+        cookbook = self._edit_recipe(options % 'bar')
+        cookbook.get_recipe('d')
+        self.assertEquals(cookbook.status['d'].steps, ['fetch'])
+        self.assertTrue(cookbook.recipe_needs_build('d'))
+        self.assertEquals(sorted(cookbook.status['d'].fingerprints.keys()),
+                          ['extract', 'fetch'])
+
+    def testUpdateEditedRecipe(self):
+        options = "    configure_options = '--enable-%s'\n"
+        self._add_recipe('recipes', 'd', 'd', ['a'], extra=options % 'foo')
+        self.cookbook._load_recipes()
+        recipe = self.cookbook.get_recipe('d')
+        for step in [x[1] for x in recipe.steps]:
+            self.cookbook.update_step_status('d', step,
+                                             recipe.step_fingerprint(step))
+
+        # The edited recipe is loaded, restarting its build, before its
+        # status is updated
+        cookbook = self._edit_recipe(options % 'bar')
+        start = time.time()
+        cookbook.update_step_status('d', 'configure')
+        self.assertTrue(time.time() - start < 30)
+        self.assertEquals(cookbook.status['d'].steps,
+                          ['fetch', 'extract', 'configure'])
+        cookbook._restore_cache()
+        self.assertEquals(cookbook.status['d'].steps,
+                          ['fetch', 'extract', 'configure'])
+
+    def testEditedRecipeWithoutFingerprints(self):
+        self._add_recipe('recipes', 'd', 'd', ['a'])
+        self.cookbook._load_recipes()
+        self.cookbook.update_step_status('d', 'fetch')
+
+        def update(status):
+            status.fingerprints = None
+        self.cookbook._update_status('d', update)
+        cookbook = self._edit_recipe('    # comment\n')
+        self.assertFalse('d' in cookbook.status)
+
+    def testPriority(self):
+        self.assertEquals(self.cookbook.get_recipe('a').version, '2.0')
+
+    def testRecipesList(self):
+        self.assertEquals([x.name for x in
+                           self.cookbook.get_recipes_list()], ['a', 'b', 'c'])
@@ -0,0 +1,96 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import unittest
+
+from cerbero.build import recipe
+from cerbero.build.build import BuildType
+from cerbero.build.cookbook import CookBook
+from cerbero.build.source import SourceType
+from cerbero.errors import FatalError
+from test.test_common import DummyConfig
+
+
+class DependencyGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = DummyConfig()
+        self.config.cache_file = '/dev/null'
+        self.cookbook = CookBook(self.config, False)
+        self.cookbook.set_status({})
+        self._add_recipe('runtime', [], runtime_dep=True)
+        self._add_recipe('a', [])
+        self._add_recipe('b', ['a'])
+        self._add_recipe('c', ['a'])
+        self._add_recipe('d', ['c', 'b'])
+        self._add_recipe('e', [])
+
+    def _add_recipe(self, name, deps, runtime_dep=False):
+        r = type('Recipe', (recipe.Recipe, ), {'name': name, 'deps': deps,
+                 'runtime_dep': runtime_dep, 'stype': SourceType.CUSTOM,
+                 'btype': BuildType.CUSTOM, '__module__': __name__})
+        self.cookbook.add_recipe(r(self.config))
+
+    def _names(self, recipes):
+        return [x.name for x in recipes]
+
+    def testDeps(self):
+        self.assertEquals(self._names(self.cookbook.list_recipe_deps('d')),
+                          ['runtime', 'a', 'c', 'b', 'd'])
+        self.assertEquals(self.cookbook.list_recipe_direct_deps('b'),
+                          ['runtime', 'a'])
+        self.assertEquals(self.cookbook.list_recipe_direct_deps('runtime'),
+                          [])
+
+    def testReverseDeps(self):
+        self.assertEquals(
+            self._names(self.cookbook.list_recipe_reverse_deps('a')),
+            ['b', 'c'])
+        self.assertEquals(
+            self._names(self.cookbook.list_recipe_reverse_deps('a', True)),
+            ['b', 'c', 'd'])
+        self.assertEquals(
+            self._names(self.cookbook.list_recipe_reverse_deps('e', True)),
+            [])
+        # The runtime dependencies don't cascade rebuilds
+        self.assertEquals(
+            self._names(self.cookbook.list_recipe_reverse_deps('runtime')),
+            [])
+
+    def testAllReverseDeps(self):
+        self.assertEquals(
+            self._names(self.cookbook.list_recipe_all_reverse_deps('a')),
+            ['b', 'c'])
+        self.assertEquals(len(self.cookbook.list_recipe_all_reverse_deps(
+            'runtime', True)), 5)
+
+    def testInvalidate(self):
+        self.assertEquals(
+            self._names(self.cookbook.list_recipe_reverse_deps('e')), [])
+        self._add_recipe('f', ['e'])
+        self.assertEquals(
+            self._names(self.cookbook.list_recipe_reverse_deps('e')), ['f'])
+
+    def testErrors(self):
+        self._add_recipe('unknown', ['missing'])
+        self.failUnlessRaises(FatalError, self.cookbook.list_recipe_deps,
+                              'unknown')
+        self._add_recipe('cycle1', ['cycle2'])
+        self._add_recipe('cycle2', ['cycle1'])
+        self.failUnlessRaises(FatalError, self.cookbook.list_recipe_deps,
+                              'cycle1')
@@ -0,0 +1,127 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from distutils.spawn import find_executable
+
+from cerbero.build.interface import interface_fingerprint
+from cerbero.config import Platform
+from cerbero.utils import shell
+from test.test_common import DummyConfig
+
+
+class InterfaceRecipe(object):
+
+    def __init__(self, prefix):
+        self.config = DummyConfig()
+        self.config.prefix = prefix
+        self.config.target_platform = Platform.LINUX
+
+    def devel_files_list(self):
+        return ['include/foo.h', 'lib/pkgconfig/foo.pc', 'lib/libfoo.so']
+
+    def libraries(self):
+        libdir = os.path.join(self.config.prefix, 'lib')
+        return ['lib/%s' % x for x in os.listdir(libdir)
+                if x.startswith('libfoo.so.')]
+
+
+class InterfaceFingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.recipe = InterfaceRecipe(self.tmp)
+        for d in ['include', 'lib/pkgconfig']:
+            os.makedirs(os.path.join(self.tmp, d))
+        self._write('include/foo.h', 'int foo (void);')
+        self._write('lib/pkgconfig/foo.pc', 'Version: 0.1.0')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, path, content):
+        with open(os.path.join(self.tmp, path), 'w') as f:
+            f.write(content)
+
+    def _build_library(self, code, version='0.1.0'):
+        self._write('foo.c', code)
+        for f in os.listdir(os.path.join(self.tmp, 'lib')):
+            if f.startswith('libfoo.so'):
+                os.remove(os.path.join(self.tmp, 'lib', f))
+        shell.call('gcc -shared -fPIC -Wl,-soname,libfoo.so.0 -o '
+                   'lib/libfoo.so.%s foo.c && '
+                   'ln -s libfoo.so.%s lib/libfoo.so.0 && '
+                   'ln -s libfoo.so.0 lib/libfoo.so' % (version, version),
+                   self.tmp)
+
+    def testNoInterface(self):
+        shutil.rmtree(self.tmp)
+        os.makedirs(os.path.join(self.tmp, 'lib'))
+        self.assertEquals(interface_fingerprint(self.recipe), None)
+
+    def testFiles(self):
+        fingerprint = interface_fingerprint(self.recipe)
+        self.assertNotEquals(fingerprint, None)
+        self.assertEquals(interface_fingerprint(self.recipe), fingerprint)
+        self._write('include/foo.h', 'int foo (int bar);')
+        self.assertNotEquals(interface_fingerprint(self.recipe), fingerprint)
+        # only the listed files are used
+        self.assertEquals(interface_fingerprint(self.recipe,
+                                                ['lib/pkgconfig/foo.pc']),
+                          interface_fingerprint(self.recipe,
+                                                ['lib/pkgconfig/foo.pc']))
+
+    @unittest.skipUnless(find_executable('gcc') and find_executable('nm'),
+                         'needs gcc and nm')
+    def testLibrary(self):
+        self._build_library('int foo (void) { return 1; }')
+        fingerprint = interface_fingerprint(self.recipe)
+        # Same exported symbols and soname
+        self._build_library('int foo (void) { return 2 + 2; }', '0.1.1')
+        self.assertEquals(interface_fingerprint(self.recipe), fingerprint)
+        # New symbol
+        self._build_library('int foo (void) { return 1; }\n'
+                            'int bar (void) { return 1; }')
+        self.assertNotEquals(interface_fingerprint(self.recipe), fingerprint)
+
+    def _build_archive(self, code):
+        self._write('foo.c', code)
+        if os.path.exists(os.path.join(self.tmp, 'lib', 'libfoo.a')):
+            os.remove(os.path.join(self.tmp, 'lib', 'libfoo.a'))
+        shell.call('gcc -c -o foo.o foo.c && ar rcU lib/libfoo.a foo.o',
+                   self.tmp)
+
+    @unittest.skipUnless(find_executable('gcc') and find_executable('ar'),
+                         'needs gcc and ar')
+    def testStaticArchive(self):
+        files = ['lib/libfoo.a']
+        self._build_archive('int foo (void) { return 1; }')
+        fingerprint = interface_fingerprint(self.recipe, files)
+        # Created again, with new modification times
+        time.sleep(1)
+        self._build_archive('int foo (void) { return 1; }')
+        self.assertEquals(interface_fingerprint(self.recipe, files),
+                          fingerprint)
+        # The code is embedded by the recipes linking it
+        self._build_archive('int foo (void) { return 2 + 2; }')
+        self.assertNotEquals(interface_fingerprint(self.recipe, files),
+                             fingerprint)
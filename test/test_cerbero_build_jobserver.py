@@ -0,0 +1,105 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from cerbero.build.jobserver import JobServer, serial_makeflags, MAKEFLAGS
+
+
+MAKEFILE = '''
+JOBS = 1 2 3 4 5 6
+all: $(JOBS)
+$(JOBS):
+\t@echo + >> %(log)s; sleep 0.2; echo - >> %(log)s
+.PHONY: all $(JOBS)
+'''
+
+
+class JobServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testSerialMakeflags(self):
+        self.assertEquals(serial_makeflags(None), '')
+        self.assertEquals(serial_makeflags('-k -j8 --jobserver-fds=3,4 '
+                          '--jobserver-auth=3,4 -j'), '-k')
+
+    def testMakeflags(self):
+        jobserver = JobServer(2)
+        try:
+            makeflags = jobserver.makeflags('-k -j4')
+            self.assertTrue(makeflags.startswith('-k -j --jobserver-fds='))
+            self.assertFalse('-j4' in makeflags)
+        finally:
+            jobserver.close()
+
+    def testTokens(self):
+        jobserver = JobServer(2)
+        try:
+            jobserver.acquire()
+            jobserver.acquire()
+            jobserver.release()
+            jobserver.acquire()
+        finally:
+            jobserver.close()
+
+    def testSeveralTokens(self):
+        jobserver = JobServer(3)
+        try:
+            jobserver.acquire(3)
+            jobserver.release(2)
+            jobserver.acquire(2)
+        finally:
+            jobserver.close()
+
+    def testSharedBudget(self):
+        # Two recipes running make at the same time never run more jobs
+        # than the jobserver has
+        log = os.path.join(self.tmp, 'log')
+        makefile = os.path.join(self.tmp, 'Makefile')
+        with open(makefile, 'w') as f:
+            f.write(MAKEFILE % {'log': log})
+        jobserver = JobServer(3)
+        env = os.environ.copy()
+        env[MAKEFLAGS] = jobserver.makeflags()
+        processes = []
+        try:
+            for i in range(2):
+                jobserver.acquire()
+                processes.append(subprocess.Popen(['make', '-s', '-f',
+                    makefile], cwd=self.tmp, env=env))
+            for p in processes:
+                self.assertEquals(p.wait(), 0)
+        finally:
+            jobserver.close()
+        running = 0
+        peak = 0
+        with open(log) as f:
+            for line in f:
+                running += line.strip() == '+' and 1 or -1
+                peak = max(peak, running)
+        self.assertEquals(running, 0)
+        self.assertEquals(peak, 3)
@@ -0,0 +1,131 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build.metrics import MetricsDB, StepMeter, MemorySampler, \
+    files_size
+from cerbero.utils import shell
+
+
+class StepMeterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testMeasures(self):
+        meter = StepMeter()
+        shell.call('true', self.tmp)
+        measures = meter.stop(True)
+        self.assertTrue(measures['success'])
+        self.assertTrue(measures['wall'] >= 0)
+        self.assertTrue(measures['utime'] >= 0)
+        self.assertTrue(measures['stime'] >= 0)
+        self.assertEquals(measures['bytes'], None)
+
+    def _allocate(self, size):
+        shell.call('%s -c "import time; x = \'a\' * %d; time.sleep(1)"' %
+                   (sys.executable, size), self.tmp)
+
+    @unittest.skipUnless(MemorySampler.supported(), 'needs /proc')
+    def testPeakMemory(self):
+        meter = StepMeter()
+        self._allocate(200 * 1024 * 1024)
+        self.assertTrue(meter.stop(True)['maxrss'] >= 200 * 1024)
+        # Measured too when lower than the peak of the previous steps
+        meter = StepMeter()
+        self._allocate(50 * 1024 * 1024)
+        maxrss = meter.stop(True)['maxrss']
+        self.assertTrue(50 * 1024 <= maxrss < 200 * 1024)
+
+    def testInstalledBytes(self):
+        meter = StepMeter(self.tmp)
+        shell.call('mkdir lib && head -c 1000 /dev/zero > lib/libfoo.so',
+                   self.tmp)
+        self.assertEquals(meter.stop(True)['bytes'], 1000)
+        # With the list of files installed
+        meter = StepMeter(self.tmp)
+        self.assertEquals(meter.stop(True, ['lib/libfoo.so'])['bytes'],
+                          1000)
+
+    def testFilesSize(self):
+        with open(os.path.join(self.tmp, 'a'), 'w') as f:
+            f.write('12345')
+        self.assertEquals(files_size(self.tmp, ['a', 'missing']), 5)
+
+
+class MetricsDBTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = MetricsDB(os.path.join(self.tmp, 'metrics'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _measures(self, wall, maxrss=None, success=True):
+        return {'start': 0, 'wall': wall, 'utime': wall / 2.0,
+                'stime': 0.5, 'maxrss': maxrss, 'bytes': 100,
+                'success': success}
+
+    def testEmpty(self):
+        self.assertEquals(self.db.slowest_recipes(), [])
+        self.assertEquals(self.db.last_run(), None)
+        self.assertEquals(self.db.recipe_estimates(), {})
+
+    def testRuns(self):
+        for wall in [10, 20]:
+            run = self.db.start_run(['a', 'b'], 2)
+            self.db.add_step(run, 'a', 'compile', self._measures(wall, 2048))
+            self.db.add_recipe(run, 'a', 0, wall, True)
+            self.db.add_step(run, 'b', 'compile', self._measures(5))
+            self.db.add_recipe(run, 'b', 0, 5, True)
+            self.db.finish_run(run, True)
+        run = self.db.start_run(['a', 'b'], 2)
+        self.db.add_step(run, 'a', 'compile', self._measures(1000, 4096,
+                                                             False))
+        self.db.add_recipe(run, 'a', 0, 1000, False)
+
+        # failures are not taken into account
+        self.assertEquals(self.db.slowest_recipes(),
+                          [('a', 15.0, 2), ('b', 5.0, 2)])
+        self.assertEquals(self.db.slowest_recipes(1), [('a', 15.0, 2)])
+        self.assertEquals(self.db.slowest_steps()[0][:3],
+                          ('a', 'compile', 15.0))
+        self.assertEquals(self.db.recipe_estimates(), {'a': 15.0, 'b': 5.0})
+        self.assertEquals(self.db.peak_memory(), {'a': 4096})
+
+        last = self.db.last_run()
+        self.assertEquals(last[0], run)
+        self.assertEquals(last[2], None)
+        self.assertEquals(last[3:], (2, ['a', 'b'], None))
+        self.assertEquals(self.db.run_recipes(run), {'a': (1000, False)})
+
+        history = self.db.recipe_history('a')
+        self.assertEquals([x[2] for x in history], [10, 20, 1000])
+        self.assertEquals([x[4] for x in history], [2048, 2048, 4096])
+        self.assertEquals([x[5] for x in history], [100, 100, 100])
+        self.assertEquals([bool(x[6]) for x in history],
+                          [True, True, False])
@@ -0,0 +1,214 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from cerbero.build import recipe
+from cerbero.build.build import BuildType
+from cerbero.build.cookbook import CookBook
+from cerbero.build.oven import Oven
+from cerbero.build.source import SourceType
+from cerbero.errors import BuildStepError
+from test.test_common import DummyConfig
+
+
+class OvenRecipe(recipe.Recipe):
+
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+    version = '1.0'
+    fail = False
+    fail_in_background = False
+    wait_for = None
+    header = 'int foo (void);'
+
+    def fetch(self):
+        if self.fail_in_background and os.getpid() != self.main_pid:
+            raise Exception('fetch failed')
+        with open(os.path.join(self.config.prefix, 'fetch-%s' % self.name),
+                  'w') as f:
+            f.write(str(os.getpid()))
+
+    def compile(self):
+        if self.fail:
+            raise Exception('compile failed')
+        if self.wait_for is not None:
+            # Wait for the other recipe to prove both compile at once
+            open(os.path.join(self.config.prefix, 'compiling-%s' %
+                              self.name), 'w').close()
+            other = os.path.join(self.config.prefix, 'compiling-%s' %
+                                 self.wait_for)
+            for i in range(100):
+                if os.path.exists(other):
+                    break
+                time.sleep(0.1)
+            else:
+                raise Exception('The recipes did not compile in parallel')
+        with open(os.path.join(self.config.prefix, self.name), 'w') as f:
+            f.write(' '.join(sorted(os.listdir(self.config.prefix))))
+        with open(os.path.join(self.config.prefix, 'compile.log'), 'a') as f:
+            f.write('%s ' % self.name)
+
+    def install(self):
+        include = os.path.join(self.config.prefix, 'include')
+        if not os.path.exists(include):
+            os.makedirs(include)
+        with open(os.path.join(include, '%s.h' % self.name), 'w') as f:
+            f.write(self.header)
+
+
+class OvenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = DummyConfig()
+        self.config.prefix = self.tmp
+        self.config.cache_file = os.path.join(self.tmp, 'cache')
+        self.config.logs = os.path.join(self.tmp, 'logs')
+        self.cookbook = CookBook(self.config, False)
+        self.cookbook.set_status({})
+        for name, deps in [('a', []), ('b', ['a']), ('c', ['a']),
+                           ('d', ['b', 'c'])]:
+            # the recipe's metaclass only adds the build and source
+            # classes to classes named 'Recipe'
+            r = type('Recipe', (OvenRecipe, ), {'name': name, 'deps': deps,
+                'files_devel': ['include/%s.h' % name],
+                '__module__': __name__})
+            r = r(self.config)
+            r.__file__ = __file__
+            r.main_pid = os.getpid()
+            self.cookbook.add_recipe(r)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _read_output(self, name):
+        with open(os.path.join(self.tmp, name), 'r') as f:
+            return f.read().split(' ')
+
+    def testParallelBuild(self):
+        oven = Oven(['d'], self.cookbook, jobs=4)
+        oven.start_cooking()
+        for name in ['a', 'b', 'c', 'd']:
+            for desc, step in self.cookbook.get_recipe(name).steps:
+                self.assertTrue(self.cookbook.step_done(name, step))
+        # dependencies are built before the recipes needing them
+        self.assertTrue('a' in self._read_output('b'))
+        self.assertTrue('a' in self._read_output('c'))
+        self.assertTrue('b' in self._read_output('d'))
+        self.assertTrue('c' in self._read_output('d'))
+        self.assertTrue(os.path.exists(os.path.join(self.config.logs,
+                                                    'd.log')))
+
+    def testParallelCompile(self):
+        # With the default configuration, without parallel make jobs
+        self.cookbook.get_recipe('b').wait_for = 'c'
+        self.cookbook.get_recipe('c').wait_for = 'b'
+        Oven(['d'], self.cookbook, jobs=2).start_cooking()
+        self.assertTrue(self.cookbook.step_done('d', 'compile'))
+
+    def testParallelBuildFailure(self):
+        self.cookbook.get_recipe('b').fail = True
+        oven = Oven(['d'], self.cookbook, jobs=4)
+        self.failUnlessRaises(BuildStepError, oven.start_cooking)
+        self.assertTrue(self.cookbook.step_done('a', 'compile'))
+        self.assertFalse(self.cookbook.step_done('b', 'compile'))
+        self.assertTrue(self.cookbook.step_done('b', 'configure'))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'd')))
+
+    def testPrefetch(self):
+        self.cookbook.get_recipe('c').fail_in_background = True
+        oven = Oven(['d'], self.cookbook, prefetch='fetch')
+        oven.start_cooking()
+        for name in ['a', 'b', 'c', 'd']:
+            self.assertTrue(self.cookbook.step_done(name, 'post_install'))
+            pid = self._read_output('fetch-%s' % name)[0]
+            if name == 'c':
+                # fetched again when the recipe was reached
+                self.assertEquals(pid, str(os.getpid()))
+            else:
+                self.assertNotEquals(pid, str(os.getpid()))
+
+    def _check_metrics(self, oven, success):
+        run = oven.metrics.last_run()
+        self.assertEquals(run[3:], (oven.jobs, ['a', 'b', 'c', 'd'],
+                                    success))
+        self.assertNotEquals(run[2], None)
+        cooked = oven.metrics.run_recipes(run[0])
+        steps = oven.metrics.slowest_steps()
+        for name in ['a', 'b', 'c', 'd']:
+            self.assertTrue(cooked[name][1])
+            for desc, step in self.cookbook.get_recipe(name).steps:
+                self.assertTrue((name, step) in [x[:2] for x in steps])
+
+    def testMetrics(self):
+        oven = Oven(['d'], self.cookbook)
+        oven.start_cooking()
+        self._check_metrics(oven, True)
+
+    def testParallelMetrics(self):
+        oven = Oven(['d'], self.cookbook, jobs=4)
+        oven.start_cooking()
+        self._check_metrics(oven, True)
+
+    def _compiled(self):
+        compiled = self._read_output('compile.log')[:-1]
+        os.remove(os.path.join(self.tmp, 'compile.log'))
+        return compiled
+
+    def testInterfaceCutoff(self):
+        Oven(['d'], self.cookbook).start_cooking()
+        self.assertEquals(self._compiled(), ['a', 'b', 'c', 'd'])
+        self.assertNotEquals(self.cookbook.recipe_interface('a'), None)
+        self.assertEquals(self.cookbook.recipe_built_against('d', 'a'),
+                          self.cookbook.recipe_interface('a'))
+        # Same interface, the reverse dependencies are not rebuilt
+        self.cookbook.reset_recipe_status('a')
+        Oven(['d'], self.cookbook).start_cooking()
+        self.assertEquals(self._compiled(), ['a'])
+        # New interface
+        self.cookbook.get_recipe('a').header = 'int foo (int bar);'
+        self.cookbook.reset_recipe_status('a')
+        Oven(['d'], self.cookbook).start_cooking()
+        self.assertEquals(self._compiled(), ['a', 'b', 'c', 'd'])
+        # The cascade stops when the interface of 'b' doesn't change
+        self.cookbook.reset_recipe_status('b')
+        Oven(['d'], self.cookbook, jobs=2).start_cooking()
+        self.assertEquals(self._compiled(), ['b'])
+
+    def testParallelInterfaceCutoff(self):
+        Oven(['d'], self.cookbook).start_cooking()
+        self._compiled()
+        self.cookbook.get_recipe('a').header = 'int foo (int bar);'
+        self.cookbook.reset_recipe_status('a')
+        resets = []
+        reset_recipe_status = self.cookbook.reset_recipe_status
+
+        def reset(name):
+            resets.append(name)
+            reset_recipe_status(name)
+        self.cookbook.reset_recipe_status = reset
+        oven = Oven(['d'], self.cookbook, jobs=2)
+        oven.start_cooking()
+        self.assertEquals(sorted(self._compiled()), ['a', 'b', 'c', 'd'])
+        # the status is reset once, when the recipe is ready to be built
+        self.assertEquals(sorted(resets), ['b', 'c', 'd'])
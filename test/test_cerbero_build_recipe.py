@@ -18,6 +18,9 @@
 
 import unittest
 import os
+import shutil
+import tempfile
+import time
 
 from cerbero.build import recipe
 from cerbero.config import Platform, License, Architecture
@@ -213,3 +216,121 @@ class TestUniversalRecipe(unittest.TestCase):
         self.recipe.add_recipe(self.recipe_x86_64)
         self.assertEquals(self.recipe.steps,
                 recipe.BuildSteps() + [recipe.BuildSteps.MERGE])
+
+
+class ArchConfig(DummyConfig):
+
+    def __init__(self, arch):
+        self.target_arch = arch
+
+    def do_setup_env(self):
+        os.environ['CERBERO_TEST_ARCH'] = self.target_arch
+
+
+class ArchRecipe(object):
+
+    name = 'recipe'
+
+    def __init__(self, config, tmpdir):
+        self.config = config
+        self.tmpdir = tmpdir
+
+    def _record(self, step):
+        path = os.path.join(self.tmpdir, '%s-%s' % (step,
+                                                    self.config.target_arch))
+        with open(path, 'w') as f:
+            f.write('%s %s' % (os.getpid(), os.environ['CERBERO_TEST_ARCH']))
+
+    def fetch(self):
+        self._record('fetch')
+
+    def configure(self):
+        self.configure_options = '--host=%s' % self.config.target_arch
+        self.log = open(os.devnull, 'w')
+
+    def compile(self):
+        self._record('compile')
+        # Wait for the other architecture to prove both run at once
+        for i in range(100):
+            if len(os.listdir(self.tmpdir)) == 2:
+                return
+            time.sleep(0.1)
+        raise Exception('The architectures did not run in parallel')
+
+    def install(self):
+        if self.config.target_arch == Architecture.X86:
+            raise Exception('install failed')
+        time.sleep(30)
+        self._record('install')
+
+
+class TestUniversalRecipeParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = DummyConfig()
+        self.config.arch_config = {}
+        self.recipe = recipe.UniversalRecipe(self.config)
+        for arch in [Architecture.X86, Architecture.X86_64]:
+            config = ArchConfig(arch)
+            self.config.arch_config[arch] = config
+            self.recipe.add_recipe(ArchRecipe(config, self.tmpdir))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _read(self, step, arch):
+        with open(os.path.join(self.tmpdir, '%s-%s' % (step, arch))) as f:
+            pid, env_arch = f.read().split()
+        return int(pid), env_arch
+
+    def testParallelStep(self):
+        self.recipe.compile()
+        pids = set()
+        for arch in [Architecture.X86, Architecture.X86_64]:
+            pid, env_arch = self._read('compile', arch)
+            self.assertEquals(env_arch, arch)
+            self.assertNotEquals(pid, os.getpid())
+            pids.add(pid)
+        self.assertEquals(len(pids), 2)
+
+    def testStepChangesKept(self):
+        self.recipe.configure()
+        for arch in [Architecture.X86, Architecture.X86_64]:
+            r = self.recipe._recipes[arch]
+            self.assertEquals(r.configure_options, '--host=%s' % arch)
+            self.assertEquals(r.config.target_arch, arch)
+            self.assertFalse(hasattr(r, 'log'))
+
+    def testInstalledFiles(self):
+        self.assertEquals(self.recipe.installed_files, None)
+        self.recipe._recipes[Architecture.X86].installed_files = \
+            ['lib/libfoo.so', 'lib/libx86.so']
+        self.assertEquals(self.recipe.installed_files, None)
+        self.recipe._recipes[Architecture.X86_64].installed_files = \
+            ['lib/libfoo.so']
+        self.assertEquals(self.recipe.installed_files,
+                          ['lib/libfoo.so', 'lib/libx86.so'])
+
+    def testFlatInstalledFiles(self):
+        flat = recipe.UniversalFlatRecipe(self.config)
+        for arch in [Architecture.X86, Architecture.X86_64]:
+            r = ArchRecipe(self.config.arch_config[arch], self.tmpdir)
+            r.installed_files = ['lib/libfoo.a']
+            flat.add_recipe(r)
+        self.assertEquals(flat.installed_files,
+            ['lib/libfoo.a', os.path.join(Architecture.X86, 'lib/libfoo.a'),
+             os.path.join(Architecture.X86_64, 'lib/libfoo.a')])
+
+    def testFetchIsSerial(self):
+        self.recipe.fetch()
+        for arch in [Architecture.X86, Architecture.X86_64]:
+            pid, env_arch = self._read('fetch', arch)
+            self.assertEquals(env_arch, arch)
+            self.assertEquals(pid, os.getpid())
+
+    def testFailureStopsArchitectures(self):
+        start = time.time()
+        self.failUnlessRaises(FatalError, self.recipe.install)
+        self.assertTrue(time.time() - start < 10)
+        self.assertEquals(os.listdir(self.tmpdir), [])
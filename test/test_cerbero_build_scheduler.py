@@ -0,0 +1,116 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import unittest
+
+from cerbero.build.scheduler import BuildQueue, longest_paths, \
+    critical_path, simulate_build
+from cerbero.errors import FatalError
+
+
+#      a
+#     / \
+#    b   c
+#    |   |
+#    d   |
+#     \ /
+#      e
+NAMES = ['a', 'b', 'c', 'd', 'e']
+DEPS = {'b': ['a'], 'c': ['a'], 'd': ['b'], 'e': ['d', 'c']}
+
+
+class LongestPathsTest(unittest.TestCase):
+
+    def testDefaultWeights(self):
+        paths = longest_paths(NAMES, DEPS)
+        self.assertEquals(paths, {'a': 4, 'b': 3, 'c': 2, 'd': 2, 'e': 1})
+
+    def testWeights(self):
+        paths = longest_paths(NAMES, DEPS, {'c': 10})
+        self.assertEquals(paths['a'], 12)
+        self.assertEquals(paths['c'], 11)
+        self.assertEquals(paths['b'], 3)
+
+
+class CriticalPathTest(unittest.TestCase):
+
+    def testDefaultWeights(self):
+        self.assertEquals(critical_path(NAMES, DEPS), ['a', 'b', 'd', 'e'])
+
+    def testWeights(self):
+        self.assertEquals(critical_path(NAMES, DEPS, {'c': 10}),
+                          ['a', 'c', 'e'])
+
+    def testEmpty(self):
+        self.assertEquals(critical_path([], {}), [])
+
+
+class SimulateBuildTest(unittest.TestCase):
+
+    def testJobs(self):
+        weights = {'a': 1, 'b': 2, 'c': 3, 'd': 2, 'e': 1}
+        self.assertEquals(simulate_build(NAMES, DEPS, weights, 1), 9)
+        # limited by the critical path a -> b -> d -> e
+        self.assertEquals(simulate_build(NAMES, DEPS, weights, 2), 6)
+        self.assertEquals(simulate_build(NAMES, DEPS, weights, 8), 6)
+
+    def testEmpty(self):
+        self.assertEquals(simulate_build([], {}, {}, 4), 0)
+
+
+class BuildQueueTest(unittest.TestCase):
+
+    def testReadyOrder(self):
+        queue = BuildQueue(NAMES, DEPS)
+        self.assertEquals(queue.pop(), 'a')
+        self.assertEquals(queue.pop(), None)
+        queue.done('a')
+        # 'b' is in the longest path
+        self.assertEquals(queue.pop(), 'b')
+        self.assertEquals(queue.pop(), 'c')
+        queue.done('c')
+        self.assertEquals(queue.pop(), None)
+        queue.done('b')
+        self.assertEquals(queue.pop(), 'd')
+        queue.done('d')
+        self.assertEquals(queue.pop(), 'e')
+        self.assertEquals(queue.pending(), 0)
+
+    def testWeightedOrder(self):
+        queue = BuildQueue(NAMES, DEPS, {'c': 10})
+        queue.done(queue.pop())
+        self.assertEquals(queue.pop(), 'c')
+
+    def testAccept(self):
+        queue = BuildQueue(NAMES, DEPS)
+        queue.done(queue.pop())
+        # 'b' is rejected and stays ready
+        self.assertEquals(queue.pop(lambda x: x != 'b'), 'c')
+        self.assertEquals(queue.pop(lambda x: x != 'b'), None)
+        self.assertEquals(queue.pending(), 3)
+        self.assertEquals(queue.pop(), 'b')
+
+    def testIgnoreDepsOutsideTheGraph(self):
+        queue = BuildQueue(['b', 'd'], DEPS)
+        self.assertEquals(queue.pop(), 'b')
+        queue.done('b')
+        self.assertEquals(queue.pop(), 'd')
+
+    def testCycle(self):
+        self.failUnlessRaises(FatalError, BuildQueue, ['a', 'b'],
+                              {'a': ['b'], 'b': ['a']})
@@ -0,0 +1,129 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build import scratch
+from cerbero.build.scratch import ScratchSpace
+from cerbero.config import Platform
+from test.test_common import DummyConfig
+
+
+class Recipe(object):
+
+    def __init__(self, name, build_dir):
+        self.name = name
+        self.build_dir = build_dir
+
+
+class UniversalRecipe(object):
+
+    def __init__(self, name, recipes):
+        self.name = name
+        self._recipes = recipes
+
+
+class ScratchSpaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.sources = os.path.join(self.tmp, 'sources')
+        self.scratch = ScratchSpace(os.path.join(self.tmp, 'scratch'), 1024)
+        self.recipe = self._extract('test', 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _extract(self, name, size):
+        build_dir = os.path.join(self.sources, name)
+        os.makedirs(os.path.join(build_dir, 'src'))
+        with open(os.path.join(build_dir, 'src', 'main.c'), 'w') as f:
+            f.write('a' * size)
+        return Recipe(name, build_dir)
+
+    def testFromConfig(self):
+        config = DummyConfig()
+        config.platform = Platform.LINUX
+        self.assertEquals(ScratchSpace.from_config(config), None)
+        config.scratch_dir = self.tmp
+        config.scratch_max_size = 10
+        space = ScratchSpace.from_config(config)
+        self.assertEquals(space.path, self.tmp)
+        self.assertEquals(space.max_size, 10 * 1024 * 1024)
+        config.platform = Platform.WINDOWS
+        self.assertEquals(ScratchSpace.from_config(config), None)
+
+    def testPlace(self):
+        build_dir = self.recipe.build_dir
+        scratch_dir = self.scratch.scratch_dir(build_dir)
+        self.assertTrue(scratch_dir.startswith(self.scratch.path))
+        self.assertTrue(self.scratch.place(self.recipe))
+        self.assertTrue(os.path.islink(build_dir))
+        self.assertEquals(os.path.realpath(build_dir),
+                          os.path.realpath(scratch_dir))
+        self.assertTrue(os.path.exists(
+            os.path.join(build_dir, 'src', 'main.c')))
+        self.assertTrue(scratch.is_placed(self.recipe))
+        # Already placed
+        self.assertFalse(self.scratch.place(self.recipe))
+
+    def testPlaceBigTree(self):
+        recipe = self._extract('big', 2048)
+        self.assertFalse(self.scratch.place(recipe))
+        self.assertFalse(os.path.islink(recipe.build_dir))
+        self.assertFalse(scratch.is_placed(recipe))
+
+    def testPlaceNoRoom(self):
+        free_space = scratch.free_space
+        scratch.free_space = lambda path: 200
+        try:
+            self.assertFalse(self.scratch.place(self.recipe))
+        finally:
+            scratch.free_space = free_space
+        self.assertFalse(os.path.islink(self.recipe.build_dir))
+
+    def testClean(self):
+        self.assertFalse(self.scratch.clean(self.recipe))
+        self.assertTrue(os.path.exists(self.recipe.build_dir))
+        self.scratch.place(self.recipe)
+        self.assertTrue(self.scratch.clean(self.recipe))
+        self.assertFalse(os.path.lexists(self.recipe.build_dir))
+        self.assertFalse(os.path.exists(
+            self.scratch.scratch_dir(self.recipe.build_dir)))
+
+    def testLost(self):
+        self.scratch.place(self.recipe)
+        self.assertFalse(self.scratch.is_lost(self.recipe))
+        shutil.rmtree(self.scratch.path)
+        self.assertTrue(self.scratch.is_lost(self.recipe))
+        self.scratch.release(self.recipe)
+        self.assertFalse(os.path.lexists(self.recipe.build_dir))
+        self.assertFalse(self.scratch.is_lost(self.recipe))
+
+    def testUniversalRecipe(self):
+        recipe = UniversalRecipe('test', {'x86': self.recipe,
+            'x86_64': self._extract('test_x86_64', 100)})
+        self.assertTrue(self.scratch.place(recipe))
+        for r in recipe._recipes.values():
+            self.assertTrue(os.path.islink(r.build_dir))
+        self.assertTrue(self.scratch.clean(recipe))
+        for r in recipe._recipes.values():
+            self.assertFalse(os.path.lexists(r.build_dir))
@@ -0,0 +1,139 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build import recipe
+from cerbero.build.build import BuildType
+from cerbero.build.cookbook import CookBook
+from cerbero.build.oven import Oven
+from cerbero.build.source import SourceType
+from cerbero.build.staging import InstallStaging
+from test.test_common import DummyConfig
+
+
+MAKEFILE = '''
+all:
+\ttouch tool
+
+install:
+\tmkdir -p $(DESTDIR)%(prefix)s/bin $(DESTDIR)%(prefix)s/lib
+\tcp tool $(DESTDIR)%(prefix)s/bin/tool
+\ttouch $(DESTDIR)%(prefix)s/lib/libstaged.so.1
+\tln -sf libstaged.so.1 $(DESTDIR)%(prefix)s/lib/libstaged.so
+'''
+
+
+# the recipe's metaclass only adds the build and source classes to classes
+# named 'Recipe'
+class Recipe(recipe.Recipe):
+
+    name = 'staged'
+    version = '1.0'
+    stype = SourceType.CUSTOM
+    btype = BuildType.MAKEFILE
+    configure_tpl = 'true'
+    files_devel = ['lib/libstaged.so', 'lib/libstaged.la']
+
+
+StagedRecipe = Recipe
+
+
+class InstallStagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = DummyConfig()
+        self.config.prefix = os.path.join(self.tmp, 'prefix')
+        self.config.sources = os.path.join(self.tmp, 'sources')
+        self.config.cache_file = os.path.join(self.tmp, 'cache')
+        self.config.logs = os.path.join(self.tmp, 'logs')
+        self.config.libdir = os.path.join(self.config.prefix, 'lib')
+        self.config.host = self.config.build = self.config.target = None
+        os.makedirs(self.config.prefix)
+        self.recipe = StagedRecipe(self.config)
+        self.recipe.__file__ = __file__
+        os.makedirs(self.recipe.build_dir)
+        with open(os.path.join(self.recipe.build_dir, 'Makefile'), 'w') as f:
+            f.write(MAKEFILE % {'prefix': self.config.prefix})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _prefix_files(self, prefix=None):
+        prefix = prefix or self.config.prefix
+        files = []
+        for dirpath, dirnames, filenames in os.walk(prefix):
+            files += [os.path.relpath(os.path.join(dirpath, f), prefix)
+                      for f in filenames]
+        return sorted(files)
+
+    def testMerge(self):
+        staging = InstallStaging(self.recipe)
+        staging.start()
+        self.assertEquals(os.environ['DESTDIR'], staging.staging_dir)
+        os.makedirs(staging.staging_dir + self.config.prefix + '/lib')
+        with open(staging.staging_dir + self.config.prefix + '/lib/a', 'w'):
+            pass
+        os.symlink('a', staging.staging_dir + self.config.prefix + '/lib/b')
+        # files already in the prefix are overwritten
+        os.makedirs(os.path.join(self.config.prefix, 'lib'))
+        os.symlink('c', os.path.join(self.config.prefix, 'lib', 'b'))
+        self.assertEquals(staging.finish(), ['lib/a', 'lib/b'])
+        self.assertFalse('DESTDIR' in os.environ)
+        self.assertFalse(os.path.exists(staging.staging_dir))
+        self.assertEquals(os.readlink(os.path.join(self.config.prefix, 'lib',
+                                                   'b')), 'a')
+
+    def testCanStageInstall(self):
+        self.assertTrue(self.recipe.can_stage_install())
+        self.recipe.stage_install = False
+        self.assertFalse(self.recipe.can_stage_install())
+        self.recipe.stage_install = True
+        self.recipe.make_install = 'make install PREFIX=/usr'
+        self.assertFalse(self.recipe.can_stage_install())
+
+    def testInstall(self):
+        self.recipe.compile()
+        self.recipe.install()
+        self.assertEquals(self.recipe.installed_files,
+                          ['bin/tool', 'lib/libstaged.so',
+                           'lib/libstaged.so.1'])
+        self.assertEquals(self._prefix_files(), self.recipe.installed_files)
+
+    def testInstallPrefix(self):
+        # used by universal recipes to install each arch in a subdirectory
+        self.recipe.install_prefix = os.path.join(self.config.prefix, 'x86')
+        self.recipe.compile()
+        self.recipe.install()
+        self.assertEquals(self._prefix_files(),
+                          ['x86/bin/tool', 'x86/lib/libstaged.so',
+                           'x86/lib/libstaged.so.1'])
+
+    def testOvenManifest(self):
+        cookbook = CookBook(self.config, False)
+        cookbook.set_status({})
+        cookbook.add_recipe(self.recipe)
+        oven = Oven(['staged'], cookbook, missing_files=True)
+        oven.start_cooking()
+        self.assertEquals(cookbook.recipe_manifest('staged'),
+                          ['bin/tool', 'lib/libstaged.so',
+                           'lib/libstaged.so.1'])
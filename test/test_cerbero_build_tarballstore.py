@@ -0,0 +1,136 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from cerbero.build import recipe, tarballstore
+from cerbero.build.source import SourceType
+from cerbero.build.tarballstore import TarballStore
+from cerbero.errors import FatalError
+from cerbero.utils import shell
+from test.test_common import DummyConfig
+
+
+DATA = 'tarball contents'
+CHECKSUM = hashlib.sha256(DATA).hexdigest()
+
+
+class TarballStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = TarballStore(os.path.join(self.tmp, 'store'))
+        self.src = os.path.join(self.tmp, 'upstream', 'test-1.0.tar.xz')
+        os.makedirs(os.path.dirname(self.src))
+        with open(self.src, 'wb') as f:
+            f.write(DATA)
+        self.url = 'file://%s' % self.src
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _destination(self, home):
+        return os.path.join(self.tmp, home, 'sources', 'test-1.0.tar.xz')
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def testFromConfig(self):
+        config = DummyConfig()
+        self.assertEquals(TarballStore.from_config(config), None)
+        config.tarball_store = self.tmp
+        self.assertEquals(TarballStore.from_config(config).path, self.tmp)
+
+    def testFetch(self):
+        dest = self._destination('home1')
+        self.assertEquals(self.store.fetch(self.url, dest, CHECKSUM),
+                          CHECKSUM)
+        stored = self.store.tarball_path(CHECKSUM)
+        self.assertEquals(self._read(stored), DATA)
+        self.assertTrue(os.path.islink(dest))
+        self.assertEquals(os.path.realpath(dest), os.path.realpath(stored))
+
+        # Other homes use the stored tarball without hashing it again
+        file_checksum = tarballstore.file_checksum
+        tarballstore.file_checksum = None
+        try:
+            dest = self._destination('home2')
+            self.store.fetch(self.url, dest, CHECKSUM.upper())
+            self.store.fetch(self.url, dest, CHECKSUM)
+        finally:
+            tarballstore.file_checksum = file_checksum
+        self.assertEquals(self._read(dest), DATA)
+
+    def testWrongChecksum(self):
+        dest = self._destination('home1')
+        checksum = hashlib.sha256('other').hexdigest()
+        self.assertRaises(FatalError, self.store.fetch, self.url, dest,
+                          checksum)
+        self.assertFalse(os.path.lexists(dest))
+        self.assertFalse(os.path.exists(self.store.tarball_path(checksum)))
+        self.assertFalse(os.path.exists(self.store.tarball_path(CHECKSUM)))
+
+    def testWithoutChecksum(self):
+        dest = self._destination('home1')
+        self.assertEquals(self.store.fetch(self.url, dest), CHECKSUM)
+        self.assertTrue(os.path.exists(self.store.tarball_path(CHECKSUM)))
+        # Found again by its url
+        os.remove(self.src)
+        dest = self._destination('home2')
+        self.assertEquals(self.store.fetch(self.url, dest), CHECKSUM)
+        self.assertEquals(self._read(dest), DATA)
+
+    def testDownloadedBefore(self):
+        dest = self._destination('home1')
+        os.makedirs(os.path.dirname(dest))
+        shutil.copy(self.src, dest)
+        os.remove(self.src)
+        self.assertEquals(self.store.fetch(self.url, dest, CHECKSUM),
+                          CHECKSUM)
+        self.assertTrue(os.path.islink(dest))
+        self.assertEquals(self._read(dest), DATA)
+
+    def testStepFingerprint(self):
+        config = DummyConfig()
+        config.local_sources = os.path.join(self.tmp, 'home1', 'sources')
+        config.sources = os.path.join(self.tmp, 'home1', 'build')
+        config.tarball_store = self.store.path
+
+        class Recipe(recipe.Recipe):
+            name = 'test'
+            version = '1.0'
+            stype = SourceType.TARBALL
+            url = self.url
+
+        r = Recipe(config)
+        r.fetch()
+        fingerprint = r.step_fingerprint('extract')
+        # The stored tarball is not hashed again
+        file_hash = shell.file_hash
+        shell.file_hash = None
+        try:
+            self.assertEquals(r.step_fingerprint('extract'), fingerprint)
+        finally:
+            shell.file_hash = file_hash
+        r.tarball_checksum = CHECKSUM
+        self.assertEquals(r.step_fingerprint('extract'), fingerprint)
@@ -17,6 +17,7 @@
 # Boston, MA 02111-1307, USA.
 
 import os
+import shutil
 import sys
 import tempfile
 import unittest
@@ -91,6 +92,10 @@ class LinuxPackagesTest(unittest.TestCase):
                  'use_ccache': None,
                  'force_git_commit': None,
                  'universal_archs': [cconfig.Architecture.X86, cconfig.Architecture.X86_64],
+                 'logs': None,
+                 'artifacts_cache': None,
+                 'artifacts_cache_size': None,
+                 'artifacts_remote': None,
                  }
         self.assertEquals(sorted(config._properties), sorted(props.keys()))
         for p, v in props.iteritems():
@@ -203,3 +208,87 @@ class LinuxPackagesTest(unittest.TestCase):
                     'test1': ('/path/to/repo', 1),
                     'test2': ('/path/to/other/repo', 2)}
         self.assertEquals(config.get_packages_repos(), expected)
+
+    def testSetupEnvCache(self):
+        config = Config()
+        tmpdir = tempfile.mkdtemp()
+        config.load_defaults()
+        config.prefix = tmpdir
+        config.build_tools_prefix = os.path.join(tmpdir, 'build-tools')
+        calls = []
+        get_env = config.get_env
+
+        def counting_get_env(*args):
+            calls.append(args)
+            return get_env(*args)
+        config.get_env = counting_get_env
+
+        config.do_setup_env()
+        os.environ['PATH'] = 'modified'
+        config.do_setup_env()
+        self.assertEquals(len(calls), 1)
+        self.assertEquals(os.environ['PATH'], config.env['PATH'])
+        self.assertEquals(os.environ['GSTREAMER_SDK_ROOT'], tmpdir)
+        config.prefix = os.path.join(tmpdir, 'other')
+        config.do_setup_env()
+        self.assertEquals(len(calls), 2)
+        self.assertEquals(os.environ['GSTREAMER_SDK_ROOT'], config.prefix)
+        # A new base environment invalidates the cache
+        config._raw_environ = os.environ.copy()
+        config.do_setup_env()
+        self.assertEquals(len(calls), 3)
+        config._restore_environment()
+        shutil.rmtree(tmpdir)
+
+    def testCompilerCacheEnv(self):
+        config = Config()
+        tmpdir = tempfile.mkdtemp()
+        config.load_defaults()
+        config.home_dir = tmpdir
+        config._load_last_defaults()
+        config.build_tools_prefix = os.path.join(tmpdir, 'build-tools')
+        config.do_setup_env()
+        self.assertFalse('CCACHE_DIR' in config.env)
+        config.use_ccache = True
+        config._env_cache = None
+        config.do_setup_env()
+        self.assertEquals(config.env['CCACHE_DIR'],
+            os.path.join(tmpdir, 'ccache', '%s_%s' %
+                         (config.target_platform, config.target_arch)))
+        # Variables of the build are kept when the environment is set again
+        config.set_build_env('CCACHE_STATSLOG', 'log')
+        config.do_setup_env()
+        self.assertEquals(os.environ['CCACHE_STATSLOG'], 'log')
+        config.set_build_env('CCACHE_STATSLOG', None)
+        config.do_setup_env()
+        self.assertFalse('CCACHE_STATSLOG' in os.environ)
+        config._restore_environment()
+        shutil.rmtree(tmpdir)
+
+    def testProbeTool(self):
+        tmpdir = tempfile.mkdtemp()
+        cache_file = os.path.join(tmpdir, 'host-facts.cache')
+        probes = []
+
+        def probe():
+            probes.append(1)
+            return '5.014002'
+
+        cconfig._host_facts = None
+        try:
+            for i in range(2):
+                self.assertEquals(cconfig.probe_tool('sh', probe,
+                                                     cache_file), '5.014002')
+            self.assertEquals(len(probes), 1)
+            # A new process reads it from the cache
+            cconfig._host_facts = None
+            self.assertEquals(cconfig.probe_tool('sh', probe, cache_file),
+                              '5.014002')
+            self.assertEquals(len(probes), 1)
+            # Tools that can't be found are always probed
+            cconfig.probe_tool('cerbero-missing-tool', probe, cache_file)
+            cconfig.probe_tool('cerbero-missing-tool', probe, cache_file)
+            self.assertEquals(len(probes), 3)
+        finally:
+            cconfig._host_facts = None
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,44 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import unittest
+
+from cerbero.utils import url_host
+
+
+class UrlHostTest(unittest.TestCase):
+
+    def testUrls(self):
+        self.assertEquals(url_host('git://anongit.freedesktop.org/gst.git'),
+                          'anongit.freedesktop.org')
+        self.assertEquals(url_host('http://ftp.gnome.org:80/pub/a.tar.xz'),
+                          'ftp.gnome.org')
+        self.assertEquals(url_host('ssh://user@host.org/repo.git'),
+                          'host.org')
+
+    def testScpLikeSyntax(self):
+        self.assertEquals(url_host('git@github.com:gstreamer/gst.git'),
+                          'github.com')
+        self.assertEquals(url_host('github.com:gstreamer/gst.git'),
+                          'github.com')
+
+    def testLocalPaths(self):
+        self.assertEquals(url_host('/srv/git/gst.git'), '')
+        self.assertEquals(url_host('file:///srv/git/gst.git'), '')
+        self.assertEquals(url_host('C:/git/gst.git'), '')
+        self.assertEquals(url_host(None), '')
@@ -0,0 +1,227 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+import SocketServer
+
+from cerbero.errors import FatalError
+from cerbero.utils import download
+from cerbero.utils.download import Downloader, PART_SUFFIX, \
+    VALIDATOR_SUFFIX
+
+
+FILES = {'/a.tar.xz': 'a' * 200000, '/b.tar.xz': 'b' * 100,
+         '/c.tar.xz': 'c' * 1000}
+ETAG = '"v1"'
+
+
+class Handler (BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('Range')))
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/a.tar.xz')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path not in FILES:
+            self.send_error(404)
+            return
+        data = FILES[self.path]
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range') or '')
+        if self.headers.get('If-Range') not in [None, ETAG]:
+            # The file changed, the range is ignored
+            match = None
+        if match:
+            offset = int(match.group(1))
+            if offset >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (offset, len(data) - 1, len(data)))
+            data = data[offset:]
+        else:
+            self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server (SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.requests = []
+        self.connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        SocketServer.ThreadingMixIn.process_request(self, request,
+                                                    client_address)
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class DownloaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.server = Server()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.downloader = Downloader()
+
+    def tearDown(self):
+        self.downloader.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def _path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def testDownload(self):
+        path = self._path('a.tar.xz')
+        digest = self.downloader.download(self.base_url + '/a.tar.xz', path)
+        self.assertEquals(digest, sha256(FILES['/a.tar.xz']))
+        self.assertEquals(self._read(path), FILES['/a.tar.xz'])
+        self.assertFalse(os.path.exists(path + PART_SUFFIX))
+
+    def testChecksum(self):
+        path = self._path('b.tar.xz')
+        self.downloader.download(self.base_url + '/b.tar.xz', path,
+                                 sha256(FILES['/b.tar.xz']))
+        self.assertRaises(FatalError, self.downloader.download,
+                          self.base_url + '/c.tar.xz', self._path('c'),
+                          sha256('wrong'))
+        self.assertFalse(os.path.exists(self._path('c')))
+        self.assertFalse(os.path.exists(self._path('c') + PART_SUFFIX))
+
+    def testKeepAlive(self):
+        for name in FILES:
+            self.downloader.download(self.base_url + name, self._path(name[1:]))
+        self.assertEquals(self.server.connections, 1)
+
+    def _write_part(self, path, data, validator=None):
+        with open(path + PART_SUFFIX, 'wb') as f:
+            f.write(data)
+        if validator is not None:
+            with open(path + VALIDATOR_SUFFIX, 'w') as f:
+                f.write(validator)
+
+    def testResume(self):
+        path = self._path('a.tar.xz')
+        self._write_part(path, FILES['/a.tar.xz'][:1000], ETAG)
+        digest = self.downloader.download(self.base_url + '/a.tar.xz', path)
+        self.assertEquals(digest, sha256(FILES['/a.tar.xz']))
+        self.assertEquals(self._read(path), FILES['/a.tar.xz'])
+        self.assertEquals(self.server.requests,
+                          [('/a.tar.xz', 'bytes=1000-')])
+        self.assertFalse(os.path.exists(path + VALIDATOR_SUFFIX))
+
+    def testResumeInvalidPart(self):
+        path = self._path('b.tar.xz')
+        self._write_part(path, 'x' * 1000, ETAG)
+        self.downloader.download(self.base_url + '/b.tar.xz', path)
+        self.assertEquals(self._read(path), FILES['/b.tar.xz'])
+
+    def testResumeChangedFile(self):
+        path = self._path('a.tar.xz')
+        self._write_part(path, 'x' * 1000, '"v0"')
+        digest = self.downloader.download(self.base_url + '/a.tar.xz', path)
+        self.assertEquals(digest, sha256(FILES['/a.tar.xz']))
+        self.assertEquals(self._read(path), FILES['/a.tar.xz'])
+
+    def testPartWithoutValidator(self):
+        path = self._path('a.tar.xz')
+        self._write_part(path, 'x' * 1000)
+        self.downloader.download(self.base_url + '/a.tar.xz', path)
+        self.assertEquals(self._read(path), FILES['/a.tar.xz'])
+        # the version of the .part file is unknown, it's not resumed
+        self.assertEquals(self.server.requests, [('/a.tar.xz', None)])
+
+    def testDownloadAll(self):
+        downloads = [(self.base_url + x, self._path(x[1:]), sha256(y))
+                     for x, y in FILES.iteritems()]
+        digests = self.downloader.download_all(downloads, jobs=3)
+        self.assertEquals(digests, dict([(x[1], x[2]) for x in downloads]))
+        for name, data in FILES.iteritems():
+            self.assertEquals(self._read(self._path(name[1:])), data)
+        downloads.append((self.base_url + '/missing', self._path('missing'),
+                          None))
+        self.assertRaises(FatalError, self.downloader.download_all,
+                          downloads, jobs=2)
+        self.assertFalse(os.path.exists(self._path('missing')))
+
+    def testRedirect(self):
+        path = self._path('a.tar.xz')
+        self.downloader.download(self.base_url + '/redirect', path)
+        self.assertEquals(self._read(path), FILES['/a.tar.xz'])
+
+    def testNotFound(self):
+        path = self._path('missing')
+        self.assertRaises(FatalError, self.downloader.download,
+                          self.base_url + '/missing', path)
+        self.assertFalse(os.path.exists(path))
+
+
+class LinkFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testLinkFile(self):
+        src = os.path.join(self.tmp, 'src.tar.xz')
+        dest = os.path.join(self.tmp, 'dest.tar.xz')
+        with open(src, 'w') as f:
+            f.write('data')
+        with open(dest, 'w') as f:
+            f.write('old')
+        download.link_file(src, dest)
+        with open(dest) as f:
+            self.assertEquals(f.read(), 'data')
@@ -0,0 +1,249 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from cerbero.build import source
+from cerbero.enums import FetchPolicy
+from cerbero.errors import FatalError
+from cerbero.utils import git, shell
+
+
+GIT_ENV = {'GIT_AUTHOR_NAME': 'Test', 'GIT_AUTHOR_EMAIL': 'test@test.org',
+           'GIT_COMMITTER_NAME': 'Test',
+           'GIT_COMMITTER_EMAIL': 'test@test.org'}
+
+
+class GitTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self._environ = os.environ.copy()
+        os.environ.update(GIT_ENV)
+        self.upstream = os.path.join(self.tmp, 'upstream')
+        git.init(self.upstream)
+        self.commits = [self._commit('1.0'), self._commit('2.0')]
+        shell.call('git tag -a -m "release" v1.0 %s' % self.commits[0],
+                   self.upstream)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environ)
+        shutil.rmtree(self.tmp)
+
+    def _commit(self, version):
+        with open(os.path.join(self.upstream, 'VERSION'), 'w') as f:
+            f.write(version)
+        shell.call('git add VERSION', self.upstream)
+        shell.call('git commit -q -m "Release %s"' % version, self.upstream)
+        return git.resolve(self.upstream, 'HEAD')
+
+    def _checkout_dir(self):
+        checkout_dir = os.path.join(self.tmp, 'build')
+        if os.path.exists(checkout_dir):
+            shutil.rmtree(checkout_dir)
+        os.mkdir(checkout_dir)
+        return checkout_dir
+
+    def _read_version(self, git_dir):
+        with open(os.path.join(git_dir, 'VERSION')) as f:
+            return f.read()
+
+
+class GitTest(GitTestCase):
+
+    def testResolve(self):
+        self.assertEquals(git.resolve(self.upstream, 'v1.0'),
+                          self.commits[0])
+        self.assertEquals(git.resolve(self.upstream, 'HEAD'),
+                          self.commits[1])
+        self.assertEquals(git.resolve(self.upstream, 'missing', fail=False),
+                          None)
+        self.assertRaises(FatalError, git.resolve, self.upstream, 'missing')
+
+    def testSharedCheckout(self):
+        checkout_dir = self._checkout_dir()
+        git.local_checkout(checkout_dir, self.upstream, 'v1.0')
+        self.assertEquals(git.resolve(checkout_dir, 'HEAD'), self.commits[0])
+        self.assertEquals(self._read_version(checkout_dir), '1.0')
+        # The objects are not copied
+        self.assertTrue(os.path.exists(os.path.join(checkout_dir, '.git',
+            'objects', 'info', 'alternates')))
+        # and the source repository is left untouched
+        self.assertEquals(self._read_version(self.upstream), '2.0')
+
+    def testCheckout(self):
+        checkout_dir = self._checkout_dir()
+        git.local_checkout(checkout_dir, self.upstream, self.commits[0],
+                           shared=False)
+        self.assertEquals(git.resolve(checkout_dir, 'HEAD'), self.commits[0])
+        self.assertFalse(os.path.exists(os.path.join(checkout_dir, '.git',
+            'objects', 'info', 'alternates')))
+
+    def testCommitRefspec(self):
+        remotes = ['origin', 'upstream']
+        self.assertEquals(git.commit_refspec('upstream/sdk-1.0', remotes),
+            ('upstream', '+refs/heads/sdk-1.0:refs/remotes/upstream/sdk-1.0'))
+        self.assertEquals(git.commit_refspec(self.commits[0], remotes),
+                          ('origin', self.commits[0]))
+        self.assertEquals(git.commit_refspec('v1.0', remotes),
+                          ('origin', '+refs/tags/v1.0:refs/tags/v1.0'))
+        self.assertEquals(git.commit_refspec('release/1.0', remotes),
+            ('origin', '+refs/tags/release/1.0:refs/tags/release/1.0'))
+
+    def testSparseCheckout(self):
+        os.mkdir(os.path.join(self.upstream, 'src'))
+        with open(os.path.join(self.upstream, 'src', 'main.c'), 'w') as f:
+            f.write('int main() {}')
+        shell.call('git add src', self.upstream)
+        shell.call('git commit -q -m "Add sources"', self.upstream)
+        checkout_dir = self._checkout_dir()
+        git.local_checkout(checkout_dir, self.upstream, 'HEAD',
+                           sparse_paths=['/src/'])
+        self.assertEquals(os.listdir(os.path.join(checkout_dir, 'src')),
+                          ['main.c'])
+        self.assertFalse(os.path.exists(os.path.join(checkout_dir,
+                                                     'VERSION')))
+
+
+class Config(object):
+
+    def __init__(self, tmp, git_fetch_policy):
+        self.git_root = tmp
+        self.local_sources = os.path.join(tmp, 'local')
+        self.git_fetch_policy = git_fetch_policy
+        self.forced_commit = None
+
+    def recipe_commit(self, recipe_name):
+        return self.forced_commit
+
+
+class GitFetchTest(GitTestCase):
+
+    def _recipe(self, policy, commit):
+        recipe = source.Git.__new__(source.Git)
+        recipe.name = 'upstream'
+        recipe.version = '1.0'
+        recipe.config = Config(self.tmp, policy)
+        recipe.commit = commit
+        recipe.remotes = {'origin': 'file://%s' % self.upstream}
+        source.Git.__init__(recipe)
+        return recipe
+
+    def _count_commits(self, git_dir):
+        return len(shell.check_call('git rev-list --all',
+                                    git_dir).splitlines())
+
+    def testFull(self):
+        recipe = self._recipe(FetchPolicy.FULL, 'v1.0')
+        recipe.fetch()
+        self.assertEquals(git.resolve(recipe.repo_dir, 'origin/master'),
+                          self.commits[1])
+        self.assertEquals(self._read_version(recipe.repo_dir), '1.0')
+
+    def testShallow(self):
+        recipe = self._recipe(FetchPolicy.SHALLOW, 'origin/master')
+        recipe.fetch()
+        self.assertEquals(self._count_commits(recipe.repo_dir), 1)
+        self.assertEquals(self._read_version(recipe.repo_dir), '2.0')
+        self.assertEquals(recipe.built_version(),
+                          '1.0+git~%s\n' % self.commits[1])
+
+    def testShallowTag(self):
+        recipe = self._recipe(FetchPolicy.SHALLOW, 'v1.0')
+        recipe.fetch()
+        self.assertEquals(self._count_commits(recipe.repo_dir), 1)
+        self.assertEquals(git.resolve(recipe.repo_dir, 'v1.0'),
+                          self.commits[0])
+
+    def testShallowFallback(self):
+        # A short hash can't be fetched
+        recipe = self._recipe(FetchPolicy.SHALLOW, self.commits[0][:10])
+        recipe.fetch()
+        self.assertEquals(self._count_commits(recipe.repo_dir), 2)
+        self.assertEquals(self._read_version(recipe.repo_dir), '1.0')
+        recipe = self._recipe(FetchPolicy.SHALLOW, 'missing')
+        self.assertRaises(FatalError, recipe.fetch)
+
+    def testBlobless(self):
+        shell.call('git config uploadpack.allowFilter true', self.upstream)
+        recipe = self._recipe(FetchPolicy.BLOBLESS, 'origin/master')
+        recipe.git_sparse_paths = ['/VERSION']
+        recipe.fetch()
+        self.assertTrue(git.is_partial(recipe.repo_dir))
+        self.assertEquals(self._count_commits(recipe.repo_dir), 2)
+        self.assertEquals(self._read_version(recipe.repo_dir), '2.0')
+        recipe.build_dir = self._checkout_dir()
+        recipe.supports_non_src_build = False
+        shutil.rmtree(recipe.build_dir)
+        recipe.extract()
+        self.assertEquals(self._read_version(recipe.build_dir), '2.0')
+
+    def testMirrors(self):
+        mirrors = os.path.join(self.tmp, 'mirrors')
+        recipe = self._recipe(FetchPolicy.FULL, 'origin/master')
+        recipe.config.git_mirrors = mirrors
+        recipe.config.session_start = time.time()
+        recipe.fetch()
+        self.assertEquals(self._read_version(recipe.repo_dir), '2.0')
+        # The objects are in the mirror
+        mirror_dir = os.path.join(mirrors, 'local', self.upstream.strip('/')
+                                  + '.git')
+        with open(os.path.join(recipe.repo_dir, '.git', 'objects', 'info',
+                               'alternates')) as f:
+            self.assertEquals(f.read().splitlines(),
+                              [os.path.join(mirror_dir, 'objects')])
+        self.assertEquals(shell.check_call('git count-objects',
+            recipe.repo_dir).split()[0], '0')
+
+        # The mirror is fetched once in a build session
+        commit = self._commit('3.0')
+        twin = self._recipe(FetchPolicy.FULL, 'origin/master')
+        twin.name = 'upstream-static'
+        twin.repo_dir = os.path.join(twin.config.local_sources, twin.name)
+        twin.config.git_mirrors = mirrors
+        twin.config.session_start = recipe.config.session_start
+        twin.fetch()
+        self.assertEquals(self._read_version(twin.repo_dir), '2.0')
+        twin.config.session_start = time.time() + 1
+        twin.fetch()
+        self.assertEquals(git.resolve(twin.repo_dir, 'HEAD'), commit)
+        # and every time outside of build sessions
+        commit = self._commit('4.0')
+        twin.config.session_start = None
+        twin.fetch()
+        self.assertEquals(git.resolve(twin.repo_dir, 'HEAD'), commit)
+
+
+class MirrorNameTest(unittest.TestCase):
+
+    def testUrls(self):
+        name = 'anongit.freedesktop.org/gstreamer/gstreamer'
+        for url in ['git://anongit.freedesktop.org/gstreamer/gstreamer',
+                    'https://anongit.freedesktop.org/gstreamer/gstreamer.git',
+                    'ssh://user@anongit.freedesktop.org/gstreamer/gstreamer',
+                    'user@anongit.freedesktop.org:gstreamer/gstreamer.git']:
+            self.assertEquals(git.mirror_name(url), name)
+        self.assertEquals(git.mirror_name('/srv/git/gst.git'),
+                          'local/srv/git/gst')
+        self.assertEquals(git.mirror_name('file:///srv/git/gst.git'),
+                          'local/srv/git/gst')
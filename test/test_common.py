@@ -16,6 +16,9 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import os
+import time
+
 from cerbero.config import Platform, Distro, Architecture, DEFAULT_PACKAGER
 
 
@@ -37,6 +40,16 @@ class DummyConfig(object):
     packages_prefix = ''
     packager = DEFAULT_PACKAGER
     install_dir = ''
+    session_start = None
+
+    def set_build_env(self, name, value):
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+    def start_session(self):
+        self.session_start = time.time()
 
 
 class XMLMixin():
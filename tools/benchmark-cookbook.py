@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# Measures the time needed to load the cookbook with an empty (cold) and a
+# populated (warm) cache of compiled recipes.
+#
+# Usage: tools/benchmark-cookbook.py [-c config] [-n runs]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+os.environ['CERBERO_UNINSTALLED'] = '1'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def load_cookbook(config_file, cache_dir):
+    from cerbero.config import Config
+    from cerbero.build.codecache import CodeCache
+    from cerbero.build.cookbook import CookBook
+
+    config = Config()
+    config.load(config_file)
+    # don't touch the build status of the configuration
+    config.cache_file = os.path.join(cache_dir, 'status')
+    start = time.time()
+    cookbook = CookBook(config, code_cache=CodeCache(cache_dir))
+    return time.time() - start, len(cookbook.get_recipes_list())
+
+
+def run(config_file, cache_dir):
+    # Each load runs in a new process, like a cerbero invocation
+    cmd = [sys.executable, __file__, '--load', cache_dir]
+    if config_file:
+        cmd += ['-c', config_file]
+    output = subprocess.check_output(cmd)
+    elapsed, recipes = output.strip().split('\n')[-1].split()
+    return float(elapsed), int(recipes)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-c', '--config', default=None)
+    parser.add_option('-n', '--runs', type='int', default=5)
+    parser.add_option('--load', default=None)
+    options, args = parser.parse_args()
+
+    if options.load:
+        elapsed, recipes = load_cookbook(options.config, options.load)
+        print '%f %d' % (elapsed, recipes)
+        return
+
+    cold = []
+    warm = []
+    for i in range(options.runs):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            elapsed, recipes = run(options.config, cache_dir)
+            cold.append(elapsed)
+            warm.append(run(options.config, cache_dir)[0])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    print 'Loaded %d recipes, best of %d runs' % (recipes, options.runs)
+    print 'cold cache: %.3fs' % min(cold)
+    print 'warm cache: %.3fs' % min(warm)
+
+
+if __name__ == '__main__':
+    main()